@@ -0,0 +1,282 @@
+import os
+import sys
+import json
+import time
+import math
+import shutil
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import numpy as np
+import cv2
+
+import post_process
+import normals
+import mesh_cache
+import mesh_utils
+import depth_readout
+import rasterizer
+import photometric
+import pose_validator
+
+# benchmarks of the hot paths that run without blender
+#
+#   python benchmark.py                          # full run, writes benchmark.json
+#   python benchmark.py --quick -k normals       # small sizes, matching cases only
+#   python benchmark.py --baseline old.json      # flag cases slower than the baseline
+#
+# every case reports the median wall time over its repeats, throughput and the
+# peak python heap (numpy buffers included) measured with tracemalloc
+# pool cases only see the parent process heap
+
+repo_dir = os.path.dirname(os.path.abspath(__file__))
+
+RESOLUTIONS = [(240, 320), (480, 640), (1080, 1440)]
+DATASET_SIZES = [64, 512]
+QUICK_RESOLUTIONS = [(240, 320)]
+QUICK_DATASET_SIZES = [16]
+
+
+# smooth random depth maps in the 0-1 range written by get_depth
+
+def synthetic_depth(shape, rng) -> np.ndarray:
+    noise = rng.random(shape).astype(np.float32)
+    dmap = cv2.GaussianBlur(noise, (0, 0), max(shape) / 40)
+    dmap -= dmap.min()
+    dmap /= max(dmap.max(), 1e-6)
+    return dmap
+
+# runs fn repeats times and returns median seconds and peak heap in mb
+# the peak comes from one extra traced call so tracing does not skew the timings
+
+def measure(fn, repeats) -> tuple:
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return float(np.median(times)), peak / 2**20
+
+def record(results, name, seconds, items, unit, peak_mb) -> None:
+    results[name] = {'seconds': seconds,
+                     'throughput': items / seconds if seconds > 0 else math.inf,
+                     'unit': unit,
+                     'peak_mb': peak_mb}
+    print(f'{name:<48} {seconds * 1000:10.2f} ms {items / seconds:12.1f} {unit:<10} {peak_mb:8.1f} MB')
+
+def bench_normals(results, resolutions, repeats) -> None:
+    rng = np.random.default_rng(0)
+    for shape in resolutions:
+        dmap = synthetic_depth(shape, rng)
+        tag = f'{shape[1]}x{shape[0]}'
+
+        seconds, peak = measure(lambda: post_process.dmap2norm(dmap), repeats)
+        record(results, f'normals/dmap2norm/{tag}', seconds, 1, 'maps/s', peak)
+
+        engine = normals.NormalEngine(shape)
+        out = np.empty(shape + (3,), dtype=np.uint8)
+        seconds, peak = measure(lambda: engine.compute(dmap, out, uint8=True), repeats)
+        record(results, f'normals/engine_uint8/{tag}', seconds, 1, 'maps/s', peak)
+
+        stack = np.stack([dmap] * 8)
+        seconds, peak = measure(lambda: engine.compute_batch(stack, uint8=True), repeats)
+        record(results, f'normals/engine_batch8/{tag}', seconds, 8, 'maps/s', peak)
+
+# rgba pixels of a blender image, .pixels[:] as the reference readout copies them
+# and foreach_get as the bulk readout does
+
+class BenchPixels():
+    def __init__(self, values):
+        self.values = values
+
+    def __getitem__(self, idx):
+        return self.values.tolist()[idx]
+
+    def foreach_get(self, buffer) -> None:
+        buffer[:] = self.values
+
+class BenchImage():
+    def __init__(self, w, h, rng):
+        self.size = (w, h)
+        self.pixels = BenchPixels(rng.random(4 * w * h).astype(np.float32))
+
+# blender depth readout on a stand-in image, list based reference against bulk copy
+
+def bench_readout(results, resolutions, repeats) -> None:
+    rng = np.random.default_rng(4)
+    for shape in resolutions:
+        image = BenchImage(shape[1], shape[0], rng)
+        tag = f'{shape[1]}x{shape[0]}'
+
+        seconds, peak = measure(lambda: depth_readout.read_reference(image), repeats)
+        record(results, f'readout/reference/{tag}', seconds, 1, 'maps/s', peak)
+        seconds, peak = measure(lambda: depth_readout.read(image), repeats)
+        record(results, f'readout/bulk/{tag}', seconds, 1, 'maps/s', peak)
+
+# end to end post processing of a synthetic render directory
+
+def bench_post_process(results, resolutions, sizes, repeats) -> None:
+    rng = np.random.default_rng(1)
+    workers = os.cpu_count() or 1
+    for shape in resolutions:
+        for size in sizes:
+            root = tempfile.mkdtemp(prefix='gs_bench_')
+            try:
+                raw_depth_dir = os.path.join(root, 'sensor_0000', 'raw_data')
+                os.makedirs(raw_depth_dir)
+                dmap = synthetic_depth(shape, rng)
+                for idx in range(size):
+                    np.save(os.path.join(raw_depth_dir, '{0:04}.npy'.format(idx)), dmap)
+                tag = f'{shape[1]}x{shape[0]}/n{size}'
+
+                def full(workers):
+                    return lambda: post_process.run(post_process.collect_units(root, force=True), workers)
+
+                seconds, peak = measure(full(1), repeats)
+                record(results, f'post_process/serial/{tag}', seconds, size, 'samples/s', peak)
+                seconds, peak = measure(full(workers), repeats)
+                record(results, f'post_process/pool{workers}/{tag}', seconds, size, 'samples/s', peak)
+
+                # nothing to do on a re-run, measures the up to date checks
+                seconds, peak = measure(lambda: post_process.collect_units(root), repeats)
+                record(results, f'post_process/up_to_date/{tag}', seconds, size, 'samples/s', peak)
+            finally:
+                shutil.rmtree(root)
+
+def bench_viewer(results, resolutions, repeats) -> None:
+    try:
+        sys.path.insert(0, os.path.join(repo_dir, 'viewers'))
+        import render
+    except ImportError as e:
+        print(f'skipping viewer benchmarks: {e}')
+        return
+
+    rng = np.random.default_rng(2)
+    for shape in resolutions:
+        dmap = synthetic_depth(shape, rng)
+        tag = f'{shape[1]}x{shape[0]}'
+        for step in [1, 4]:
+            for trace in ['scatter', 'surface']:
+                seconds, peak = measure(lambda: render.build_figure(dmap, step, trace).to_json(), repeats)
+                record(results, f'viewer/{trace}_step{step}/{tag}', seconds, 1, 'figures/s', peak)
+
+# obj parsing and lowest point search on the meshes in meshes/
+
+def bench_meshes(results, repeats, quick) -> None:
+    names = mesh_cache.list_meshes(mesh_cache.mesh_dir)
+    if quick: names = names[:3]
+    rng = np.random.default_rng(3)
+
+    for name in names:
+        path = os.path.join(mesh_cache.mesh_dir, name + '.obj')
+        seconds, peak = measure(lambda: mesh_cache.parse_obj(path), max(1, repeats // 2))
+        record(results, f'mesh/parse_obj/{name}', seconds, 1, 'meshes/s', peak)
+
+        vertices = mesh_cache.to_blender_axes(mesh_cache.parse_obj(path)[0]).astype(np.float32)
+        angles = rng.uniform(0, 2 * np.pi, (32, 3))
+        matrices = [mesh_utils.euler_matrix(a) for a in angles]
+
+        def lowest(indices=None):
+            return lambda: [mesh_utils.lowest_points(vertices, mw, indices) for mw in matrices]
+
+        seconds, peak = measure(lowest(), repeats)
+        record(results, f'mesh/find_lowest/{name}', seconds, len(matrices), 'poses/s', peak)
+
+        hull = mesh_utils.hull_indices(vertices)
+        if hull is not None:
+            seconds, peak = measure(lowest(hull), repeats)
+            record(results, f'mesh/find_lowest_hull/{name}', seconds, len(matrices), 'poses/s', peak)
+
+# depth maps of random poses per mesh, as written by python rasterizer.py
+
+def bench_raster(results, resolutions, repeats, quick) -> None:
+    names = mesh_cache.list_meshes(mesh_cache.mesh_dir)
+    if quick: names = names[:3]
+    rng = np.random.default_rng(4)
+
+    for name in names:
+        vertices, faces, max_dim = rasterizer.get_mesh(name)
+        entries = [{'seed': int(rng.integers(2**31)), 'obj': name, 'size': rng.uniform(0.01, 0.05),
+                    'location': [rng.uniform(-0.007, 0.007), rng.uniform(-0.007, 0.007), rng.uniform(0.0006, 0.0018)],
+                    'rotation': rng.uniform(0, 2 * np.pi, 3).tolist()} for _ in range(8)]
+        worlds = [pose_validator.place_entry(vertices, max_dim, entry) for entry in entries]
+        for h, w in resolutions:
+            out = np.empty((h, w), dtype=np.float32)
+            seconds, peak = measure(lambda: [rasterizer.rasterize(world, faces, 40, 0.01, (w, h), out) for world in worlds], max(1, repeats // 2))
+            record(results, f'raster/{name}/{w}x{h}', seconds, len(worlds), 'maps/s', peak)
+
+# tactile images of a depth batch under several sensors at once
+
+def bench_photometric(results, resolutions, repeats, batch=8, sensors=4) -> None:
+    rng = np.random.default_rng(5)
+    for shape in resolutions:
+        dmaps = np.stack([synthetic_depth(shape, rng) for _ in range(batch)])
+        bases = rng.random((sensors,) + shape + (3,)).astype(np.float32)
+        responses = rng.normal(0, 0.1, (sensors, len(photometric.FEATURES), 3)).astype(np.float32)
+        seconds, peak = measure(lambda: photometric.render(dmaps, bases, responses), repeats)
+        record(results, f'photometric/render/{shape[1]}x{shape[0]}x{sensors}', seconds, batch * sensors, 'images/s', peak)
+
+# cases whose median time grew by more than threshold compared to a baseline
+
+def compare(results, baseline, threshold) -> list:
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline: continue
+        before = baseline[name]['seconds']
+        ratio = result['seconds'] / before if before > 0 else math.inf
+        if ratio > 1 + threshold: regressions.append((name, before, result['seconds'], ratio))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark post-processing, normal maps, depth readout, viewers, mesh handling, rasterization and photometric rendering.')
+    parser.add_argument('-o', '--output', default=os.path.join(repo_dir, 'benchmark.json'), help='result json path')
+    parser.add_argument('-b', '--baseline', default=None, help='result json of an earlier run to compare against')
+    parser.add_argument('-t', '--threshold', type=float, default=0.10, help='allowed slowdown before a case counts as regression')
+    parser.add_argument('-k', '--filter', default=None, help='only run cases whose group contains this string')
+    parser.add_argument('-r', '--repeats', type=int, default=5, help='repeats per case')
+    parser.add_argument('--quick', action='store_true', help='small resolutions and datasets only')
+    args = parser.parse_args()
+
+    resolutions = QUICK_RESOLUTIONS if args.quick else RESOLUTIONS
+    sizes = QUICK_DATASET_SIZES if args.quick else DATASET_SIZES
+    groups = {'normals': lambda r: bench_normals(r, resolutions, args.repeats),
+              'readout': lambda r: bench_readout(r, resolutions, args.repeats),
+              'post_process': lambda r: bench_post_process(r, resolutions, sizes, max(1, args.repeats // 2)),
+              'viewer': lambda r: bench_viewer(r, resolutions, args.repeats),
+              'mesh': lambda r: bench_meshes(r, args.repeats, args.quick),
+              'raster': lambda r: bench_raster(r, resolutions, args.repeats, args.quick),
+              'photometric': lambda r: bench_photometric(r, resolutions, args.repeats)}
+
+    results = {}
+    for group, run in groups.items():
+        if args.filter is not None and args.filter not in group: continue
+        run(results)
+
+    report = {'meta': {'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                       'python': platform.python_version(),
+                       'numpy': np.__version__,
+                       'opencv': cv2.__version__,
+                       'machine': platform.machine(),
+                       'cpus': os.cpu_count(),
+                       'quick': args.quick},
+              'results': results}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=1)
+    print(f'wrote {args.output}')
+
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold)
+        for name, before, after, ratio in regressions:
+            print(f'REGRESSION {name}: {before * 1000:.2f} ms -> {after * 1000:.2f} ms ({ratio:.2f}x)')
+        if len(regressions) > 0: sys.exit(1)
+        print('no regressions')
+    sys.exit(0)
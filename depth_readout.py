@@ -0,0 +1,49 @@
+import numpy as np
+
+# depth map readout of blender's 'Viewer Node' image, usable inside and outside
+# of blender. images only need .size (w, h) and .pixels with
+# foreach_get(buffer), so a plain numpy stand-in works for testing
+#
+# pixels are copied in bulk into a reused float32 rgba buffer instead of a
+# python list of 4 * w * h floats, and the flip and 1 - x inversion of the
+# red channel run as a single pass into a reused output array
+
+
+# rgba buffers and depth outputs by (w, h)
+_buffers = {}
+
+def get_buffers(size) -> tuple:
+    size = tuple(size)
+    if size not in _buffers:
+        w, h = size
+        _buffers[size] = (np.empty((h, w, 4), dtype=np.float32), np.empty((h, w), dtype=np.float32))
+    return _buffers[size]
+
+# rotating by 180 degrees then mirroring left-right only flips the rows
+
+def reorient(rgba, out=None) -> np.ndarray:
+    if out is None: out = np.empty(rgba.shape[:2], dtype=np.float32)
+    np.subtract(1, rgba[::-1, :, 0], out=out)
+    return out
+
+# depth map of an image, 1 - red channel upside down
+
+# copy: return a new array, otherwise the reused output that the next readout
+#       of the same size overwrites
+
+def read(image, copy=False) -> np.ndarray:
+    rgba, out = get_buffers(image.size)
+    image.pixels.foreach_get(rgba.ravel())
+    reorient(rgba, out)
+    return out.copy() if copy else out
+
+# original readout through a python list, kept as reference
+
+def read_reference(image) -> np.ndarray:
+    w, h = image.size
+    dmap = np.array(image.pixels[:], dtype=np.float32)
+    dmap = np.reshape(dmap, (h, w, 4))[:,:,0]
+    dmap = np.rot90(dmap, k=2)
+    dmap = np.fliplr(dmap)
+    dmap = 1 - dmap
+    return dmap
@@ -0,0 +1,250 @@
+import os
+import sys
+import json
+import argparse
+import threading
+import numpy as np
+
+# chunked, append-only depth map store, one per sensor directory
+# replaces one raw_data/XXXX.npy file per sample with a few large files
+#
+# sensor_XXXX/depth_store/
+#     meta.json                       shape, dtype and chunk size
+#     <segment>/chunk_XXXX.npy        (chunk, h, w) arrays, memory mappable
+#     <segment>/index.i64             sample index of every written slot
+#     <segment>/times.f64             mtime of every written slot
+#
+# every writer (shard) appends to its own segment, readers merge all segments
+# in name order and the last slot written for a sample wins. a chunk's mtime
+# changes with every append, so the age of a sample is its slot's own time
+
+STORE_NAME = 'depth_store'
+META_NAME = 'meta.json'
+INDEX_NAME = 'index.i64'
+TIMES_NAME = 'times.f64'
+CHUNK_SIZE = 1024
+
+
+def get_store_dir(sensor_dir) -> str:
+    return os.path.join(sensor_dir, STORE_NAME)
+
+def exists(sensor_dir) -> bool:
+    return os.path.exists(os.path.join(get_store_dir(sensor_dir), META_NAME))
+
+def chunk_path(segment_dir, chunk_idx) -> str:
+    return os.path.join(segment_dir, 'chunk_{0:04}.npy'.format(chunk_idx))
+
+def load_meta(store_dir) -> dict:
+    with open(os.path.join(store_dir, META_NAME), 'r') as f:
+        return json.load(f)
+
+# creates meta.json on first use, or checks that it matches
+# writers of every shard may create it at once, each through its own tmp file
+
+def init_meta(store_dir, shape, dtype, chunk) -> dict:
+    path = os.path.join(store_dir, META_NAME)
+    if os.path.exists(path):
+        meta = load_meta(store_dir)
+        assert tuple(meta['shape']) == tuple(shape), f"Depth map shape {shape} does not match store {meta['shape']}"
+        return meta
+
+    os.makedirs(store_dir, exist_ok=True)
+    meta = {'shape': list(shape), 'dtype': np.dtype(dtype).name, 'chunk': chunk}
+    tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp, path)
+    return meta
+
+class DepthStoreWriter():
+    def __init__(self, sensor_dir, segment, dtype='float32', chunk=CHUNK_SIZE, sync=False):
+        self.store_dir = get_store_dir(sensor_dir)
+        self.segment_dir = os.path.join(self.store_dir, segment)
+        self.dtype = dtype
+        self.chunk = chunk
+        self.sync = sync
+        self.meta = None
+        self.chunk_idx = None
+        self.chunk_data = None
+
+        os.makedirs(self.segment_dir, exist_ok=True)
+        index_path = os.path.join(self.segment_dir, INDEX_NAME)
+        self.index = open(index_path, 'ab')
+
+        # drop a torn entry left by a crash mid-append
+        size = os.path.getsize(index_path)
+        if size % 8 != 0:
+            self.index.truncate(size - size % 8)
+        self.count = size // 8
+
+        # one time per committed slot, segments from before the times file get
+        # their chunk's mtime, a time written without its index entry is dropped
+        times_path = os.path.join(self.segment_dir, TIMES_NAME)
+        self.times = open(times_path, 'ab')
+        timed = os.path.getsize(times_path) // 8
+        if timed > self.count or os.path.getsize(times_path) % 8 != 0:
+            self.times.truncate(min(timed, self.count) * 8)
+            timed = min(timed, self.count)
+        if timed < self.count:
+            chunk = load_meta(self.store_dir)['chunk']
+            mtimes = [os.path.getmtime(chunk_path(self.segment_dir, slot // chunk)) for slot in range(timed, self.count)]
+            self.times.write(np.array(mtimes, dtype=np.float64).tobytes())
+            self.times.flush()
+
+    def open_chunk(self, chunk_idx):
+        if self.chunk_idx == chunk_idx: return self.chunk_data
+        if self.chunk_data is not None: self.chunk_data.flush()
+
+        shape = (self.meta['chunk'],) + tuple(self.meta['shape'])
+        path = chunk_path(self.segment_dir, chunk_idx)
+        if os.path.exists(path):
+            self.chunk_data = np.load(path, mmap_mode='r+')
+        else:
+            self.chunk_data = np.lib.format.open_memmap(path, mode='w+', dtype=self.meta['dtype'], shape=shape)
+        self.chunk_idx = chunk_idx
+        return self.chunk_data
+
+    # writes a depth map into the next slot, then commits it in the index
+    # the slot's time is taken from the filesystem, so it compares with output mtimes
+
+    def append(self, sample, dmap) -> None:
+        if self.meta is None: self.meta = init_meta(self.store_dir, dmap.shape, self.dtype, self.chunk)
+
+        slot = self.count
+        data = self.open_chunk(slot // self.meta['chunk'])
+        data[slot % self.meta['chunk']] = dmap
+        data.flush()
+        path = chunk_path(self.segment_dir, slot // self.meta['chunk'])
+        os.utime(path)
+        self.times.write(np.float64(os.path.getmtime(path)).tobytes())
+        self.times.flush()
+
+        self.index.write(np.int64(sample).tobytes())
+        self.index.flush()
+        if self.sync: os.fsync(self.index.fileno())
+        self.count += 1
+
+    # makes every appended map durable, for callers batching their fsyncs
+
+    def flush(self) -> None:
+        if self.chunk_data is not None: self.chunk_data.flush()
+        self.times.flush()
+        os.fsync(self.times.fileno())
+        self.index.flush()
+        os.fsync(self.index.fileno())
+
+    def close(self) -> None:
+        if self.chunk_data is not None: self.chunk_data.flush()
+        self.chunk_data = None
+        self.times.close()
+        self.index.close()
+
+class DepthStore():
+    def __init__(self, sensor_dir):
+        self.store_dir = get_store_dir(sensor_dir)
+        self.meta = load_meta(self.store_dir)
+        self.chunk = self.meta['chunk']
+        self.slots = {}
+        self.times = {}
+        self.chunks = {}
+        # index bytes read per segment, to tell when the store grew
+        self.sizes = {}
+
+        segments = [d for d in os.listdir(self.store_dir) if os.path.isdir(os.path.join(self.store_dir, d))]
+        segments.sort()
+        for segment in segments:
+            segment_dir = os.path.join(self.store_dir, segment)
+            index_path = os.path.join(segment_dir, INDEX_NAME)
+            if not os.path.exists(index_path): continue
+            size = os.path.getsize(index_path) // 8
+            self.sizes[segment] = size * 8
+            index = np.fromfile(index_path, dtype=np.int64, count=size)
+            times_path = os.path.join(segment_dir, TIMES_NAME)
+            times = np.fromfile(times_path, dtype=np.float64, count=min(size, os.path.getsize(times_path) // 8)).tolist() if os.path.exists(times_path) else []
+            for slot, sample in enumerate(index.tolist()):
+                self.slots[sample] = (segment_dir, slot)
+                self.times[sample] = times[slot] if slot < len(times) else None
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    def __contains__(self, sample) -> bool:
+        return sample in self.slots
+
+    def samples(self) -> list:
+        return sorted(self.slots)
+
+    # whether a segment appended slots or appeared since the store was opened,
+    # a later slot may have rewritten a sample this store still maps to the old one
+
+    def grown(self) -> bool:
+        for segment in os.listdir(self.store_dir):
+            index_path = os.path.join(self.store_dir, segment, INDEX_NAME)
+            if not os.path.exists(index_path): continue
+            if os.path.getsize(index_path) // 8 * 8 != self.sizes.get(segment, 0): return True
+        return False
+
+    # file holding a sample
+
+    def source_path(self, sample) -> str:
+        segment_dir, slot = self.slots[sample]
+        return chunk_path(segment_dir, slot // self.chunk)
+
+    # time a sample was written, its chunk's mtime for segments without slot times
+
+    def mtime(self, sample) -> float:
+        if self.times[sample] is not None: return self.times[sample]
+        return os.path.getmtime(self.source_path(sample))
+
+    # zero-copy view of one depth map
+
+    def __getitem__(self, sample) -> np.ndarray:
+        segment_dir, slot = self.slots[sample]
+        key = (segment_dir, slot // self.chunk)
+        data = self.chunks.get(key)
+        if data is None:
+            data = np.load(chunk_path(segment_dir, slot // self.chunk), mmap_mode='r')
+            self.chunks[key] = data
+        return data[slot % self.chunk]
+
+# copies raw_data/*.npy of a sensor into its store, skipping samples already stored
+
+# returns: number of converted samples
+
+def convert_sensor(sensor_dir, dtype='float32', chunk=CHUNK_SIZE, remove=False) -> int:
+    raw_depth_dir = os.path.join(sensor_dir, 'raw_data')
+    if not os.path.isdir(raw_depth_dir): return 0
+    stored = DepthStore(sensor_dir) if exists(sensor_dir) else {}
+
+    raw_depths = [f for f in os.listdir(raw_depth_dir) if f.endswith('.npy') and f[:-4].isdigit()]
+    raw_depths.sort()
+    writer = DepthStoreWriter(sensor_dir, 'legacy', dtype=dtype, chunk=chunk)
+    count = 0
+    for raw in raw_depths:
+        sample = int(raw[:-4])
+        if sample in stored: continue
+        writer.append(sample, np.load(os.path.join(raw_depth_dir, raw)))
+        count += 1
+    writer.close()
+
+    if remove:
+        for raw in raw_depths: os.remove(os.path.join(raw_depth_dir, raw))
+    return count
+
+
+if __name__ == '__main__':
+    root_dir = os.environ.get('GELSIGHT_RENDER_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'renders'))
+
+    parser = argparse.ArgumentParser(description='Convert raw_data/*.npy depth maps into per-sensor chunked stores.')
+    parser.add_argument('--root', default=root_dir, help='render directory (default: GELSIGHT_RENDER_DIR or <repo>/renders)')
+    parser.add_argument('--dtype', default='float32', choices=['float32', 'float16'], help='storage precision')
+    parser.add_argument('--chunk', type=int, default=CHUNK_SIZE, help='depth maps per chunk file')
+    parser.add_argument('--remove', action='store_true', help='delete raw_data/*.npy after converting')
+    args = parser.parse_args()
+
+    sensor_dirs = [d for d in os.listdir(args.root) if d.startswith('sensor_') and os.path.isdir(os.path.join(args.root, d))]
+    sensor_dirs.sort()
+    for sensor in sensor_dirs:
+        count = convert_sensor(os.path.join(args.root, sensor), args.dtype, args.chunk, args.remove)
+        print(f'{sensor}: converted {count} depth maps')
+    sys.exit(0)
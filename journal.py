@@ -0,0 +1,119 @@
+import os
+import json
+import threading
+
+# append-only journal of finished render units, used to resume a run
+# each line is one json record, fsynced before the next unit starts
+#   {"kind": "calib", "sensor": 0, "index": 3}
+#   {"kind": "sample", "sensor": 0, "index": 12}
+#   {"kind": "pose", "index": 12, ...}     written ahead of a sample's renders
+# every writer (shard) appends to its own file inside <render_dir>/journal
+
+JOURNAL_DIR = 'journal'
+
+
+def get_journal_dir(render_dir) -> str:
+    return os.path.join(render_dir, JOURNAL_DIR)
+
+class Journal():
+    def __init__(self, render_dir, name):
+        journal_dir = get_journal_dir(render_dir)
+        os.makedirs(journal_dir, exist_ok=True)
+        self.path = os.path.join(journal_dir, f'{name}.jsonl')
+        self.file = open(self.path, 'a')
+        self.lock = threading.Lock()
+
+    # appends a record, by default making it durable before returning
+
+    def append(self, kind, index, sensor=None, sync=True, **data) -> None:
+        record = {'kind': kind, 'index': index}
+        if sensor is not None: record['sensor'] = sensor
+        record.update(data)
+        line = json.dumps(record) + '\n'
+        with self.lock:
+            self.file.write(line)
+            if sync: self.sync()
+
+    def sync(self) -> None:
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self) -> None:
+        with self.lock:
+            if not self.file.closed: self.file.close()
+
+# reads the records of one journal file
+# a torn last line from a crash mid-write is ignored
+
+def read_records(path) -> list:
+    records = []
+    with open(path, 'r') as f:
+        for line in f:
+            if not line.endswith('\n'): break
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    return records
+
+# state of a run recovered from all journal files of a render directory
+
+class JournalState():
+    def __init__(self):
+        self.done = set()
+        self.poses = {}
+
+    def add(self, record) -> None:
+        if record['kind'] == 'pose':
+            self.poses[record['index']] = record
+        else:
+            self.done.add((record['kind'], record['sensor'], record['index']))
+
+    def is_done(self, kind, sensor, index) -> bool:
+        return (kind, sensor, index) in self.done
+
+    # sensors still missing a sample
+
+    def missing_sensors(self, index, num_sensors) -> list:
+        return [s for s in range(num_sensors) if ('sample', s, index) not in self.done]
+
+def exists(render_dir) -> bool:
+    return os.path.isdir(get_journal_dir(render_dir))
+
+def load_state(render_dir) -> JournalState:
+    state = JournalState()
+    journal_dir = get_journal_dir(render_dir)
+    if not os.path.isdir(journal_dir): return state
+    names = [f for f in os.listdir(journal_dir) if f.endswith('.jsonl')]
+    names.sort()
+    for name in names:
+        for record in read_records(os.path.join(journal_dir, name)):
+            state.add(record)
+    return state
+
+# seeds a journal from the files of a render directory written before journaling
+# calibration images count individually, samples only when every sensor has
+# both the render and the depth map since the pose of a partial sample is lost
+
+def import_legacy(render_dir, num_sensors, num_samples) -> None:
+    journal = Journal(render_dir, 'legacy')
+    for sensor_idx in range(num_sensors):
+        calib_dir = os.path.join(render_dir, 'sensor_{0:04}'.format(sensor_idx), 'calibration')
+        if not os.path.isdir(calib_dir): continue
+        for name in sorted(os.listdir(calib_dir)):
+            if name.endswith('.png') and name[0:4].isdigit():
+                journal.append('calib', int(name[0:4]), sensor_idx, sync=False)
+
+    for sample_idx in range(num_samples):
+        complete = True
+        for sensor_idx in range(num_sensors):
+            sensor_dir = os.path.join(render_dir, 'sensor_{0:04}'.format(sensor_idx))
+            if not os.path.exists(os.path.join(sensor_dir, 'samples', '{0:04}.png'.format(sample_idx))) or \
+               not os.path.exists(os.path.join(sensor_dir, 'raw_data', '{0:04}.npy'.format(sample_idx))):
+                complete = False
+                break
+        if not complete: continue
+        for sensor_idx in range(num_sensors):
+            journal.append('sample', sample_idx, sensor_idx, sync=False)
+    journal.sync()
+    journal.close()
@@ -0,0 +1,200 @@
+import os
+import sys
+import zlib
+import struct
+import argparse
+import numpy as np
+
+import sensor_params
+
+# per emitter light passes and their linear recomposition, usable inside and
+# outside of blender
+#
+# with LIGHT_PASSES the generator renders every sample once per emitter with
+# only that emitter on, at unit strength and white, into linear .exr files,
+# reads them back and keeps them as one array per sample
+#   sensor_XXXX/passes/XXXX.npy           (4, h, w, 3) top, bottom, left, right
+# and composes the sample png as the weighted sum of the passes with the
+# sensor's emitter weights (sensor_params.emitter_weights), encoded like
+# blender's Standard view transform. any other colors and strengths of the
+# same geometry are then sums of the same four passes:
+#
+#   python light_passes.py validate            # compositions against direct renders in passes/check/
+#   python light_passes.py variants -n 8       # 8 new lightings per sensor into variants/VV/XXXX.png
+#
+# the first LIGHT_PASS_CHECK samples of every sensor are also rendered
+# directly for the validation, which reports the differences in 8 bit levels
+
+SIDES = ['top', 'bottom', 'left', 'right']
+
+PASS_DIR = 'passes'
+CHECK_DIR = 'check'
+VARIANT_DIR = 'variants'
+VARIANT_BANK = 'variants.npy'
+
+root_dir = os.environ.get('GELSIGHT_RENDER_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'renders'))
+
+
+def to_linear(image) -> np.ndarray:
+    return np.where(image <= 0.04045, image / 12.92, ((image + 0.055) / 1.055) ** 2.4).astype(np.float32)
+
+def to_srgb(image) -> np.ndarray:
+    image = np.clip(image, 0, 1)
+    return np.where(image <= 0.0031308, image * 12.92, 1.055 * image ** (1 / 2.4) - 0.055).astype(np.float32)
+
+# 8 bit srgb of linear images, the Standard view transform without dithering
+
+def encode(image) -> np.ndarray:
+    return (to_srgb(image) * 255 + 0.5).astype(np.uint8)
+
+# passes of a sample
+
+def pass_path(sensor_dir, name) -> str:
+    return os.path.join(sensor_dir, PASS_DIR, name + '.npy')
+
+# writes the passes of a sample under a temporary name first
+
+# dtype: storage precision, float16 keeps compositions within a level of float32
+
+def save_passes(path, passes, dtype='float16') -> None:
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        np.save(f, passes.astype(dtype))
+    os.replace(tmp, path)
+
+def load_passes(path) -> np.ndarray:
+    return np.load(path).astype(np.float32)
+
+# sensor parameters that change the passes, everything but emitter strengths and colors
+
+def geometry_params(params) -> dict:
+    return {key: value for key, value in params.items() if key != 'emittors'}
+
+# linear images as weighted sums of the passes
+
+# passes: (4, h, w, 3) linear unit strength passes in SIDES order
+# weights: (4, 3) or (v, 4, 3) emitter weights
+# returns: (h, w, 3) or (v, h, w, 3) float32
+
+def composite(passes, weights) -> np.ndarray:
+    weights = np.asarray(weights, dtype=np.float32)
+    if weights.ndim == 2: return np.einsum('kc,khwc->hwc', weights, passes)
+    return np.einsum('vkc,khwc->vhwc', weights, passes)
+
+# writes an (h, w, 3) uint8 image as png with zlib only, usable in blender's python
+
+def write_png(path, image) -> None:
+    h, w, _ = image.shape
+    rows = np.zeros((h, 1 + w * 3), dtype=np.uint8)
+    rows[:, 1:] = image.reshape(h, w * 3)
+
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+    png = (b'\x89PNG\r\n\x1a\n'
+           + chunk(b'IHDR', struct.pack('>IIBBBBB', w, h, 8, 2, 0, 0, 0))
+           + chunk(b'IDAT', zlib.compress(rows.tobytes(), 6))
+           + chunk(b'IEND', b''))
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(png)
+    os.replace(tmp, path)
+
+def read_png(path) -> np.ndarray:
+    import cv2
+    image = cv2.imread(path, cv2.IMREAD_COLOR)
+    if image is None: raise FileNotFoundError(path)
+    return image[:, :, ::-1]
+
+# samples of a sensor with stored passes
+
+def list_passes(sensor_dir) -> list:
+    pass_dir = os.path.join(sensor_dir, PASS_DIR)
+    if not os.path.isdir(pass_dir): return []
+    return sorted(f[:-4] for f in os.listdir(pass_dir) if f.endswith('.npy'))
+
+# compares compositions with the direct renders in passes/check/
+
+# returns: list of (sensor, sample, max, mean abs difference, fraction within 1 level)
+
+def validate(root, sensors=None) -> list:
+    bank = sensor_params.load_bank(root)
+    results = []
+    for sensor in sensor_params.list_sensor_dirs(root):
+        sensor_dir = os.path.join(root, sensor)
+        sensor_idx = int(sensor[len('sensor_'):])
+        if sensors is not None and sensor not in sensors and str(sensor_idx) not in sensors: continue
+        check_dir = os.path.join(sensor_dir, PASS_DIR, CHECK_DIR)
+        if not os.path.isdir(check_dir): continue
+
+        weights = sensor_params.emitter_weights(sensor_params.to_params(bank[sensor_idx]))
+        for name in sorted(f[:-4] for f in os.listdir(check_dir) if f.endswith('.png')):
+            path = pass_path(sensor_dir, name)
+            if not os.path.exists(path): continue
+            expected = read_png(os.path.join(check_dir, name + '.png')).astype(np.int16)
+            diff = np.abs(encode(composite(load_passes(path), weights)).astype(np.int16) - expected)
+            results.append((sensor, name, int(diff.max()), float(diff.mean()), float((diff <= 1).mean())))
+    return results
+
+# draws new emitter strengths and colors for a sensor, keeping its geometry
+
+# config: the constants of scripting.py, see plan.load_config
+# returns: bank rows of the variants
+
+def draw_variants(row, n, config, rng) -> np.ndarray:
+    variants = sensor_params.sample_bank(n, config, rng)
+    for field in sensor_params.SENSOR_DTYPE.names:
+        if field not in ('strength', 'color'): variants[field] = row[field]
+    return variants
+
+# composes every passed sample of a sensor under its variants
+
+# returns: number of written images
+
+def write_variants(sensor_dir, variants) -> int:
+    np.save(os.path.join(sensor_dir, VARIANT_BANK), variants)
+    weights = np.stack([sensor_params.emitter_weights(sensor_params.to_params(row)) for row in variants])
+    for variant_idx in range(len(variants)):
+        os.makedirs(os.path.join(sensor_dir, VARIANT_DIR, '{0:02}'.format(variant_idx)), exist_ok=True)
+
+    written = 0
+    for name in list_passes(sensor_dir):
+        images = encode(composite(load_passes(pass_path(sensor_dir, name)), weights))
+        for variant_idx, image in enumerate(images):
+            write_png(os.path.join(sensor_dir, VARIANT_DIR, '{0:02}'.format(variant_idx), name + '.png'), image)
+            written += 1
+    return written
+
+
+if __name__ == '__main__':
+    import plan
+
+    parser = argparse.ArgumentParser(description='Validate light pass compositions or compose new lighting variants.')
+    parser.add_argument('command', choices=['validate', 'variants'])
+    parser.add_argument('--root', default=root_dir, help='render directory (default: GELSIGHT_RENDER_DIR or <repo>/renders)')
+    parser.add_argument('-s', '--sensors', nargs='+', default=None, help='sensor names or indices (default: all)')
+    parser.add_argument('-n', '--num', type=int, default=8, help='lighting variants per sensor')
+    parser.add_argument('--seed', type=int, default=None, help='seed of the variant lightings')
+    args = parser.parse_args()
+
+    if args.command == 'validate':
+        results = validate(args.root, args.sensors)
+        for sensor, name, max_diff, mean_diff, within in results:
+            print(f'{sensor}/{name}: max {max_diff}, mean {mean_diff:.3f}, {within:.2%} within 1 level')
+        if len(results) == 0:
+            print('no direct renders to check against, set LIGHT_PASS_CHECK in scripting.py')
+            sys.exit(0)
+        worst = max(result[2] for result in results)
+        print(f'{len(results)} checks, worst pixel {worst} levels, mean {np.mean([r[3] for r in results]):.3f} levels')
+        sys.exit(0)
+
+    config = plan.load_config()
+    rng = np.random.default_rng(args.seed)
+    bank = sensor_params.load_bank(args.root)
+    for sensor in sensor_params.list_sensor_dirs(args.root):
+        sensor_dir = os.path.join(args.root, sensor)
+        sensor_idx = int(sensor[len('sensor_'):])
+        if args.sensors is not None and sensor not in args.sensors and str(sensor_idx) not in args.sensors: continue
+        written = write_variants(sensor_dir, draw_variants(bank[sensor_idx], args.num, config, rng))
+        print(f'{sensor}: {written} variant images')
+    sys.exit(0)
@@ -0,0 +1,132 @@
+import os
+import random
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import cv2
+
+import depth_store
+import sensor_params
+from normals import get_engine
+
+# dataset access to renders/sensor_XXXX/{samples,raw_data,dmaps,norms,calibration}
+#
+#   dataset = RenderDataset()
+#   item = dataset[10]                          # rgb, depth, normals, params
+#   for batch in dataset.iter_batches(32):      # stacked arrays
+#       ...
+#
+# png decode runs on a thread pool (cv2 releases the gil) and depth maps are
+# memory mapped, at most `prefetch` batches are held in memory at a time
+
+root_dir = os.environ.get('GELSIGHT_RENDER_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'renders'))
+
+COMPONENTS = ('rgb', 'depth', 'normals', 'params')
+
+
+def list_sensor_dirs(root) -> list:
+    sensor_dirs = [d for d in os.listdir(root) if d.startswith('sensor_') and os.path.isdir(os.path.join(root, d))]
+    sensor_dirs.sort()
+    return sensor_dirs
+
+def read_rgb(path) -> np.ndarray:
+    img = cv2.imread(path, cv2.IMREAD_COLOR)
+    assert img is not None, f"Unreadable image: {path}"
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+class RenderDataset():
+    # root: render directory
+    # sensors: optional list of sensor directory names
+    # components: subset of COMPONENTS to load per item
+
+    def __init__(self, root=root_dir, sensors=None, components=COMPONENTS):
+        self.root = root
+        self.components = tuple(components)
+        self.sensor_dirs = list_sensor_dirs(root) if sensors is None else list(sensors)
+        self.params = []
+        self.stores = []
+        self.items = []
+
+        bank = sensor_params.load_bank(root) if sensor_params.bank_exists(root) else None
+        for sensor_idx, sensor in enumerate(self.sensor_dirs):
+            sensor_dir = os.path.join(root, sensor)
+            self.params.append(sensor_params.load_sensor(root, int(sensor[len('sensor_'):]), bank))
+            self.stores.append(depth_store.DepthStore(sensor_dir) if depth_store.exists(sensor_dir) else None)
+
+            samples_dir = os.path.join(sensor_dir, 'samples')
+            names = [f[:-4] for f in os.listdir(samples_dir) if f.endswith('.png')]
+            names.sort()
+            self.items += [(sensor_idx, name) for name in names]
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def sensor_dir(self, sensor_idx) -> str:
+        return os.path.join(self.root, self.sensor_dirs[sensor_idx])
+
+    def calibration(self, sensor_idx) -> list:
+        calib_dir = os.path.join(self.sensor_dir(sensor_idx), 'calibration')
+        names = [f for f in os.listdir(calib_dir) if f.endswith('.png')]
+        names.sort()
+        return [read_rgb(os.path.join(calib_dir, name)) for name in names]
+
+    # memory mapped depth map from raw_data/*.npy or the sensor's depth store
+
+    def depth(self, sensor_idx, name) -> np.ndarray:
+        raw_dir = os.path.join(self.sensor_dir(sensor_idx), 'raw_data', name + '.npy')
+        if os.path.exists(raw_dir): return np.load(raw_dir, mmap_mode='r')
+        return self.stores[sensor_idx][int(name)]
+
+    # normals from norms/*.png, or computed from the depth map like post_process.py
+
+    def normals(self, sensor_idx, name) -> np.ndarray:
+        norm_dir = os.path.join(self.sensor_dir(sensor_idx), 'norms', name + '.png')
+        if os.path.exists(norm_dir): return read_rgb(norm_dir)
+        dmap = self.depth(sensor_idx, name)
+        norm = get_engine(dmap.shape).compute(dmap, uint8=True)
+        return norm[:, :, ::-1]
+
+    def __getitem__(self, idx) -> dict:
+        sensor_idx, name = self.items[idx]
+        item = {'sensor': sensor_idx, 'sample': int(name)}
+        if 'rgb' in self.components:
+            item['rgb'] = read_rgb(os.path.join(self.sensor_dir(sensor_idx), 'samples', name + '.png'))
+        if 'depth' in self.components:
+            item['depth'] = self.depth(sensor_idx, name)
+        if 'normals' in self.components:
+            item['normals'] = self.normals(sensor_idx, name)
+        if 'params' in self.components:
+            item['params'] = sensor_params.to_vector(self.params[sensor_idx])
+        return item
+
+    # stacks items into one batch, depth maps are copied out of their memory maps
+
+    def collate(self, items) -> dict:
+        return {key: np.stack([np.asarray(item[key]) for item in items]) for key in items[0]}
+
+    def load_batch(self, indices) -> dict:
+        return self.collate([self[idx] for idx in indices])
+
+    # yields batches of stacked arrays, shuffled across all sensors
+
+    # batch_size: items per batch
+    # shuffle: permute the item order every call
+    # seed: optional seed of the shuffle
+    # prefetch: batches decoded ahead, bounds memory use
+    # threads: decode threads
+    # drop_last: skip a final partial batch
+
+    def iter_batches(self, batch_size, shuffle=True, seed=None, prefetch=4, threads=4, drop_last=False):
+        order = list(range(len(self)))
+        if shuffle: random.Random(seed).shuffle(order)
+        batches = [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+        if drop_last and len(batches) > 0 and len(batches[-1]) < batch_size: batches.pop()
+
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            pending = deque()
+            for indices in batches:
+                pending.append([pool.submit(self.__getitem__, idx) for idx in indices])
+                if len(pending) > prefetch:
+                    yield self.collate([future.result() for future in pending.popleft()])
+            while pending:
+                yield self.collate([future.result() for future in pending.popleft()])
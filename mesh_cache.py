@@ -0,0 +1,178 @@
+import os
+import sys
+import json
+import hashlib
+import argparse
+import numpy as np
+
+import mesh_utils
+
+# parses meshes/*.obj once into compact .npz files so tools can read
+# vertices, faces and bounds without a text parse
+# entries are rebuilt only when the source mtime/size and hash change
+
+mesh_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'meshes')
+
+CACHE_NAME = '.cache'
+INDEX_NAME = 'index.json'
+
+
+def get_cache_dir(mesh_dir) -> str:
+    return os.path.join(mesh_dir, CACHE_NAME)
+
+# sorted mesh names (file stems) of all .obj files in mesh_dir
+
+def list_meshes(mesh_dir) -> list:
+    names = [f[:-4] for f in os.listdir(mesh_dir) if f.endswith('.obj') and os.path.isfile(os.path.join(mesh_dir, f))]
+    names.sort()
+    return names
+
+def file_hash(path) -> str:
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+# reads vertex positions and faces of an obj file
+# polygons are fan triangulated, texture/normal indices are dropped
+
+# returns: (N, 3) float32 vertices, (M, 3) int32 zero based triangle indices
+
+def parse_obj(path):
+    vertex_lines = []
+    faces = []
+    with open(path, 'r') as f:
+        for line in f:
+            if line.startswith('v '):
+                vertex_lines.append(line[2:])
+            elif line.startswith('f '):
+                face = [int(tok.split('/')[0]) for tok in line[2:].split()]
+                faces.append(face)
+
+    vertices = np.array(' '.join(vertex_lines).split(), dtype=np.float32).reshape(-1, 3)
+    n = len(vertices)
+
+    triangles = []
+    for face in faces:
+        face = [idx - 1 if idx > 0 else n + idx for idx in face]
+        for i in range(1, len(face) - 1):
+            triangles.append((face[0], face[i], face[i + 1]))
+    triangles = np.array(triangles, dtype=np.int32).reshape(-1, 3)
+    return vertices, triangles
+
+# converts obj coordinates (y up) into blender's default import axes (z up)
+
+def to_blender_axes(vertices) -> np.ndarray:
+    return np.stack((vertices[:, 0], -vertices[:, 2], vertices[:, 1]), axis=1)
+
+# parses one obj and writes its cache entry
+
+# returns: index metadata of the entry
+
+def build_entry(path, cache_dir, digest=None) -> dict:
+    name = os.path.basename(path)[:-4]
+    vertices, faces = parse_obj(path)
+    if digest is None: digest = file_hash(path)
+
+    bbox_min = vertices.min(axis=0)
+    bbox_max = vertices.max(axis=0)
+    hull = mesh_utils.hull_indices(vertices)
+    if hull is None: hull = np.arange(len(vertices))
+
+    stat = os.stat(path)
+    np.savez(os.path.join(cache_dir, name + '.npz'),
+             vertices=vertices,
+             faces=faces,
+             bbox_min=bbox_min,
+             bbox_max=bbox_max,
+             hull=hull.astype(np.int32))
+
+    return {'hash': digest,
+            'mtime': stat.st_mtime,
+            'size': stat.st_size,
+            'num_vertices': int(len(vertices)),
+            'num_faces': int(len(faces)),
+            'bbox_min': bbox_min.tolist(),
+            'bbox_max': bbox_max.tolist(),
+            'max_dim': float((bbox_max - bbox_min).max())}
+
+def load_index(mesh_dir) -> dict:
+    path = os.path.join(get_cache_dir(mesh_dir), INDEX_NAME)
+    if not os.path.exists(path): return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def save_index(mesh_dir, index) -> None:
+    path = os.path.join(get_cache_dir(mesh_dir), INDEX_NAME)
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(index, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+# brings the cache in line with mesh_dir, rebuilding only changed meshes
+
+# force: rebuild every entry
+
+def update_cache(mesh_dir, force=False, verbose=False) -> dict:
+    cache_dir = get_cache_dir(mesh_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+    index = load_index(mesh_dir)
+    names = list_meshes(mesh_dir)
+
+    for name in names:
+        path = os.path.join(mesh_dir, name + '.obj')
+        entry = index.get(name)
+        have_file = os.path.exists(os.path.join(cache_dir, name + '.npz'))
+        digest = None
+
+        if entry is not None and have_file and not force:
+            stat = os.stat(path)
+            if entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size: continue
+            digest = file_hash(path)
+            if entry['hash'] == digest:
+                entry['mtime'] = stat.st_mtime
+                continue
+
+        if verbose: print(f'caching {name}')
+        index[name] = build_entry(path, cache_dir, digest)
+
+    for name in list(index):
+        if name in names: continue
+        del index[name]
+        stale = os.path.join(cache_dir, name + '.npz')
+        if os.path.exists(stale): os.remove(stale)
+
+    save_index(mesh_dir, index)
+    return index
+
+# sha1 of a mesh file, from the index while it is current
+
+def mesh_hash(name, mesh_dir=mesh_dir) -> str:
+    path = os.path.join(mesh_dir, name + '.obj')
+    entry = load_index(mesh_dir).get(name)
+    if entry is not None:
+        stat = os.stat(path)
+        if entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size: return entry['hash']
+    return file_hash(path)
+
+# loads the cached arrays of one mesh, building the cache entry if needed
+
+# returns: dict with vertices, faces, bbox_min, bbox_max, hull
+
+def load_mesh(name, mesh_dir=mesh_dir) -> dict:
+    path = os.path.join(get_cache_dir(mesh_dir), name + '.npz')
+    if name not in load_index(mesh_dir) or not os.path.exists(path): update_cache(mesh_dir)
+    with np.load(path) as data:
+        return {key: data[key] for key in data.files}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Parse meshes/*.obj into a binary cache.')
+    parser.add_argument('--mesh-dir', default=mesh_dir, help='directory holding the .obj files')
+    parser.add_argument('-f', '--force', action='store_true', help='rebuild every cache entry')
+    args = parser.parse_args()
+
+    index = update_cache(args.mesh_dir, force=args.force, verbose=True)
+    print(f'{len(index)} meshes cached in {get_cache_dir(args.mesh_dir)}')
+    sys.exit(0)
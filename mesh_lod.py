@@ -0,0 +1,363 @@
+import os
+import sys
+import json
+import argparse
+import numpy as np
+
+import mesh_cache
+
+# offline level of detail variants of meshes/*.obj, pure numpy
+#
+#   python mesh_lod.py              # writes meshes/lod/<name>_lodK.obj and the error report
+#   python mesh_lod.py --report     # prints the report of existing lods
+#
+# meshes are simplified by quadric vertex clustering: vertices are binned into a
+# grid with cells of LOD_CELLS * the mesh's largest dimension, every cell
+# collapses into the point minimizing the summed squared distance to the planes
+# of its faces, and faces collapsing to an edge or point are dropped
+# every lod records its distance to the original surface relative to the
+# largest dimension, in both directions: original vertices to the lod, and
+# points sampled on every lod face (corners, edge midpoints, centroid) to the
+# original, which bounds lod surface bulging past the original, the part
+# that touches the gel first. max_error is the larger of the two (a sampled
+# symmetric hausdorff distance), so the generator can scale it by the sampled
+# object size and pick the coarsest lod whose error stays below a pixel
+
+LOD_NAME = 'lod'
+INDEX_NAME = 'index.json'
+
+# bump when the lods or their error report change, older index entries are rebuilt
+LOD_VERSION = 2
+
+# grid cell sizes relative to the largest mesh dimension, finest first
+LOD_CELLS = [1/1024, 1/512, 1/256, 1/128, 1/64]
+
+# levels must drop at least this fraction of the vertices of the previous level
+MIN_REDUCTION = 0.2
+
+
+def get_lod_dir(mesh_dir) -> str:
+    return os.path.join(mesh_dir, LOD_NAME)
+
+def lod_name(name, level) -> str:
+    return f'{name}_lod{level}'
+
+# obj file of a mesh or one of its lods
+
+def mesh_path(name, mesh_dir) -> str:
+    path = os.path.join(mesh_dir, name + '.obj')
+    if os.path.exists(path): return path
+    return os.path.join(get_lod_dir(mesh_dir), name + '.obj')
+
+# unit normals and areas of triangles, degenerate ones get a zero normal
+
+def face_planes(vertices, faces) -> tuple:
+    v = vertices.astype(np.float64)
+    cross = np.cross(v[faces[:, 1]] - v[faces[:, 0]], v[faces[:, 2]] - v[faces[:, 0]])
+    length = np.linalg.norm(cross, axis=1)
+    normals = np.divide(cross, length[:, None], out=np.zeros_like(cross), where=length[:, None] > 0)
+    return normals, length / 2
+
+# simplifies a mesh by clustering its vertices into cells of the given size
+
+# returns: (K, 3) float32 vertices, (L, 3) int32 faces, (N,) cluster of every original vertex
+
+def cluster_mesh(vertices, faces, cell) -> tuple:
+    v = vertices.astype(np.float64)
+    bins = np.floor((v - v.min(axis=0)) / cell).astype(np.int64)
+    _, cluster = np.unique(bins, axis=0, return_inverse=True)
+    cluster = cluster.reshape(-1)
+    k = cluster.max() + 1
+
+    # area weighted plane quadrics summed per cluster
+    normals, areas = face_planes(vertices, faces)
+    planes = np.concatenate((normals, -np.einsum('ij,ij->i', normals, v[faces[:, 0]])[:, None]), axis=1)
+    quadrics = areas[:, None, None] * planes[:, :, None] * planes[:, None, :]
+    q = np.zeros((k, 4, 4))
+    for corner in range(3):
+        np.add.at(q, cluster[faces[:, corner]], quadrics)
+
+    # fallback position: cluster centroid
+    counts = np.bincount(cluster, minlength=k)
+    mean = np.zeros((k, 3))
+    np.add.at(mean, cluster, v)
+    mean /= counts[:, None]
+
+    # minimize the quadric where its 3x3 part is well conditioned and the
+    # optimum stays near the cell, flat or thin clusters keep the centroid
+    a = q[:, :3, :3]
+    b = -q[:, :3, 3]
+    scale = np.trace(a, axis1=1, axis2=2) / 3
+    good = np.abs(np.linalg.det(a)) > 1e-3 * np.maximum(scale, 1e-30) ** 3
+    positions = mean.copy()
+    if good.any():
+        solved = np.linalg.solve(a[good], b[good][:, :, None])[:, :, 0]
+        near = np.abs(solved - mean[good]).max(axis=1) <= cell
+        idx = np.flatnonzero(good)[near]
+        positions[idx] = solved[near]
+
+    # drop collapsed and duplicate faces, then clusters without faces
+    new_faces = cluster[faces]
+    keep = (new_faces[:, 0] != new_faces[:, 1]) & (new_faces[:, 1] != new_faces[:, 2]) & (new_faces[:, 0] != new_faces[:, 2])
+    new_faces = new_faces[keep]
+    _, first = np.unique(np.sort(new_faces, axis=1), axis=0, return_index=True)
+    new_faces = new_faces[np.sort(first)]
+
+    used = np.zeros(k, dtype=bool)
+    used[new_faces.ravel()] = True
+    remap = np.cumsum(used) - 1
+    return positions[used].astype(np.float32), remap[new_faces].astype(np.int32), np.where(used[cluster], remap[cluster], -1)
+
+# distances of points p to triangles (a, b, c), all (N, 3)
+# closest point regions after Ericson, Real-Time Collision Detection 5.1.5
+
+def point_triangle_distance(p, a, b, c) -> np.ndarray:
+    ab, ac = b - a, c - a
+    ap, bp, cp = p - a, p - b, p - c
+    dot = lambda x, y: np.einsum('ij,ij->i', x, y)
+    d1, d2 = dot(ab, ap), dot(ac, ap)
+    d3, d4 = dot(ab, bp), dot(ac, bp)
+    d5, d6 = dot(ab, cp), dot(ac, cp)
+    va = d3 * d6 - d5 * d4
+    vb = d5 * d2 - d1 * d6
+    vc = d1 * d4 - d3 * d2
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # later regions take precedence, matching the order of the reference
+        denom = va + vb + vc
+        closest = a + ab * (vb / denom)[:, None] + ac * (vc / denom)[:, None]
+
+        region = (va <= 0) & (d4 - d3 >= 0) & (d5 - d6 >= 0)
+        w = (d4 - d3) / ((d4 - d3) + (d5 - d6))
+        closest = np.where(region[:, None], b + (c - b) * w[:, None], closest)
+
+        region = (vb <= 0) & (d2 >= 0) & (d6 <= 0)
+        w = d2 / (d2 - d6)
+        closest = np.where(region[:, None], a + ac * w[:, None], closest)
+
+        closest = np.where(((d6 >= 0) & (d5 <= d6))[:, None], c, closest)
+
+        region = (vc <= 0) & (d1 >= 0) & (d3 <= 0)
+        v = d1 / (d1 - d3)
+        closest = np.where(region[:, None], a + ab * v[:, None], closest)
+
+        closest = np.where(((d3 >= 0) & (d4 <= d3))[:, None], b, closest)
+        closest = np.where(((d1 <= 0) & (d2 <= 0))[:, None], a, closest)
+
+    dist = np.linalg.norm(p - closest, axis=1)
+
+    # degenerate triangles fall back to their nearest corner
+    bad = ~np.isfinite(dist)
+    if bad.any():
+        corners = np.stack((np.linalg.norm(ap[bad], axis=1), np.linalg.norm(bp[bad], axis=1), np.linalg.norm(cp[bad], axis=1)))
+        dist[bad] = corners.min(axis=0)
+    return dist
+
+# distance of every original vertex to the simplified surface, measured
+# against the faces around the vertex its cell collapsed into
+
+def lod_errors(vertices, lod_vertices, lod_faces, cluster) -> np.ndarray:
+    v = vertices.astype(np.float64)
+    lv = lod_vertices.astype(np.float64)
+    errors = np.full(len(v), np.inf)
+
+    # faces incident to every lod vertex
+    corner_vertex = lod_faces.ravel()
+    corner_face = np.repeat(np.arange(len(lod_faces)), 3)
+    order = np.argsort(corner_vertex, kind='stable')
+    incident = corner_face[order]
+    degree = np.bincount(corner_vertex, minlength=len(lv))
+    offsets = np.cumsum(degree) - degree
+
+    # (original vertex, incident face) pairs
+    mapped = np.flatnonzero(cluster >= 0)
+    counts = degree[cluster[mapped]]
+    pair_vertex = np.repeat(mapped, counts)
+    starts = np.repeat(offsets[cluster[mapped]], counts)
+    steps = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    pair_face = incident[starts + steps]
+
+    tri = lod_faces[pair_face]
+    dist = point_triangle_distance(v[pair_vertex], lv[tri[:, 0]], lv[tri[:, 1]], lv[tri[:, 2]])
+    np.minimum.at(errors, pair_vertex, dist)
+
+    # vertices whose cell lost all faces, e.g. thin parts, measured to the nearest lod vertex
+    lost = np.flatnonzero(~np.isfinite(errors))
+    for start in range(0, len(lost), 1024):
+        chunk = lost[start:start + 1024]
+        errors[chunk] = np.sqrt(((v[chunk, None, :] - lv[None, :, :]) ** 2).sum(axis=2).min(axis=1))
+    return errors
+
+# distance of points sampled on every lod face to the original surface,
+# measured against the original faces touching the cells of the face's corners
+# the candidates are a subset of all faces, so the distance is an upper bound
+
+# returns: (L * 7,) distances, 7 samples per lod face
+
+def lod_surface_errors(vertices, faces, lod_vertices, lod_faces, cluster) -> np.ndarray:
+    v = vertices.astype(np.float64)
+    lv = lod_vertices.astype(np.float64)
+
+    # original faces touching every lod vertex, deduplicated
+    corner_cluster = cluster[faces].ravel()
+    corner_face = np.repeat(np.arange(len(faces)), 3)
+    valid = corner_cluster >= 0
+    pairs = np.unique(np.stack((corner_cluster[valid], corner_face[valid]), axis=1), axis=0)
+    degree = np.bincount(pairs[:, 0], minlength=len(lv))
+    offsets = np.cumsum(degree) - degree
+    touching = pairs[:, 1]
+
+    # samples: corners, edge midpoints and centroid of every lod face
+    a, b, c = lv[lod_faces[:, 0]], lv[lod_faces[:, 1]], lv[lod_faces[:, 2]]
+    samples = np.stack((a, b, c, (a + b) / 2, (b + c) / 2, (c + a) / 2, (a + b + c) / 3), axis=1)
+    errors = np.full((len(lod_faces), 7), np.inf)
+
+    # candidate faces of a lod face, in chunks bounding the pair count
+    counts = degree[lod_faces].sum(axis=1)
+    start = 0
+    while start < len(lod_faces):
+        end = start + max(1, int(np.searchsorted(np.cumsum(counts[start:]), 1 << 18)))
+        chunk = np.arange(start, min(end, len(lod_faces)))
+        corners = lod_faces[chunk].ravel()
+        corner_counts = degree[corners]
+        pair_lod = np.repeat(np.repeat(chunk, 3), corner_counts)
+        steps = np.arange(corner_counts.sum()) - np.repeat(np.cumsum(corner_counts) - corner_counts, corner_counts)
+        pair_face = touching[np.repeat(offsets[corners], corner_counts) + steps]
+
+        tri = faces[pair_face]
+        for sample in range(7):
+            dist = point_triangle_distance(samples[pair_lod, sample], v[tri[:, 0]], v[tri[:, 1]], v[tri[:, 2]])
+            np.minimum.at(errors[:, sample], pair_lod, dist)
+        start = chunk[-1] + 1
+
+    # faces without candidates, measured to the nearest original vertex
+    errors = errors.ravel()
+    points = samples.reshape(-1, 3)
+    lost = np.flatnonzero(~np.isfinite(errors))
+    for start in range(0, len(lost), 1024):
+        chunk = lost[start:start + 1024]
+        errors[chunk] = np.sqrt(((points[chunk, None, :] - v[None, :, :]) ** 2).sum(axis=2).min(axis=1))
+    return errors
+
+# the object line names the blender object after the file, like the source meshes
+
+def write_obj(path, vertices, faces) -> None:
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(f'# {len(vertices)} vertices, {len(faces)} faces, written by mesh_lod.py\n')
+        f.write(f'o {os.path.basename(path)[:-4]}\n')
+        np.savetxt(f, vertices, fmt='v %.7g %.7g %.7g')
+        np.savetxt(f, faces + 1, fmt='f %d %d %d')
+    os.replace(tmp, path)
+
+# builds the lods of one mesh
+
+# returns: index entry with the error report of every level
+
+def build_lods(name, mesh_dir, cells=LOD_CELLS, verbose=False) -> dict:
+    mesh = mesh_cache.load_mesh(name, mesh_dir)
+    vertices, faces = mesh['vertices'], mesh['faces']
+    max_dim = float((vertices.max(axis=0) - vertices.min(axis=0)).max())
+    lod_dir = get_lod_dir(mesh_dir)
+    entry = {'hash': mesh_cache.mesh_hash(name, mesh_dir),
+             'version': LOD_VERSION,
+             'max_dim': max_dim,
+             'num_vertices': int(len(vertices)),
+             'num_faces': int(len(faces)),
+             'levels': []}
+
+    previous = len(vertices)
+    for cell in cells:
+        lod_vertices, lod_faces, cluster = cluster_mesh(vertices, faces, cell * max_dim)
+        if len(lod_faces) == 0 or len(lod_vertices) > (1 - MIN_REDUCTION) * previous: continue
+        previous = len(lod_vertices)
+
+        errors = lod_errors(vertices, lod_vertices, lod_faces, cluster) / max_dim
+        outward = lod_surface_errors(vertices, faces, lod_vertices, lod_faces, cluster) / max_dim
+        level = {'name': lod_name(name, len(entry['levels']) + 1),
+                 'cell': cell,
+                 'num_vertices': int(len(lod_vertices)),
+                 'num_faces': int(len(lod_faces)),
+                 'max_error': float(max(errors.max(), outward.max())),
+                 'lod_error': float(outward.max()),
+                 'mean_error': float(errors.mean()),
+                 'rms_error': float(np.sqrt((errors ** 2).mean()))}
+        write_obj(os.path.join(lod_dir, level['name'] + '.obj'), lod_vertices, lod_faces)
+        entry['levels'].append(level)
+        if verbose: print(f"  {level['name']}: {level['num_vertices']} vertices, max error {level['max_error']:.2e}")
+    return entry
+
+def load_index(mesh_dir) -> dict:
+    path = os.path.join(get_lod_dir(mesh_dir), INDEX_NAME)
+    if not os.path.exists(path): return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def save_index(mesh_dir, index) -> None:
+    path = os.path.join(get_lod_dir(mesh_dir), INDEX_NAME)
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(index, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+# builds lods of every mesh whose source changed since the last run
+
+# force: rebuild every mesh
+
+def update_lods(mesh_dir, force=False, verbose=False) -> dict:
+    os.makedirs(get_lod_dir(mesh_dir), exist_ok=True)
+    index = load_index(mesh_dir)
+    names = mesh_cache.list_meshes(mesh_dir)
+
+    for name in names:
+        entry = index.get(name)
+        if entry is not None and not force and entry.get('version') == LOD_VERSION and entry['hash'] == mesh_cache.mesh_hash(name, mesh_dir): continue
+        if verbose: print(f'simplifying {name}')
+        if entry is not None:
+            for level in entry['levels']:
+                stale = os.path.join(get_lod_dir(mesh_dir), level['name'] + '.obj')
+                if os.path.exists(stale): os.remove(stale)
+        index[name] = build_lods(name, mesh_dir, verbose=verbose)
+        save_index(mesh_dir, index)
+
+    for name in list(index):
+        if name not in names: del index[name]
+    save_index(mesh_dir, index)
+    return index
+
+# coarsest variant of a mesh whose max error at the given size stays below max_error
+
+# size: largest dimension of the placed object
+# max_error: allowed surface error in the same unit, e.g. a pixel footprint
+
+def select_lod(index, name, size, max_error) -> str:
+    entry = index.get(name)
+    if entry is None: return name
+    choice = name
+    for level in entry['levels']:
+        if level['max_error'] * size > max_error: break
+        choice = level['name']
+    return choice
+
+def print_report(index) -> None:
+    print(f"{'mesh':<28} {'vertices':>9} {'faces':>9} {'cell':>8} {'max err':>9} {'lod err':>9} {'mean err':>9} {'rms err':>9}")
+    for name, entry in sorted(index.items()):
+        print(f"{name:<28} {entry['num_vertices']:>9} {entry['num_faces']:>9}")
+        for level in entry['levels']:
+            print(f"  {level['name']:<26} {level['num_vertices']:>9} {level['num_faces']:>9} {level['cell']:>8.5f} "
+                  f"{level['max_error']:>9.2e} {level.get('lod_error', float('nan')):>9.2e} {level['mean_error']:>9.2e} {level['rms_error']:>9.2e}")
+    print('errors are relative to the largest mesh dimension, max err covers both directions,')
+    print('lod err only lod surface to original, mean and rms only original vertices to lod')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write simplified lod variants of meshes/*.obj with an error report.')
+    parser.add_argument('--mesh-dir', default=mesh_cache.mesh_dir, help='directory holding the .obj files')
+    parser.add_argument('-f', '--force', action='store_true', help='rebuild the lods of every mesh')
+    parser.add_argument('--report', action='store_true', help='only print the report of existing lods')
+    args = parser.parse_args()
+
+    if args.report: index = load_index(args.mesh_dir)
+    else: index = update_lods(args.mesh_dir, force=args.force, verbose=True)
+    print_report(index)
+    sys.exit(0)
@@ -0,0 +1,98 @@
+import numpy as np
+
+# numpy helpers for mesh vertex math, usable inside and outside of blender
+# objects only need .name, .matrix_world (4x4) and .data.vertices with
+# foreach_get('co', buffer), so a plain numpy stand-in works for testing
+
+try:
+    from scipy.spatial import ConvexHull
+except ImportError:
+    ConvexHull = None
+
+# object name -> (mesh key, vertices) and (mesh key, hull indices)
+_vertex_cache = {}
+_hull_cache = {}
+
+# identifies the mesh data block of an object, changes when the mesh is
+# replaced or its vertex count is edited. code editing coordinates in place
+# must call invalidate, moving or rotating an object only changes its matrix_world
+
+def mesh_key(obj) -> tuple:
+    mesh = obj.data
+    pointer = mesh.as_pointer() if hasattr(mesh, 'as_pointer') else id(mesh)
+    return (getattr(mesh, 'name', None), pointer, len(mesh.vertices))
+
+# drops cached vertices and hull of an object, or of all objects
+
+# name: string object name, None clears everything
+
+def invalidate(name=None) -> None:
+    if name is None:
+        _vertex_cache.clear()
+        _hull_cache.clear()
+    else:
+        _vertex_cache.pop(name, None)
+        _hull_cache.pop(name, None)
+
+# local vertex coordinates of an object as a contiguous (N, 3) float32 array
+# copied in bulk once per mesh, cached until its mesh key changes or invalidate
+
+def get_vertices(obj) -> np.ndarray:
+    key = mesh_key(obj)
+    cached = _vertex_cache.get(obj.name)
+    if cached is not None and cached[0] == key: return cached[1]
+
+    co = np.empty((len(obj.data.vertices), 3), dtype=np.float32)
+    obj.data.vertices.foreach_get('co', co.ravel())
+    _vertex_cache[obj.name] = (key, co)
+    _hull_cache.pop(obj.name, None)
+    return co
+
+# indices of the convex hull vertices of a point set
+# returns None when scipy is unavailable or the points are degenerate
+
+def hull_indices(co):
+    if ConvexHull is None or len(co) < 4: return None
+    try:
+        return np.sort(ConvexHull(co).vertices)
+    except Exception:
+        return None
+
+# cached convex hull indices of an object's vertices, None means use all
+
+def get_hull(obj):
+    key = mesh_key(obj)
+    cached = _hull_cache.get(obj.name)
+    if cached is not None and cached[0] == key: return cached[1]
+
+    hull = hull_indices(get_vertices(obj))
+    _hull_cache[obj.name] = (key, hull)
+    return hull
+
+# world space coordinates of all vertices sharing the minimum world z
+
+# co: (N, 3) local vertex coordinates
+# matrix_world: 4x4 matrix (mathutils.Matrix or array)
+# indices: optional vertex subset, e.g. the convex hull
+
+def lowest_points(co, matrix_world, indices=None) -> np.ndarray:
+    mw = np.asarray(matrix_world, dtype=np.float64)
+    if indices is not None: co = co[indices]
+
+    z = co @ mw[2, :3] + mw[2, 3]
+    lowest = co[z == z.min()]
+    return lowest @ mw[:3, :3].T + mw[:3, 3]
+
+# 4x4 world matrix of a blender XYZ euler rotation with optional scale and translation
+# scale: uniform float or per axis (sx, sy, sz) like an object's .scale
+
+def euler_matrix(angles, scale=1.0, location=(0, 0, 0)) -> np.ndarray:
+    cx, cy, cz = np.cos(angles)
+    sx, sy, sz = np.sin(angles)
+    rx = np.array([[1, 0, 0], [0, cx, -sx], [0, sx, cx]])
+    ry = np.array([[cy, 0, sy], [0, 1, 0], [-sy, 0, cy]])
+    rz = np.array([[cz, -sz, 0], [sz, cz, 0], [0, 0, 1]])
+    mw = np.eye(4)
+    mw[:3, :3] = rz @ ry @ rx * scale
+    mw[:3, 3] = location
+    return mw
@@ -0,0 +1,89 @@
+import threading
+import numpy as np
+import cv2
+
+# float32 normal map engine, a drop in replacement for post_process.dmap2norm
+# buffers are allocated once per depth map shape and reused for every map,
+# normalization happens in place and uint8 output skips the float copy
+#
+# accuracy against dmap2norm (float64 sobel) on 0-1 depth maps:
+#   float output: max abs difference below 1e-5
+#   uint8 output: identical except for rare pixels sitting on a quantization
+#                 step, which differ by at most 1
+
+
+class NormalEngine():
+    # shape: (h, w) of the depth maps
+    # ksize: sobel kernel size, 1, 3, 5 or 7
+
+    def __init__(self, shape, ksize=5):
+        self.shape = tuple(shape)
+        self.ksize = ksize
+        h, w = self.shape
+
+        self.src = np.empty((h, w), dtype=np.float32)
+        self.zx = np.empty((h, w), dtype=np.float32)
+        self.zy = np.empty((h, w), dtype=np.float32)
+        self.scale = np.empty((h, w), dtype=np.float32)
+        self.out = np.empty((h, w, 3), dtype=np.float32)
+
+    # normal map of one depth map, channels reversed (b, g, r) like dmap2norm
+
+    # out: optional (h, w, 3) float32 or uint8 array to write into
+    # uint8: return 0-255 values, matching post_process.py's png encoding
+
+    def compute(self, dmap, out=None, uint8=False) -> np.ndarray:
+        if dmap.dtype != np.float32:
+            np.copyto(self.src, dmap, casting='unsafe')
+            dmap = self.src
+
+        zx, zy, scale, normals = self.zx, self.zy, self.scale, self.out
+        cv2.Sobel(dmap, cv2.CV_32F, 1, 0, dst=zx, ksize=self.ksize)
+        cv2.Sobel(dmap, cv2.CV_32F, 0, 1, dst=zy, ksize=self.ksize)
+
+        # scale = 0.5 / |(-zx, -zy, 1)|
+        np.multiply(zx, zx, out=scale)
+        scale += 1
+        np.multiply(zy, zy, out=normals[:, :, 0])
+        scale += normals[:, :, 0]
+        np.sqrt(scale, out=scale)
+        np.divide(0.5, scale, out=scale)
+
+        # (n + 1) / 2 per channel, z first
+        np.add(scale, 0.5, out=normals[:, :, 0])
+        np.multiply(zy, scale, out=normals[:, :, 1])
+        np.subtract(0.5, normals[:, :, 1], out=normals[:, :, 1])
+        np.multiply(zx, scale, out=normals[:, :, 2])
+        np.subtract(0.5, normals[:, :, 2], out=normals[:, :, 2])
+
+        if uint8:
+            np.clip(normals, 0, 1, out=normals)
+            normals *= 255
+            if out is None: out = np.empty(normals.shape, dtype=np.uint8)
+            np.copyto(out, normals, casting='unsafe')
+            return out
+
+        if out is None: return normals.copy()
+        np.copyto(out, normals)
+        return out
+
+    # normal maps of a (b, h, w) stack of depth maps
+
+    # out: optional preallocated (b, h, w, 3) output
+
+    def compute_batch(self, dmaps, out=None, uint8=False) -> np.ndarray:
+        if out is None: out = np.empty(dmaps.shape + (3,), dtype=np.uint8 if uint8 else np.float32)
+        for idx in range(len(dmaps)):
+            self.compute(dmaps[idx], out[idx], uint8)
+        return out
+
+# engines by (shape, ksize), so callers can reuse buffers without keeping state
+# engines reuse their buffers, so every thread gets engines of its own
+_local = threading.local()
+
+def get_engine(shape, ksize=5) -> NormalEngine:
+    engines = getattr(_local, 'engines', None)
+    if engines is None: engines = _local.engines = {}
+    key = (tuple(shape), ksize)
+    if key not in engines: engines[key] = NormalEngine(shape, ksize)
+    return engines[key]
@@ -0,0 +1,125 @@
+import os
+import time
+import queue
+import threading
+
+# background writer for the outputs of the generation loop, usable outside of blender
+#
+#   output = OutputWriter(threads=2, syncs=[store.sync], commit=log.sync)
+#   output.submit(np.save, path, dmap, key=sensor_idx, paths=[path],
+#                 on_done=partial(log.append, 'sample', idx, sensor_idx, sync=False))
+#   ...
+#   output.close()      # drains the queues, syncs and raises a failed write
+#
+# tasks with the same key run in submission order on the same thread, every
+# thread has a bounded queue so submit blocks instead of buffering without limit
+#
+# fsyncs are batched: finished tasks wait until sync_every of them are pending
+# (or sync_interval seconds passed), then their paths are fsynced, the syncs
+# run, the on_done callbacks run and commit makes them durable. a unit is
+# therefore only journaled once its files are on disk
+
+
+class OutputWriter():
+    # threads: writer threads
+    # queue_size: tasks queued per thread before submit blocks
+    # sync_every: finished tasks per batched sync
+    # sync_interval: seconds after which finished tasks are synced regardless
+    # syncs: functions making written data durable, run before the callbacks
+    # commit: function run after the callbacks of a batch, e.g. Journal.sync
+
+    def __init__(self, threads=2, queue_size=8, sync_every=16, sync_interval=2.0, syncs=(), commit=None):
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.syncs = list(syncs)
+        self.commit = commit
+
+        self.error = None
+        self.pending = []
+        self.last_sync = time.monotonic()
+        self.lock = threading.Lock()
+        self.sync_lock = threading.Lock()
+
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in range(threads)]
+        self.threads = [threading.Thread(target=self.work, args=(q,), daemon=True) for q in self.queues]
+        for thread in self.threads: thread.start()
+
+    # queues fn(*args, **kwargs) on the thread of key
+
+    # key: tasks sharing a key keep their order, e.g. appends to one depth store
+    # paths: files fn writes, fsynced before on_done runs
+    # on_done: called without arguments once the task's outputs are durable
+
+    def submit(self, fn, *args, key=0, paths=(), on_done=None, **kwargs) -> None:
+        self.check()
+        self.queues[hash(key) % len(self.queues)].put((fn, args, kwargs, list(paths), on_done))
+
+    def work(self, tasks) -> None:
+        while True:
+            task = tasks.get()
+            try:
+                if task is None: return
+                fn, args, kwargs, paths, on_done = task
+                # after a failure the remaining tasks are dropped, the run restarts anyway
+                if self.error is not None: continue
+                try:
+                    fn(*args, **kwargs)
+                except BaseException as e:
+                    self.fail(e)
+                    continue
+                with self.lock:
+                    self.pending.append((paths, on_done))
+                    due = len(self.pending) >= self.sync_every or time.monotonic() - self.last_sync >= self.sync_interval
+                if due: self.sync()
+            finally:
+                tasks.task_done()
+
+    def fail(self, error) -> None:
+        with self.lock:
+            if self.error is None: self.error = error
+
+    # raises the first error of a writer thread in the calling thread
+
+    def check(self) -> None:
+        if self.error is not None:
+            raise RuntimeError(f'output writer failed: {self.error!r}') from self.error
+
+    # makes the outputs of all finished tasks durable and runs their callbacks
+
+    def sync(self) -> None:
+        with self.sync_lock:
+            with self.lock:
+                batch = self.pending
+                self.pending = []
+                self.last_sync = time.monotonic()
+            if len(batch) == 0: return
+            try:
+                for paths, _ in batch:
+                    for path in paths: fsync_path(path)
+                for sync in self.syncs: sync()
+                for _, on_done in batch:
+                    if on_done is not None: on_done()
+                if self.commit is not None: self.commit()
+            except BaseException as e:
+                self.fail(e)
+
+    # waits for every queued task, syncs them and raises a failed write
+
+    def flush(self) -> None:
+        for tasks in self.queues: tasks.join()
+        self.sync()
+        self.check()
+
+    def close(self) -> None:
+        try:
+            self.flush()
+        finally:
+            for tasks in self.queues: tasks.put(None)
+            for thread in self.threads: thread.join()
+
+def fsync_path(path) -> None:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
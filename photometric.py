@@ -0,0 +1,297 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import cv2
+
+import normals
+import light_passes
+import post_process
+import sensor_params
+
+# approximate tactile rgb renderer, numpy only, fitted against the blender renders
+#
+#   python photometric.py fit                                # per sensor and per light setup models
+#   python photometric.py render --depth-root renders/raster # samples/*.png for rasterized depth maps
+#
+# an image is modelled in linear light as the flat gel image plus a contact
+# response that is linear in features of the surface normal (computed like
+# post_process.dmap2norm) and the depth:
+#   image(p) = base(p) + features(p) @ response        features vanish on a flat gel
+# base is the sensor's flat render (calibration/0000, the indenter lifted off
+# the gel) and the (F, 3) response is fitted by least squares on the sensor's
+# sample renders and their depth maps. calibration/0001+ have no depth maps,
+# their indenters only exist in the .blend
+#
+# for parameter sets without renders, sensors sharing a light_type and angle
+# are decomposed into the four emitters: every sensor's base and response are
+#   ambient + sum_k weight_k * field_k      and      kappa + sum_k weight_k * theta_k
+# with weight_k = sensor_params.emitter_weights of the sensor,
+# so any strengths and colors can be rendered, the remaining parameters
+# (scale, roughness, smoothness, fov, length) take the average of the group
+
+FEATURES = ['nx', 'ny', 'nx2', 'ny2', 'nxny', 'nz', 'depth']
+
+MODEL_NAME = 'photometric.npz'
+
+# 8 bit values outside of this range are treated as clipped and left out of fits
+CLIPPED = (1 / 255, 254 / 255)
+
+
+# rgb image of a png as 0-1 floats (srgb encoded)
+
+def read_image(path) -> np.ndarray:
+    image = cv2.imread(path, cv2.IMREAD_COLOR)
+    if image is None: raise FileNotFoundError(path)
+    return image[:, :, ::-1].astype(np.float32) / 255
+
+def write_image(path, image) -> None:
+    light_passes.write_png(path, light_passes.encode(image))
+
+# contact features of a (b, h, w) stack of depth maps
+
+# returns: (b, h, w, F) float32, zero wherever the gel is flat
+
+def features(dmaps, ksize=5) -> np.ndarray:
+    dmaps = np.asarray(dmaps)
+    engine = normals.get_engine(dmaps.shape[1:], ksize)
+    encoded = engine.compute_batch(dmaps)
+
+    # dmap2norm channels are (nz, ny, nx) encoded as (n + 1) / 2
+    nz, ny, nx = (2 * encoded[..., 0] - 1, 2 * encoded[..., 1] - 1, 2 * encoded[..., 2] - 1)
+    out = np.empty(dmaps.shape + (len(FEATURES),), dtype=np.float32)
+    out[..., 0] = nx
+    out[..., 1] = ny
+    out[..., 2] = nx * nx
+    out[..., 3] = ny * ny
+    out[..., 4] = nx * ny
+    out[..., 5] = nz - 1
+    out[..., 6] = dmaps
+    return out
+
+# linear images of depth maps under several sensors at once
+
+# dmaps: (b, h, w) depth maps
+# bases: (s, h, w, 3) flat images of the sensors
+# responses: (s, F, 3) contact responses of the sensors
+# returns: (s, b, h, w, 3) float32 linear images
+
+def render(dmaps, bases, responses, ksize=5) -> np.ndarray:
+    phi = features(dmaps, ksize)
+    b, h, w, f = phi.shape
+    images = np.matmul(phi.reshape(-1, f), np.asarray(responses, dtype=np.float32))
+    images = images.reshape(len(bases), b, h, w, 3)
+    images += np.asarray(bases, dtype=np.float32)[:, None]
+    return images
+
+# samples of a sensor that have both a render and a depth map
+
+def list_pairs(sensor_dir) -> list:
+    return [name for name in post_process.list_samples(sensor_dir)
+            if os.path.exists(os.path.join(sensor_dir, 'samples', name + '.png'))]
+
+# fits the contact response of one sensor
+
+# names: samples to fit on
+# stride: pixel subsampling of the fit
+# returns: model dict with base, response and fit rmse
+
+def fit_sensor(sensor_dir, names, stride=4, ksize=5) -> dict:
+    ref = read_image(os.path.join(sensor_dir, 'calibration', '0000.png'))
+    base = light_passes.to_linear(ref)
+    rows, targets = [], []
+    for name in names:
+        image = read_image(os.path.join(sensor_dir, 'samples', name + '.png'))
+        phi = features(post_process.load_depth(sensor_dir, name)[None], ksize)[0]
+        phi = phi[::stride, ::stride].reshape(-1, len(FEATURES))
+        diff = (light_passes.to_linear(image) - base)[::stride, ::stride].reshape(-1, 3)
+
+        # contact pixels whose render and flat image are both unclipped
+        clipped = np.zeros(phi.shape[0], dtype=bool)
+        for img in [image, ref]:
+            img = img[::stride, ::stride].reshape(-1, 3)
+            clipped |= ((img <= CLIPPED[0]) | (img >= CLIPPED[1])).any(axis=1)
+        keep = (np.abs(phi).max(axis=1) > 1e-6) & ~clipped
+        rows.append(phi[keep])
+        targets.append(diff[keep])
+
+    rows, targets = np.concatenate(rows), np.concatenate(targets)
+    if len(rows) == 0: response = np.zeros((len(FEATURES), 3))
+    else: response = np.linalg.lstsq(rows.astype(np.float64), targets.astype(np.float64), rcond=None)[0]
+    rmse = float(np.sqrt(((rows @ response - targets) ** 2).mean())) if len(rows) > 0 else 0.0
+    return {'base': base, 'response': response.astype(np.float32), 'rmse': rmse, 'samples': len(names)}
+
+# rmse in 8 bit levels between rendered and blender images of a sensor
+
+def evaluate(sensor_dir, model, names, ksize=5) -> float:
+    errors = []
+    for name in names:
+        expected = read_image(os.path.join(sensor_dir, 'samples', name + '.png'))
+        dmap = post_process.load_depth(sensor_dir, name)
+        image = light_passes.to_srgb(render(dmap[None], model['base'][None], model['response'][None], ksize)[0, 0])
+        errors.append(((image - expected) ** 2).mean())
+    return float(np.sqrt(np.mean(errors)) * 255) if len(errors) > 0 else float('nan')
+
+def save_model(sensor_dir, model, params) -> None:
+    path = os.path.join(sensor_dir, MODEL_NAME)
+    tmp = path + '.tmp.npz'
+    np.savez(tmp, base=model['base'].astype(np.float32), response=model['response'],
+             rmse=model['rmse'], samples=model['samples'], params=sensor_params.to_vector(params))
+    os.replace(tmp, path)
+
+# model of a sensor, None if it was not fitted with these parameters
+
+def load_model(sensor_dir, params=None):
+    path = os.path.join(sensor_dir, MODEL_NAME)
+    if not os.path.exists(path): return None
+    with np.load(path) as data:
+        model = {key: data[key] for key in data.files}
+    if params is not None and not np.allclose(model['params'], sensor_params.to_vector(params)): return None
+    return model
+
+def group_key(params) -> str:
+    return f"{params['light_type']}_{params['angle']}"
+
+# decomposes fitted sensors of each light setup into per emitter fields and responses
+
+# models, params: fitted models and the parameters of their sensors
+# returns: dict group key -> dict of ambient (h, w, 3), fields (4, h, w), kappa (F, 3), theta (4, F)
+
+def fit_emitters(models, params, min_sensors=3) -> dict:
+    groups = {}
+    for model, p in zip(models, params):
+        groups.setdefault(group_key(p), []).append((model, p))
+
+    emitters = {}
+    for key, members in groups.items():
+        if len(members) < min_sensors: continue
+        h, w, _ = members[0][0]['base'].shape
+
+        # every sensor contributes one row per channel: 4 emitter weights, one hot channel
+        design, targets = [], []
+        for model, p in members:
+            weights = sensor_params.emitter_weights(p)
+            for c in range(3):
+                design.append(np.concatenate([weights[:, c], np.eye(3)[c]]))
+                targets.append(np.concatenate([model['base'][:, :, c].ravel(), model['response'][:, c]]))
+        solution = np.linalg.lstsq(np.array(design), np.array(targets, dtype=np.float64), rcond=None)[0]
+
+        emitters[key] = {'ambient': np.moveaxis(solution[4:, :h * w].reshape(3, h, w), 0, -1).astype(np.float32),
+                         'fields': solution[:4, :h * w].reshape(4, h, w).astype(np.float32),
+                         'kappa': solution[4:, h * w:].T.astype(np.float32),
+                         'theta': solution[:4, h * w:].astype(np.float32),
+                         'sensors': len(members)}
+    return emitters
+
+def save_emitters(root, emitters) -> None:
+    arrays = {f'{key}/{name}': value for key, group in emitters.items() for name, value in group.items()}
+    path = os.path.join(root, MODEL_NAME)
+    tmp = path + '.tmp.npz'
+    np.savez(tmp, **arrays)
+    os.replace(tmp, path)
+
+def load_emitters(root) -> dict:
+    path = os.path.join(root, MODEL_NAME)
+    emitters = {}
+    if not os.path.exists(path): return emitters
+    with np.load(path) as data:
+        for name in data.files:
+            key, field = name.split('/')
+            emitters.setdefault(key, {})[field] = data[name]
+    return emitters
+
+# base and response of any parameter set from the emitters of its light setup
+
+def predict(params, emitters) -> dict:
+    group = emitters.get(group_key(params))
+    if group is None: raise KeyError(f'no fitted sensors with light setup {group_key(params)}')
+    weights = sensor_params.emitter_weights(params).astype(np.float32)
+    base = group['ambient'] + np.einsum('kc,khw->hwc', weights, group['fields'])
+    response = group['kappa'] + group['theta'].T @ weights
+    return {'base': base, 'response': response}
+
+# fits every sensor of root, holding out every holdout-th sample for evaluation
+
+# returns: number of fitted sensors
+
+def fit_all(root, sensors=None, num=None, holdout=4, stride=4, ksize=5) -> int:
+    bank = sensor_params.load_bank(root)
+    models, params = [], []
+    print(f"{'sensor':<12} {'samples':>8} {'fit rmse':>9} {'test rmse':>10}")
+    for sensor in post_process.list_sensors(root, sensors):
+        sensor_dir = os.path.join(root, sensor)
+        if not os.path.exists(os.path.join(sensor_dir, 'calibration', '0000.png')): continue
+        names = list_pairs(sensor_dir)[:num]
+        if len(names) == 0: continue
+
+        test = names[::holdout] if len(names) >= holdout else []
+        train = [name for name in names if name not in test]
+        p = sensor_params.to_params(bank[int(sensor[len('sensor_'):])])
+        model = fit_sensor(sensor_dir, train, stride, ksize)
+        save_model(sensor_dir, model, p)
+        models.append(model)
+        params.append(p)
+        print(f"{sensor:<12} {len(train):>8} {model['rmse'] * 255:>9.2f} {evaluate(sensor_dir, model, test, ksize):>10.2f}")
+    print('rmse in 8 bit levels, fit rmse over contact pixels in linear light, test rmse over whole held out images')
+
+    emitters = fit_emitters(models, params)
+    save_emitters(root, emitters)
+    for key, group in emitters.items():
+        print(f"light setup {key}: emitters fitted from {group['sensors']} sensors")
+    return len(models)
+
+# renders samples/*.png for the depth maps of depth_root, with the models fitted in model_root
+
+# batch: depth maps rendered at once
+# returns: number of written images
+
+def render_all(depth_root, model_root, sensors=None, batch=16, ksize=5, force=False) -> int:
+    bank = sensor_params.load_bank(depth_root)
+    emitters = load_emitters(model_root)
+    written = 0
+    for sensor in post_process.list_sensors(depth_root, sensors):
+        sensor_dir = os.path.join(depth_root, sensor)
+        p = sensor_params.to_params(bank[int(sensor[len('sensor_'):])])
+        model = load_model(os.path.join(model_root, sensor), p)
+        if model is None: model = predict(p, emitters)
+
+        sample_dir = os.path.join(sensor_dir, 'samples')
+        os.makedirs(sample_dir, exist_ok=True)
+        names = [name for name in post_process.list_samples(sensor_dir)
+                 if force or not os.path.exists(os.path.join(sample_dir, name + '.png'))]
+        for start in range(0, len(names), batch):
+            chunk = names[start:start + batch]
+            dmaps = np.stack([post_process.load_depth(sensor_dir, name) for name in chunk])
+            if dmaps.shape[1:] != model['base'].shape[:2]:
+                raise ValueError(f"{sensor}: depth maps {dmaps.shape[1:]} do not match the model resolution {model['base'].shape[:2]}")
+            images = render(dmaps, model['base'][None], model['response'][None], ksize)[0]
+            for name, image in zip(chunk, images):
+                write_image(os.path.join(sample_dir, name + '.png'), image)
+            written += len(chunk)
+    return written
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fit and run the numpy photometric renderer.')
+    parser.add_argument('command', choices=['fit', 'render'])
+    parser.add_argument('--root', default=post_process.root_dir, help='blender render directory the models are fitted on (default: GELSIGHT_RENDER_DIR or <repo>/renders)')
+    parser.add_argument('--depth-root', default=None, help='with render, directory of the depth maps to shade (default: <root>/raster)')
+    parser.add_argument('-s', '--sensors', nargs='+', default=None, help='sensor names or indices (default: all)')
+    parser.add_argument('-n', '--num', type=int, default=64, help='samples per sensor used by fit')
+    parser.add_argument('--stride', type=int, default=4, help='pixel subsampling of the fit')
+    parser.add_argument('-b', '--batch', type=int, default=16, help='depth maps rendered at once')
+    parser.add_argument('--ksize', type=int, default=5, choices=[1, 3, 5, 7], help='sobel kernel size of the normals')
+    parser.add_argument('-f', '--force', action='store_true', help='with render, overwrite existing images')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.command == 'fit':
+        count = fit_all(args.root, args.sensors, args.num, stride=args.stride, ksize=args.ksize)
+        print(f'fitted {count} sensors in {time.perf_counter() - start:.1f} s')
+    else:
+        depth_root = args.depth_root if args.depth_root is not None else os.path.join(args.root, 'raster')
+        written = render_all(depth_root, args.root, args.sensors, args.batch, args.ksize, args.force)
+        elapsed = time.perf_counter() - start
+        print(f'wrote {written} images in {elapsed:.1f} s ({written / max(elapsed, 1e-9):.1f} images/s)')
+    sys.exit(0)
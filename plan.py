@@ -0,0 +1,99 @@
+import os
+import ast
+import json
+import random
+from math import pi
+
+# precomputed object choices and poses of a run, one json line per sample
+#   {"index": 12, "seed": 8123, "obj": "teapot", "size": 0.031,
+#    "location": [x, y, z], "rotation": [a_x, a_y, a_z]}
+# drawn up front so samples can be rendered in any order (sensor-major blocks,
+# shards, resumes) with identical results, the seed drives the remaining
+# randomness of a sample such as the lowest vertex tie break
+
+PLAN_NAME = 'plan.jsonl'
+
+script_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scripting.py')
+
+
+def get_plan_path(render_dir) -> str:
+    return os.path.join(render_dir, PLAN_NAME)
+
+# draws the pose of one sample
+
+# rng: random.Random
+# meshes: list of mesh names
+# config: dict with OBJ_SIZE_MIN/MAX, X_MIN/MAX, Y_MIN/MAX, OBJ_DEPTH_MIN/MAX
+
+def draw_pose(index, rng, meshes, config) -> dict:
+    return {'index': index,
+            'seed': rng.randrange(2**31),
+            'obj': rng.choice(meshes),
+            'size': rng.uniform(config['OBJ_SIZE_MIN'], config['OBJ_SIZE_MAX']),
+            'location': [rng.uniform(config['X_MIN'], config['X_MAX']),
+                         rng.uniform(config['Y_MIN'], config['Y_MAX']),
+                         rng.uniform(config['OBJ_DEPTH_MIN'], config['OBJ_DEPTH_MAX'])],
+            'rotation': [rng.uniform(0, 2*pi), rng.uniform(0, 2*pi), rng.uniform(0, 2*pi)]}
+
+# literal upper case constants at the top of scripting.py, for tools running
+# without blender (scripting.py itself imports bpy)
+
+def load_config(path=script_path) -> dict:
+    with open(path, 'r') as f:
+        tree = ast.parse(f.read(), path)
+    config = {}
+    for node in tree.body:
+        if not isinstance(node, ast.Assign) or len(node.targets) != 1: continue
+        target = node.targets[0]
+        if not isinstance(target, ast.Name) or not target.id.isupper(): continue
+        try:
+            config[target.id] = ast.literal_eval(node.value)
+        except ValueError:
+            continue
+    return config
+
+def load_plan(render_dir) -> dict:
+    plan = {}
+    path = get_plan_path(render_dir)
+    if not os.path.exists(path): return plan
+    with open(path, 'r') as f:
+        for line in f:
+            if not line.endswith('\n'): break
+            entry = json.loads(line)
+            plan[entry['index']] = entry
+    return plan
+
+# indices of the samples whose pose ran out of tries
+
+def invalid_samples(plan) -> list:
+    return sorted(idx for idx, entry in plan.items() if entry.get('invalid', False))
+
+# makes sure the plan covers num_samples samples, keeping existing entries
+
+# seed: optional seed of new entries, None draws one
+# validate: optional fn(entry) -> bool, rejected poses of the same object and
+#           size are redrawn, up to max_tries draws in total. when every draw
+#           is rejected the last one is kept and flagged "invalid": true
+
+def extend_plan(render_dir, num_samples, meshes, config, seed=None, validate=None, max_tries=20) -> dict:
+    plan = load_plan(render_dir)
+    missing = [idx for idx in range(num_samples) if idx not in plan]
+    if len(missing) == 0: return plan
+
+    rng = random.Random(seed)
+    with open(get_plan_path(render_dir), 'a') as f:
+        for index in missing:
+            entry = draw_pose(index, rng, meshes, config)
+            for tries in range(1, max_tries + 1):
+                if validate is None or validate(entry): break
+                if tries == max_tries:
+                    entry['invalid'] = True
+                    break
+                size = entry['size']
+                entry = draw_pose(index, rng, [entry['obj']], config)
+                entry['size'] = size
+            plan[index] = entry
+            f.write(json.dumps(entry) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+    return plan
@@ -0,0 +1,157 @@
+import os
+import sys
+import json
+import random
+import argparse
+import numpy as np
+
+import mesh_cache
+import mesh_utils
+
+# numpy check of planned poses before anything is rendered
+# a pose is placed exactly like scripting.py's move_object does it (scaled to
+# its planned size, rotated, lowest vertex moved to (x, y, -depth)) and measured
+# against the gel plane z = 0 inside the sensor window |x| < wx, |y| < wy:
+#   lowest inside: the lowest vertex, placed at the planned depth, lies in the window
+#   contact area: projected area of downward facing triangles below the gel
+#                 whose centroid lies inside the window
+# the penetration inside the window is the planned depth whenever the lowest
+# vertex is inside, so it is not checked, the depth range already bounds it
+# rejected poses are redrawn by plan.extend_plan
+#
+#   python pose_validator.py --length 0.0075    # acceptance rate of random poses
+
+VALIDATION_NAME = 'validation.json'
+
+
+class PoseValidator():
+    # mesh_dir: directory of the .obj files, read through mesh_cache
+    # window: (wx, wy) half extents of the smallest sensor window
+    # min_area: smallest accepted contact area
+
+    def __init__(self, mesh_dir, window, min_area):
+        self.mesh_dir = mesh_dir
+        self.window = window
+        self.min_area = min_area
+        self.meshes = {}
+        self.accepted = 0
+        self.rejected = {}
+
+    # blender axis vertices, faces and largest dimension of a mesh
+
+    def get_mesh(self, name) -> tuple:
+        if name not in self.meshes:
+            mesh = mesh_cache.load_mesh(name, self.mesh_dir)
+            vertices = mesh_cache.to_blender_axes(mesh['vertices']).astype(np.float64)
+            max_dim = float((vertices.max(axis=0) - vertices.min(axis=0)).max())
+            self.meshes[name] = (vertices, mesh['faces'], max_dim)
+        return self.meshes[name]
+
+    # world vertices of a plan entry after move_object
+
+    def place(self, entry) -> tuple:
+        vertices, faces, max_dim = self.get_mesh(entry['obj'])
+        return place_entry(vertices, max_dim, entry), faces
+
+    # returns: dict with contact area and whether the lowest vertex is in the window
+
+    def measure(self, entry) -> dict:
+        world, faces = self.place(entry)
+        wx, wy = self.window
+
+        tri = world[faces]
+        centroid = tri.mean(axis=1)
+        # z component of the face normal, negative for faces looking at the camera
+        nz = (tri[:, 1, 0] - tri[:, 0, 0]) * (tri[:, 2, 1] - tri[:, 0, 1]) - (tri[:, 1, 1] - tri[:, 0, 1]) * (tri[:, 2, 0] - tri[:, 0, 0])
+        contact = (nz < 0) & (centroid[:, 2] < 0) & (np.abs(centroid[:, 0]) < wx) & (np.abs(centroid[:, 1]) < wy)
+        area = float(-nz[contact].sum() / 2)
+
+        x, y, _ = entry['location']
+        return {'area': area, 'lowest_inside': bool(abs(x) < wx and abs(y) < wy)}
+
+    # accepts or rejects a plan entry and counts the reason
+
+    def __call__(self, entry) -> bool:
+        metrics = self.measure(entry)
+        reason = None
+        if not metrics['lowest_inside']: reason = 'outside'
+        elif metrics['area'] < self.min_area: reason = 'area'
+
+        if reason is None: self.accepted += 1
+        else: self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        return reason is None
+
+    def summary(self) -> dict:
+        drawn = self.accepted + sum(self.rejected.values())
+        return {'drawn': drawn,
+                'accepted': self.accepted,
+                'rejected': dict(self.rejected),
+                'acceptance_rate': self.accepted / drawn if drawn > 0 else 1.0}
+
+# world vertices of a plan entry placed like scripting.py's move_object
+
+# vertices: (N, 3) blender axis vertices of the entry's mesh
+# max_dim: largest dimension of the vertices, scaled to the entry's size
+
+def place_entry(vertices, max_dim, entry) -> np.ndarray:
+    mw = mesh_utils.euler_matrix(entry['rotation'], entry['size'] / max_dim)
+
+    # same tie break between equally low vertices as find_lowest
+    low = random.Random(entry['seed']).choice(mesh_utils.lowest_points(vertices, mw))
+    x, y, depth = entry['location']
+    mw[:3, 3] = (x - low[0], y - low[1], -depth - low[2])
+    return vertices @ mw[:3, :3].T + mw[:3, 3]
+
+# sensor window of the sensor with the shortest gel
+# every camera frames 2 * length across the larger image side
+
+# resolution: (w, h) of the renders
+
+def sensor_window(length, resolution) -> tuple:
+    w, h = resolution
+    return (length * w / max(w, h), length * h / max(w, h))
+
+# merges the counts of this validation into render_dir/validation.json
+
+# invalid: samples of the whole plan whose pose ran out of tries, replaces the stored count
+
+def save_summary(render_dir, summary, invalid=0) -> dict:
+    path = os.path.join(render_dir, VALIDATION_NAME)
+    total = {'drawn': 0, 'accepted': 0, 'rejected': {}}
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            total = json.load(f)
+    total['drawn'] += summary['drawn']
+    total['accepted'] += summary['accepted']
+    for reason, count in summary['rejected'].items():
+        total['rejected'][reason] = total['rejected'].get(reason, 0) + count
+    total['invalid'] = invalid
+    total['acceptance_rate'] = total['accepted'] / total['drawn'] if total['drawn'] > 0 else 1.0
+
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(total, f, indent=1)
+    os.replace(tmp, path)
+    return total
+
+
+if __name__ == '__main__':
+    import plan
+
+    parser = argparse.ArgumentParser(description='Acceptance rate of random poses under the contact validator.')
+    parser.add_argument('--mesh-dir', default=mesh_cache.mesh_dir, help='directory holding the .obj files')
+    parser.add_argument('-n', '--num', type=int, default=1000, help='poses to draw')
+    parser.add_argument('--length', type=float, default=0.0075, help='gel half length of the sensor')
+    parser.add_argument('--resolution', type=int, nargs=2, default=[640, 480], help='render resolution w h')
+    parser.add_argument('--min-area', type=float, default=1e-6, help='smallest contact area in m^2')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    config = plan.load_config()
+    validator = PoseValidator(args.mesh_dir, sensor_window(args.length, args.resolution), args.min_area)
+    rng = random.Random(args.seed)
+    meshes = mesh_cache.list_meshes(args.mesh_dir)
+    for index in range(args.num):
+        validator(plan.draw_pose(index, rng, meshes, config))
+    print(json.dumps(validator.summary(), indent=1))
+    sys.exit(0)
@@ -1,10 +1,23 @@
 import os
+import sys
+import json
+import time
+import signal
+import hashlib
+import threading
+import argparse
 import numpy as np
 import cv2
-import shutil
+from multiprocessing import Pool
+
+import depth_store
+import normals
 
 root_dir = os.environ.get('GELSIGHT_RENDER_DIR', os.path.join(os.path.dirname(__file__), 'renders'))
 
+# per-sensor record of the source hash each output was built from
+MANIFEST_NAME = 'post_process.json'
+
 
 def dmap2norm(dmap):
     zx = cv2.Sobel(dmap, cv2.CV_64F, 1, 0, ksize=5)
@@ -19,38 +32,346 @@ def dmap2norm(dmap):
     normals /= 2
     return normals[:, :, ::-1].astype(np.float32)
 
+# lists sensor directories, optionally restricted to a subset
+
+# sensors: iterable of sensor names ('sensor_0003') or indices (3), None for all
+
+def list_sensors(root, sensors=None) -> list:
+    sensor_dirs = [d for d in os.listdir(root) if d.startswith('sensor_') and os.path.isdir(os.path.join(root, d))]
+    sensor_dirs.sort()
+    if sensors is None: return sensor_dirs
+
+    wanted = set()
+    for sensor in sensors:
+        sensor = str(sensor)
+        if sensor.isdigit(): sensor = 'sensor_{0:04}'.format(int(sensor))
+        wanted.add(sensor)
+    return [d for d in sensor_dirs if d in wanted]
+
+def file_hash(path) -> str:
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def load_manifest(sensor_dir) -> dict:
+    path = os.path.join(sensor_dir, MANIFEST_NAME)
+    if not os.path.exists(path): return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def save_manifest(sensor_dir, manifest) -> None:
+    path = os.path.join(sensor_dir, MANIFEST_NAME)
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, sort_keys=True)
+    os.replace(tmp, path)
+
+# checks whether dst exists and was written after its source
+
+# mtime: modification time of the source, see source_mtime
+
+def up_to_date(mtime, dst) -> bool:
+    if not os.path.exists(dst): return False
+    return os.path.getmtime(dst) >= mtime
+
+# checks that a .npy file is fully written, its size must match the header
+# the generator writes atomically, this also guards against older partial files
+
+def is_complete(path) -> bool:
+    try:
+        with open(path, 'rb') as f:
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0): shape, _, dtype = np.lib.format.read_array_header_1_0(f)
+            else: shape, _, dtype = np.lib.format.read_array_header_2_0(f)
+            expected = f.tell() + int(np.prod(shape)) * dtype.itemsize
+    except (OSError, ValueError):
+        return False
+    return os.path.getsize(path) == expected
+
+# depth stores opened by this process, keyed by sensor directory
+
+# sample: optional int sample index, reopens a store that grew since it was opened,
+#         so a sample rewritten into a newer slot is read from that slot
+
+_stores = {}
+
+def get_store(sensor_dir, sample=None):
+    store = _stores.get(sensor_dir)
+    if store is None or (sample is not None and (sample not in store or store.grown())):
+        _stores[sensor_dir] = depth_store.DepthStore(sensor_dir)
+    return _stores[sensor_dir]
+
+# time a sample's depth map was written, from raw_data/*.npy or its depth store slot
+
+def source_mtime(sensor_dir, sample) -> float:
+    raw_dir = os.path.join(sensor_dir, 'raw_data', sample + '.npy')
+    if os.path.exists(raw_dir): return os.path.getmtime(raw_dir)
+    return get_store(sensor_dir, int(sample)).mtime(int(sample))
+
+def load_depth(sensor_dir, sample) -> np.ndarray:
+    raw_dir = os.path.join(sensor_dir, 'raw_data', sample + '.npy')
+    if os.path.exists(raw_dir): return np.load(raw_dir)
+    return np.asarray(get_store(sensor_dir, int(sample))[int(sample)], dtype=np.float32)
+
+def source_hash(sensor_dir, sample) -> str:
+    raw_dir = os.path.join(sensor_dir, 'raw_data', sample + '.npy')
+    if os.path.exists(raw_dir): return file_hash(raw_dir)
+    return hashlib.sha1(get_store(sensor_dir, int(sample))[int(sample)].tobytes()).hexdigest()
+
+# sample names of a sensor from raw_data/*.npy and its depth store
+
+def list_samples(sensor_dir) -> list:
+    samples = set()
+    raw_depth_dir = os.path.join(sensor_dir, 'raw_data')
+    if os.path.isdir(raw_depth_dir):
+        samples.update(f[:-4] for f in os.listdir(raw_depth_dir) if f.endswith('.npy'))
+    if depth_store.exists(sensor_dir):
+        # reopened so samples appended since the last listing show up
+        _stores.pop(sensor_dir, None)
+        samples.update('{0:04}'.format(idx) for idx in get_store(sensor_dir).samples())
+    return sorted(samples)
+
+# whether a sample's outputs must be (re)built, None while its depth map is still being written
+
+def needs_processing(sensor_dir, sample, manifest, force=False, use_hash=False):
+    raw_dir = os.path.join(sensor_dir, 'raw_data', sample + '.npy')
+    if os.path.exists(raw_dir) and not is_complete(raw_dir): return None
+    if force: return True
+
+    src = source_mtime(sensor_dir, sample)
+    dmap_dir = os.path.join(sensor_dir, 'dmaps', sample + '.png')
+    norm_dir = os.path.join(sensor_dir, 'norms', sample + '.png')
+    if up_to_date(src, dmap_dir) and up_to_date(src, norm_dir): return False
+    if use_hash and sample in manifest and os.path.exists(dmap_dir) and os.path.exists(norm_dir):
+        if manifest[sample] == source_hash(sensor_dir, sample): return False
+    return True
+
+# builds the list of (sensor_dir, sample) units that need processing
+
+# force: rebuild every output regardless of timestamps
+# use_hash: also accept outputs whose recorded source hash still matches
+# ksize: sobel kernel size of the normal maps
+
+def collect_units(root, sensors=None, force=False, use_hash=False, ksize=5) -> list:
+    units = []
+    for sensor in list_sensors(root, sensors):
+        sensor_dir = os.path.join(root, sensor)
+        samples = list_samples(sensor_dir)
+        if len(samples) == 0: continue
+        os.makedirs(os.path.join(sensor_dir, 'dmaps'), exist_ok=True)
+        os.makedirs(os.path.join(sensor_dir, 'norms'), exist_ok=True)
+        manifest = load_manifest(sensor_dir) if use_hash else {}
+
+        for sample in samples:
+            todo = needs_processing(sensor_dir, sample, manifest, force, use_hash)
+            if todo is None: print(f'skipping incomplete {sensor}/raw_data/{sample}.npy')
+            if todo: units.append((sensor_dir, sample, use_hash, ksize))
+    return units
+
+# writes a png under a temporary name first, an interrupted write never leaves
+# a truncated file that up_to_date would accept
+
+def write_png(path, image) -> None:
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(cv2.imencode('.png', image)[1].tobytes())
+    os.replace(tmp, path)
+
+# converts one raw depth map into its dmap and norm pngs
+
+# unit: (sensor_dir, sample, use_hash, ksize) as produced by collect_units
+
+def process_sample(unit):
+    sensor_dir, sample, use_hash, ksize = unit
+    dmap_dir = os.path.join(sensor_dir, 'dmaps', sample + '.png')
+    norm_dir = os.path.join(sensor_dir, 'norms', sample + '.png')
+
+    raw = load_depth(sensor_dir, sample)
+
+    norm = normals.get_engine(raw.shape, ksize).compute(raw, uint8=True)
+    write_png(norm_dir, norm)
+
+    dmap = np.clip(raw, 0, 1)
+    dmap = (dmap * 255).astype(np.uint8)
+    write_png(dmap_dir, dmap)
+
+    digest = source_hash(sensor_dir, sample) if use_hash else None
+    return sensor_dir, sample, digest
+
+# processes units on a pool of worker processes and records hashes per sensor
+
+# workers: number of processes, 1 runs inline
+
+def run(units, workers=None) -> int:
+    if workers is None: workers = os.cpu_count() or 1
+    manifests = {}
+
+    def record(result):
+        sensor_dir, sample, digest = result
+        if digest is None: return
+        if sensor_dir not in manifests: manifests[sensor_dir] = load_manifest(sensor_dir)
+        manifests[sensor_dir][sample] = digest
+
+    if workers <= 1 or len(units) <= 1:
+        for unit in units: record(process_sample(unit))
+    else:
+        with Pool(workers) as pool:
+            for result in pool.imap_unordered(process_sample, units, chunksize=8):
+                record(result)
+
+    for sensor_dir, manifest in manifests.items():
+        save_manifest(sensor_dir, manifest)
+    return len(units)
+
+# new samples of a sensor since the last call, without rescanning old ones
+# raw_data/ is only listed again once its mtime changes, and the append-only
+# index of every depth store segment is read from the offset reached before
+
+class SensorWatch():
+    def __init__(self, sensor_dir):
+        self.sensor_dir = sensor_dir
+        self.raw_mtime = None
+        self.raw_seen = set()
+        self.offsets = {}
+
+    def new_samples(self) -> list:
+        samples = set()
+        raw_depth_dir = os.path.join(self.sensor_dir, 'raw_data')
+        if os.path.isdir(raw_depth_dir):
+            mtime = os.stat(raw_depth_dir).st_mtime_ns
+            if mtime != self.raw_mtime:
+                names = {f[:-4] for f in os.listdir(raw_depth_dir) if f.endswith('.npy')}
+                samples.update(names - self.raw_seen)
+                self.raw_seen |= names
+                # a file added within the same mtime tick would be missed, so a
+                # recent mtime is listed again on the next call
+                if time.time_ns() - mtime > 2 * 10**9: self.raw_mtime = mtime
+
+        store_dir = depth_store.get_store_dir(self.sensor_dir)
+        if depth_store.exists(self.sensor_dir):
+            for segment in os.listdir(store_dir):
+                index_path = os.path.join(store_dir, segment, depth_store.INDEX_NAME)
+                if not os.path.exists(index_path): continue
+                offset = self.offsets.get(segment, 0)
+                size = os.path.getsize(index_path) // 8 * 8
+                if size <= offset: continue
+                index = np.fromfile(index_path, dtype=np.int64, count=(size - offset) // 8, offset=offset)
+                samples.update('{0:04}'.format(idx) for idx in index.tolist())
+                self.offsets[segment] = size
+        return sorted(samples)
+
+# pool workers leave ctrl-c to the main process, which lets them finish
+
+def ignore_sigint() -> None:
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+# processes depth maps as the generator writes them, until idle seconds pass
+# without a new one (None follows until interrupted)
+# every poll only looks at samples that appeared since the previous one and
+# at those still being written, finished ones are never looked at again
+
+# interval: seconds between polls of raw_data/ and the depth stores
+
+def follow(root, sensors=None, workers=None, interval=5.0, idle=None, use_hash=False, ksize=5) -> int:
+    if workers is None: workers = os.cpu_count() or 1
+    watches = {}
+    waiting = {}
+    in_flight = set()
+    manifests = {}
+    dirty = set()
+    processed = 0
+    last_new = time.monotonic()
+
+    # results arrive on the pool's result thread
+    lock = threading.Lock()
+
+    def record(result):
+        sensor_dir, sample, digest = result
+        with lock:
+            in_flight.discard((sensor_dir, sample))
+            if digest is None: return
+            manifests[sensor_dir][sample] = digest
+            dirty.add(sensor_dir)
+
+    def save_manifests():
+        with lock:
+            for sensor_dir in dirty: save_manifest(sensor_dir, dict(manifests[sensor_dir]))
+            dirty.clear()
 
-sensors = os.listdir(root_dir)
-for sensor in sensors:
-    change_dir = os.path.join(root_dir, sensor)
-    raw_depth_dir = os.path.join(change_dir, 'raw_data')
-    dmaps_dir = os.path.join(change_dir, 'dmaps')
-    norms_dir = os.path.join(change_dir, 'norms')
+    errors = []
+    with Pool(max(1, workers), initializer=ignore_sigint) as pool:
+        try:
+            while True:
+                if len(errors) > 0: raise errors[0]
+                queued = 0
+                for sensor in list_sensors(root, sensors) if os.path.isdir(root) else []:
+                    sensor_dir = os.path.join(root, sensor)
+                    if sensor_dir not in watches:
+                        os.makedirs(os.path.join(sensor_dir, 'dmaps'), exist_ok=True)
+                        os.makedirs(os.path.join(sensor_dir, 'norms'), exist_ok=True)
+                        watches[sensor_dir] = SensorWatch(sensor_dir)
+                        waiting[sensor_dir] = set()
+                        with lock:
+                            manifests[sensor_dir] = load_manifest(sensor_dir) if use_hash else {}
 
-    if os.path.exists(norms_dir) == True:
-        shutil.rmtree(norms_dir)
-    if os.path.exists(dmaps_dir) == True:
-        shutil.rmtree(dmaps_dir)
-    os.mkdir(norms_dir)
-    os.mkdir(dmaps_dir)
+                    # samples still being written are checked again every poll
+                    candidates = sorted(waiting[sensor_dir].union(watches[sensor_dir].new_samples()))
+                    waiting[sensor_dir].clear()
+                    for sample in candidates:
+                        key = (sensor_dir, sample)
+                        if key in in_flight: continue
+                        with lock:
+                            todo = needs_processing(sensor_dir, sample, manifests[sensor_dir], use_hash=use_hash)
+                        if todo is None:
+                            waiting[sensor_dir].add(sample)
+                            continue
+                        if not todo: continue
+                        in_flight.add(key)
+                        pool.apply_async(process_sample, ((sensor_dir, sample, use_hash, ksize),), callback=record, error_callback=errors.append)
+                        queued += 1
 
-    raw_depths = os.listdir(raw_depth_dir)
-    raw_depths.sort()
+                processed += queued
+                if queued > 0:
+                    last_new = time.monotonic()
+                    print(f'queued {queued} samples, {len(in_flight)} in flight, {processed} total')
+                save_manifests()
+                if idle is not None and len(in_flight) == 0 and time.monotonic() - last_new >= idle: break
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            print('stopping, waiting for samples in flight')
+            pool.close()
+            pool.join()
 
-    for raw in raw_depths:
-        raw_dir = os.path.join(raw_depth_dir, raw)
-        dmap_dir = os.path.join(dmaps_dir, raw[0:4] + '.png')
-        norm_dir = os.path.join(norms_dir, raw[0:4] + '.png')
+    save_manifests()
+    if len(errors) > 0: raise errors[0]
+    return processed
 
-        raw = np.load(raw_dir)
 
-        norm = dmap2norm(raw)
-        norm = np.clip(norm, 0, 1)
-        norm = (norm * 255).astype(np.uint8)
-        cv2.imwrite(norm_dir, norm)
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Convert raw_data/*.npy (or depth store) depth maps into dmaps/ and norms/ pngs.')
+    parser.add_argument('--root', default=root_dir, help='render directory (default: GELSIGHT_RENDER_DIR or <repo>/renders)')
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count() or 1, help='number of worker processes')
+    parser.add_argument('-s', '--sensors', nargs='+', default=None, help='sensor names or indices to process (default: all)')
+    parser.add_argument('-f', '--force', action='store_true', help='rebuild every output, ignoring timestamps and hashes')
+    parser.add_argument('--hash', action='store_true', help='record source hashes and skip outputs whose hash still matches')
+    parser.add_argument('--ksize', type=int, default=5, choices=[1, 3, 5, 7], help='sobel kernel size of the normal maps')
+    parser.add_argument('--follow', action='store_true', help='keep polling for depth maps written by a running generator')
+    parser.add_argument('--interval', type=float, default=5.0, help='seconds between polls with --follow')
+    parser.add_argument('--idle', type=float, default=None, help='with --follow, exit after this many seconds without new depth maps')
+    return parser.parse_args(argv)
 
-        dmap = np.clip(raw, 0, 1)
-        dmap = (dmap * 255).astype(np.uint8)
-        cv2.imwrite(dmap_dir, dmap)
 
+if __name__ == '__main__':
+    args = parse_args()
+    if args.follow:
+        print(f'following {args.root} with {args.workers} workers')
+        processed = follow(args.root, args.sensors, args.workers, args.interval, args.idle, args.hash, args.ksize)
+        print(f'processed {processed} samples')
+        sys.exit(0)
 
+    units = collect_units(args.root, args.sensors, force=args.force, use_hash=args.hash, ksize=args.ksize)
+    print(f'processing {len(units)} samples with {args.workers} workers')
+    run(units, args.workers)
+    sys.exit(0)
@@ -0,0 +1,299 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+from math import pi, tan
+from multiprocessing import Pool
+
+import mesh_cache
+import mesh_lod
+import mesh_utils
+import journal
+import sensor_params
+import pose_validator
+import plan as sample_plan
+
+# numpy z-buffer rasterizer producing the depth maps of scripting.py without blender
+#
+#   python rasterizer.py                        # every planned sample and sensor into renders/raster
+#   python rasterizer.py --generate 8 1000      # draws 8 sensors and 1000 poses first (scripting.py config)
+#   python rasterizer.py --compare -n 200       # accuracy against the blender rendered depth maps
+#
+# the scene of set_cam: a perspective camera at (0, 0, -height) looking up +z,
+# height = length / tan(fov / 2), fov spanning the larger image side, so the
+# gel plane z = 0 is 2 * length across. the compositor's Map Range maps the
+# camera distance [height - 0.002, height] to [0, 1] (clamped) and the readout
+# inverts it, so a depth map value is the penetration below the gel / 2 mm.
+# the camera is rotated 180 degrees about x, image columns follow +x and rows
+# (after the readout's flip) follow +y, python rasterizer.py --compare reports
+# whether another orientation matches the blender maps better
+#
+# the gel in blender is shrinkwrapped onto the object and smoothed by its
+# CorrectiveSmooth modifier, here the object surface itself is rasterized, so
+# contact edges are sharper than in blender renders with a high smoothness
+
+# camera distance range of the compositor's Map Range, see set_cam
+DEPTH_RANGE = 0.002
+
+# covered (triangle, pixel) candidates evaluated at once
+PIXEL_BUDGET = 1 << 21
+
+root_dir = os.environ.get('GELSIGHT_RENDER_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'renders'))
+
+
+def camera_height(fov, length) -> float:
+    return length / tan((fov / 360) * pi)
+
+# depth map of world space triangles seen by a sensor camera
+
+# world: (N, 3) world vertices
+# faces: (M, 3) triangle indices
+# fov, length: sensor camera parameters
+# resolution: (w, h) of the render
+# out: optional reused (h, w) float32 output
+
+def rasterize(world, faces, fov, length, resolution, out=None) -> np.ndarray:
+    w, h = resolution
+    if out is None: out = np.empty((h, w), dtype=np.float32)
+    height = camera_height(fov, length)
+    focal = (max(w, h) / 2) / tan((fov / 360) * pi)
+
+    # only triangles reaching below the gel can change the map
+    tri = world[faces]
+    tri = tri[tri[:, :, 2].min(axis=1) < 0]
+    dist = tri[:, :, 2] + height
+    tri, dist = tri[(dist > 0).all(axis=1)], dist[(dist > 0).all(axis=1)]
+
+    # pixel coordinates with pixel centers on integers
+    u = tri[:, :, 0] / dist * focal + w / 2 - 0.5
+    v = tri[:, :, 1] / dist * focal + h / 2 - 0.5
+    x0 = np.maximum(np.ceil(u.min(axis=1)), 0).astype(np.int64)
+    x1 = np.minimum(np.floor(u.max(axis=1)), w - 1).astype(np.int64)
+    y0 = np.maximum(np.ceil(v.min(axis=1)), 0).astype(np.int64)
+    y1 = np.minimum(np.floor(v.max(axis=1)), h - 1).astype(np.int64)
+    area = (u[:, 1] - u[:, 0]) * (v[:, 2] - v[:, 0]) - (u[:, 2] - u[:, 0]) * (v[:, 1] - v[:, 0])
+    keep = (x1 >= x0) & (y1 >= y0) & (np.abs(area) > 1e-12)
+    u, v, dist, area = u[keep], v[keep], dist[keep], area[keep]
+    x0, x1, y0, y1 = x0[keep], x1[keep], y0[keep], y1[keep]
+
+    # nearest surface per pixel as the smallest camera distance
+    zbuf = np.full(h * w, np.inf)
+    nx = x1 - x0 + 1
+    counts = nx * (y1 - y0 + 1)
+    ends = np.cumsum(counts)
+    start = 0
+    while start < len(counts):
+        offset = ends[start - 1] if start > 0 else 0
+        stop = max(int(np.searchsorted(ends, offset + PIXEL_BUDGET, side='right')), start + 1)
+        chunk = slice(start, stop)
+
+        tid = np.repeat(np.arange(stop - start), counts[chunk])
+        local = np.arange(len(tid)) - np.repeat(ends[chunk] - counts[chunk] - offset, counts[chunk])
+        px = x0[chunk][tid] + local % nx[chunk][tid]
+        py = y0[chunk][tid] + local // nx[chunk][tid]
+
+        cu, cv, cd, ca = u[chunk][tid], v[chunk][tid], dist[chunk][tid], area[chunk][tid]
+        b1 = ((px - cu[:, 0]) * (cv[:, 2] - cv[:, 0]) - (cu[:, 2] - cu[:, 0]) * (py - cv[:, 0])) / ca
+        b2 = ((cu[:, 1] - cu[:, 0]) * (py - cv[:, 0]) - (px - cu[:, 0]) * (cv[:, 1] - cv[:, 0])) / ca
+        b0 = 1 - b1 - b2
+        inside = (b0 >= -1e-9) & (b1 >= -1e-9) & (b2 >= -1e-9)
+
+        # perspective correct: 1 / distance is linear in screen space
+        inv = (b0 / cd[:, 0] + b1 / cd[:, 1] + b2 / cd[:, 2])[inside]
+        np.minimum.at(zbuf, (py * w + px)[inside], 1 / inv)
+        start = stop
+
+    # the readout's 1 - x of the Map Range output
+    np.clip((height - zbuf.reshape(h, w)) / DEPTH_RANGE, 0, 1, out=out, casting='unsafe')
+    return out
+
+# blender axis vertices and faces of a mesh or one of its lods, cached per process
+
+_meshes = {}
+
+def get_mesh(name, mesh_dir=mesh_cache.mesh_dir) -> tuple:
+    if name not in _meshes:
+        if os.path.exists(os.path.join(mesh_dir, name + '.obj')):
+            mesh = mesh_cache.load_mesh(name, mesh_dir)
+            vertices, faces = mesh['vertices'], mesh['faces']
+        else:
+            vertices, faces = mesh_cache.parse_obj(mesh_lod.mesh_path(name, mesh_dir))
+        vertices = mesh_cache.to_blender_axes(vertices).astype(np.float64)
+        max_dim = float((vertices.max(axis=0) - vertices.min(axis=0)).max())
+        _meshes[name] = (vertices, faces, max_dim)
+    return _meshes[name]
+
+# world vertices and faces of a sample, from its journaled pose if the
+# generator placed it, otherwise placed from its plan entry
+
+def place_sample(entry, pose=None, mesh_dir=mesh_cache.mesh_dir) -> tuple:
+    if pose is not None:
+        vertices, faces, _ = get_mesh(pose['obj'], mesh_dir)
+        mw = mesh_utils.euler_matrix(pose['rotation'], np.asarray(pose['scale']), pose['location'])
+        return vertices @ mw[:3, :3].T + mw[:3, 3], faces
+
+    vertices, faces, max_dim = get_mesh(entry['obj'], mesh_dir)
+    return pose_validator.place_entry(vertices, max_dim, entry), faces
+
+# worker state of write_sample, set once per process
+
+_job = {}
+
+def init_job(out_dir, sensors, resolution, mesh_dir, force) -> None:
+    _job.update(out_dir=out_dir, sensors=sensors, resolution=resolution, mesh_dir=mesh_dir, force=force)
+
+# writes the depth maps of one sample for every sensor
+
+# unit: (sample index, plan entry, journaled pose or None)
+# returns: number of written depth maps
+
+def write_sample(unit) -> int:
+    index, entry, pose = unit
+    paths = [os.path.join(_job['out_dir'], 'sensor_{0:04}'.format(sensor_idx), 'raw_data', '{0:04}.npy'.format(index))
+             for sensor_idx in range(len(_job['sensors']))]
+    if not _job['force'] and all(os.path.exists(path) for path in paths): return 0
+
+    world, faces = place_sample(entry, pose, _job['mesh_dir'])
+    out = np.empty(_job['resolution'][::-1], dtype=np.float32)
+    written = 0
+    for (fov, length), path in zip(_job['sensors'], paths):
+        if not _job['force'] and os.path.exists(path): continue
+        rasterize(world, faces, fov, length, _job['resolution'], out)
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.save(f, out)
+        os.replace(tmp, path)
+        written += 1
+    return written
+
+# rasterizes every planned sample of root for every sensor of its bank
+
+# out_dir: output root, laid out like root (sensor_XXXX/raw_data/XXXX.npy)
+# returns: number of written depth maps
+
+def run(root, out_dir, resolution, workers=None, mesh_dir=mesh_cache.mesh_dir, force=False) -> int:
+    bank = sensor_params.load_bank(root)
+    entries = sample_plan.load_plan(root)
+    poses = journal.load_state(root).poses
+
+    os.makedirs(out_dir, exist_ok=True)
+    sensor_params.write_bank(out_dir, np.asarray(bank))
+    for sensor_idx in range(len(bank)):
+        os.makedirs(os.path.join(out_dir, 'sensor_{0:04}'.format(sensor_idx), 'raw_data'), exist_ok=True)
+
+    sensors = [(float(row['fov']), float(row['length'])) for row in bank]
+    units = [(index, entries[index], poses.get(index)) for index in sorted(entries)]
+    args = (out_dir, sensors, tuple(resolution), mesh_dir, force)
+    if workers == 1:
+        init_job(*args)
+        return sum(write_sample(unit) for unit in units)
+    with Pool(workers, initializer=init_job, initargs=args) as pool:
+        return sum(pool.imap_unordered(write_sample, units, chunksize=8))
+
+# orientations tried against the blender maps
+
+ORIENTATIONS = {'identity': lambda d: d, 'flipud': np.flipud, 'fliplr': np.fliplr, 'rot180': lambda d: d[::-1, ::-1]}
+
+# compares rasterized depth maps with the blender rendered ones of root
+# only samples with a journaled pose are compared, their placement is exact
+
+# limit: compare at most this many depth maps
+# threshold: depth map value counting as contact for the contact iou
+# returns: dict of per map metric arrays and counts
+
+def compare(root, sensors=None, limit=None, threshold=0.01, mesh_dir=mesh_cache.mesh_dir) -> dict:
+    import post_process
+
+    bank = sensor_params.load_bank(root)
+    poses = journal.load_state(root).poses
+    metrics = {'mae': [], 'rmse': [], 'max': [], 'iou': [], 'ms': []}
+    best = dict.fromkeys(ORIENTATIONS, 0)
+    skipped = 0
+
+    for sensor in post_process.list_sensors(root, sensors):
+        sensor_dir = os.path.join(root, sensor)
+        row = bank[int(sensor[len('sensor_'):])]
+        for sample in post_process.list_samples(sensor_dir):
+            if limit is not None and len(metrics['mae']) >= limit: break
+            pose = poses.get(int(sample))
+            if pose is None:
+                skipped += 1
+                continue
+
+            expected = post_process.load_depth(sensor_dir, sample)
+            start = time.perf_counter()
+            world, faces = place_sample(None, pose, mesh_dir)
+            dmap = rasterize(world, faces, float(row['fov']), float(row['length']), expected.shape[::-1])
+            metrics['ms'].append((time.perf_counter() - start) * 1000)
+
+            errors = {name: np.abs(orient(dmap) - expected).mean() for name, orient in ORIENTATIONS.items()}
+            best[min(errors, key=errors.get)] += 1
+            diff = dmap - expected
+            metrics['mae'].append(errors['identity'])
+            metrics['rmse'].append(np.sqrt((diff ** 2).mean()))
+            metrics['max'].append(np.abs(diff).max())
+            contact, expected_contact = dmap > threshold, expected > threshold
+            union = (contact | expected_contact).sum()
+            metrics['iou'].append((contact & expected_contact).sum() / union if union > 0 else 1.0)
+
+    result = {name: np.array(values) for name, values in metrics.items()}
+    result['best_orientation'] = best
+    result['skipped'] = skipped
+    return result
+
+def print_comparison(result) -> None:
+    count = len(result['mae'])
+    print(f"{count} depth maps compared, {result['skipped']} skipped without a journaled pose")
+    if count == 0: return
+    print(f"{'metric':<8} {'mean':>10} {'p50':>10} {'p95':>10} {'max':>10}")
+    for name in ['mae', 'rmse', 'max', 'iou', 'ms']:
+        values = result[name]
+        print(f'{name:<8} {values.mean():>10.4f} {np.percentile(values, 50):>10.4f} {np.percentile(values, 95):>10.4f} {values.max():>10.4f}')
+    print('depth errors are in map units (1 = 2 mm), ms is the placement and rasterization time per map')
+    orientation = max(result['best_orientation'], key=result['best_orientation'].get)
+    if orientation != 'identity':
+        print(f"warning: {result['best_orientation'][orientation]} maps match better after {orientation}, check the camera orientation")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rasterize depth maps of planned samples without blender.')
+    parser.add_argument('--root', default=root_dir, help='render directory with plan.jsonl and sensors.npy (default: GELSIGHT_RENDER_DIR or <repo>/renders)')
+    parser.add_argument('--out', default=None, help='output directory (default: <root>/raster)')
+    parser.add_argument('--mesh-dir', default=mesh_cache.mesh_dir, help='directory holding the .obj files')
+    parser.add_argument('--resolution', type=int, nargs=2, default=[640, 480], help='depth map resolution w h')
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count() or 1, help='number of worker processes')
+    parser.add_argument('-f', '--force', action='store_true', help='rewrite existing depth maps')
+    parser.add_argument('--generate', type=int, nargs=2, metavar=('SENSORS', 'SAMPLES'), default=None,
+                        help='draw a sensor bank and pose plan with the config of scripting.py where missing')
+    parser.add_argument('--seed', type=int, default=None, help='seed of the generated bank and plan')
+    parser.add_argument('--compare', action='store_true', help='compare against the blender depth maps of root instead')
+    parser.add_argument('-s', '--sensors', nargs='+', default=None, help='sensors to compare (default: all)')
+    parser.add_argument('-n', '--num', type=int, default=None, help='compare at most this many depth maps')
+    args = parser.parse_args()
+
+    if args.compare:
+        print_comparison(compare(args.root, args.sensors, args.num, mesh_dir=args.mesh_dir))
+        sys.exit(0)
+
+    if args.generate is not None:
+        config = sample_plan.load_config()
+        os.makedirs(args.root, exist_ok=True)
+        if not sensor_params.bank_exists(args.root):
+            sensor_params.write_bank(args.root, sensor_params.sample_bank(args.generate[0], config, np.random.default_rng(args.seed)))
+        validator = None
+        if config.get('VALIDATE_POSES', False):
+            length = float(sensor_params.load_bank(args.root)['length'].min())
+            validator = pose_validator.PoseValidator(args.mesh_dir, pose_validator.sensor_window(length, args.resolution),
+                                                     config['MIN_CONTACT_AREA'])
+        samples = sample_plan.extend_plan(args.root, args.generate[1], mesh_cache.list_meshes(args.mesh_dir), config, args.seed,
+                                          validator, config.get('MAX_POSE_TRIES', 20))
+        invalid = sample_plan.invalid_samples(samples)
+        if len(invalid) > 0: print(f'{len(invalid)} samples without a valid pose after {config.get("MAX_POSE_TRIES", 20)} tries')
+
+    out_dir = args.out if args.out is not None else os.path.join(args.root, 'raster')
+    start = time.perf_counter()
+    written = run(args.root, out_dir, args.resolution, args.workers, args.mesh_dir, args.force)
+    elapsed = time.perf_counter() - start
+    print(f'wrote {written} depth maps to {out_dir} in {elapsed:.1f} s ({written / max(elapsed, 1e-9):.1f} maps/s)')
+    sys.exit(0)
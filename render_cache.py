@@ -0,0 +1,205 @@
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import threading
+import argparse
+import numpy as np
+
+# content addressed cache of rendered outputs, shared by runs and workers
+# an entry is keyed by the hash of everything that goes into a render
+# (sensor parameters, object, mesh hash, pose, .blend hash) and holds the
+# files the render produced:
+#   <cache_dir>/<key[:2]>/<key>/image.png
+#   <cache_dir>/<key[:2]>/<key>/depth.npy       (samples only)
+# hits are hard linked into renders/ (copied across filesystems), the entry
+# directory mtime marks its last use and the least recently used entries are
+# evicted once the cache grows past its size bound. the size is kept as a
+# running total: every process scans the cache once for its starting size,
+# then adds the bytes that every put appends to <cache_dir>/added.i64, read
+# incrementally. later scans only happen to evict, down to LOW_WATER of the bound
+#
+#   python render_cache.py                  # size and entry count
+#   python render_cache.py --max-gb 10      # evict down to 10 gb
+
+cache_dir = os.environ.get('GELSIGHT_RENDER_CACHE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'render_cache'))
+
+# bump to invalidate every entry after changes to how scripting.py renders
+VERSION = 1
+
+SIZE_LOG = 'added.i64'
+LOW_WATER = 0.9
+
+
+# sha1 of a file, memoized by path, mtime and size
+_hashes = {}
+
+def file_hash(path) -> str:
+    stat = os.stat(path)
+    memo = (path, stat.st_mtime, stat.st_size)
+    if memo not in _hashes:
+        h = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        _hashes[memo] = h.hexdigest()
+    return _hashes[memo]
+
+# key of a render from json serializable inputs, floats are hashed at full precision
+
+def make_key(**inputs) -> str:
+    inputs['version'] = VERSION
+    return hashlib.sha1(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+# links src to dst, copying when a hard link is not possible
+
+def link_or_copy(src, dst) -> None:
+    if os.path.exists(dst): os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+class RenderCache():
+    # cache_dir: cache root, may be shared with other runs and workers
+    # max_bytes: size bound, None never evicts
+
+    def __init__(self, cache_dir=cache_dir, max_bytes=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.size_log = os.path.join(cache_dir, SIZE_LOG)
+        # running size estimate and how far into the size log it is counted
+        self.total = None
+        self.offset = 0
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def entry_dir(self, key) -> str:
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    # links the cached files of key to their destinations
+
+    # outputs: dict file name -> destination path, e.g. {'image.png': png_path}
+    # returns: True on a hit with every file present
+
+    def get(self, key, outputs) -> bool:
+        entry = self.entry_dir(key)
+        if not all(os.path.exists(os.path.join(entry, name)) for name in outputs): return False
+        try:
+            for name, dst in outputs.items(): link_or_copy(os.path.join(entry, name), dst)
+            os.utime(entry)
+        except FileNotFoundError:
+            # evicted by another worker in between
+            return False
+        return True
+
+    # loads one cached array, e.g. a depth map destined for a depth store
+
+    def load(self, key, name) -> np.ndarray:
+        return np.load(os.path.join(self.entry_dir(key), name))
+
+    # adds an entry, an existing entry of the same key is kept
+
+    # sources: dict file name -> source path or ndarray saved as .npy
+
+    def put(self, key, sources) -> None:
+        entry = self.entry_dir(key)
+        if os.path.exists(entry): return
+        tmp = f'{entry}.{os.getpid()}.{threading.get_ident()}.tmp'
+        os.makedirs(tmp, exist_ok=True)
+        try:
+            for name, src in sources.items():
+                if isinstance(src, np.ndarray): np.save(os.path.join(tmp, name), src)
+                else: link_or_copy(src, os.path.join(tmp, name))
+            size = sum(os.path.getsize(os.path.join(tmp, name)) for name in sources)
+            os.rename(tmp, entry)
+        except OSError:
+            # another worker added the entry first
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+
+        # appends below PIPE_BUF are atomic, workers never interleave entries
+        with open(self.size_log, 'ab') as f:
+            f.write(np.int64(size).tobytes())
+        if self.max_bytes is not None and self.size() > self.max_bytes:
+            self.evict(int(self.max_bytes * LOW_WATER))
+
+    # running size of the cache, adds the entries every process logged since the last call
+    # evictions by other processes are only seen at the next own scan, so it may overestimate
+
+    def size(self) -> int:
+        with self.lock:
+            if self.total is None:
+                self.offset = self.log_size()
+                self.total = sum(size for _, size, _ in self.entries())
+            end = self.log_size()
+            if end > self.offset:
+                self.total += int(np.fromfile(self.size_log, dtype=np.int64, count=(end - self.offset) // 8, offset=self.offset).sum())
+                self.offset = end
+            return self.total
+
+    def log_size(self) -> int:
+        try:
+            return os.path.getsize(self.size_log) // 8 * 8
+        except OSError:
+            return 0
+
+    # (mtime, bytes, path) of every entry
+    # hard linked files count fully, their space is only freed once renders/ drops them too
+
+    def entries(self) -> list:
+        entries = []
+        if not os.path.isdir(self.cache_dir): return entries
+        for prefix in os.listdir(self.cache_dir):
+            prefix_dir = os.path.join(self.cache_dir, prefix)
+            if not os.path.isdir(prefix_dir): continue
+            for key in os.listdir(prefix_dir):
+                entry = os.path.join(prefix_dir, key)
+                if key.endswith('.tmp'): continue
+                try:
+                    size = sum(os.path.getsize(os.path.join(entry, name)) for name in os.listdir(entry))
+                    entries.append((os.path.getmtime(entry), size, entry))
+                except FileNotFoundError:
+                    continue
+        return entries
+
+    # removes least recently used entries until the cache fits max_bytes
+
+    # returns: number of removed entries
+
+    def evict(self, max_bytes) -> int:
+        # entries added during the scan are counted twice, an overestimate
+        offset = self.log_size()
+        entries = self.entries()
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, entry in entries:
+            if total <= max_bytes: break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+            removed += 1
+        with self.lock:
+            self.total = total
+            self.offset = offset
+        return removed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Inspect or shrink the render cache.')
+    parser.add_argument('--cache-dir', default=cache_dir, help='cache directory (default: GELSIGHT_RENDER_CACHE or <repo>/render_cache)')
+    parser.add_argument('--max-gb', type=float, default=None, help='evict least recently used entries down to this size')
+    args = parser.parse_args()
+
+    cache = RenderCache(args.cache_dir)
+    if args.max_gb is not None:
+        removed = cache.evict(int(args.max_gb * 2**30))
+        print(f'evicted {removed} entries')
+    entries = cache.entries()
+    size = sum(size for _, size, _ in entries)
+    print(f'{len(entries)} entries, {size / 2**30:.2f} gb in {args.cache_dir}')
+    if len(entries) > 0:
+        print(f'least recently used {time.strftime("%Y-%m-%d %H:%M", time.localtime(min(entries)[0]))}')
+    sys.exit(0)
@@ -1,10 +1,26 @@
+import argparse
 import subprocess
+import json
 import sys
 import time
 import os
 
-def run_blender_once() -> int:
-    repo_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.dirname(os.path.abspath(__file__))
+render_dir = os.environ.get("GELSIGHT_RENDER_DIR", os.path.join(repo_dir, "renders"))
+
+# blender is supervised per worker by the progress it makes: the journal and
+# trace files it appends to (and plan.jsonl while worker 0 plans) are its
+# heartbeat. a worker that shows no progress for BLENDER_HANG_TIMEOUT seconds
+# is killed and restarted, BLENDER_MAX_RETRIES counts consecutive failed
+# attempts without progress in between, restarts back off exponentially from
+# BLENDER_BACKOFF seconds. every attempt is logged to renders/supervisor.jsonl
+# when worker 0 is given up before the setup is done the other workers are
+# abandoned: stopped and never restarted, as they could only wait for it
+STATS_NAME = "supervisor.jsonl"
+BACKOFF_MAX = 300
+KILL_GRACE = 10
+
+def blender_cmd(threads=None) -> list:
     blend_path = os.path.join(repo_dir, "gelsight_sampler.blend")
     script_path = os.path.join(repo_dir, "scripting.py")
 
@@ -12,32 +28,192 @@ def run_blender_once() -> int:
         "blender",
         "-b",
         blend_path,
+    ]
+    if threads is not None:
+        cmd += ["--threads", str(threads)]
+    cmd += [
         "--python-exit-code",
         "1",
         "--python",
         script_path,
     ]
+    return cmd
 
-    result = subprocess.run(cmd)
-    return result.returncode
+# starts one shard of a sharded run, scripting.py reads its shard from the environment
 
+def start_worker(worker, num_workers, attempt, threads=None) -> subprocess.Popen:
+    env = dict(os.environ,
+               GELSIGHT_WORKER=str(worker),
+               GELSIGHT_NUM_WORKERS=str(num_workers),
+               GELSIGHT_ATTEMPT=str(attempt))
+    return subprocess.Popen(blender_cmd(threads), env=env)
 
-if __name__ == "__main__":
-    max_retries = int(os.environ.get("BLENDER_MAX_RETRIES", "3"))
-    for attempt in range(1, max_retries + 1):
-        start_time = time.time()
-        print(f"starting blender attempt {attempt}/{max_retries}")
-        rc = run_blender_once()
-        elapsed_time = time.time() - start_time
-        print(f"ending blender attempt {attempt} with rc={rc} (elapsed {elapsed_time:.1f}s)")
+def journal_path(worker) -> str:
+    return os.path.join(render_dir, "journal", "worker_{0:04}.jsonl".format(worker))
+
+def file_size(path) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+# heartbeat of a worker, changes whenever it journals, traces or plans
+
+def progress(worker) -> tuple:
+    paths = [journal_path(worker), os.path.join(render_dir, "trace", "worker_{0:04}.jsonl".format(worker))]
+    if worker == 0: paths.append(os.path.join(render_dir, "plan.jsonl"))
+    return tuple(file_size(path) for path in paths)
+
+# samples a worker journaled after offset, a torn last line is not counted
+
+def count_samples(worker, offset) -> int:
+    try:
+        with open(journal_path(worker), "r") as f:
+            f.seek(offset)
+            lines = f.read().split("\n")[:-1]
+    except OSError:
+        return 0
+    return sum(1 for line in lines if '"kind": "sample"' in line)
+
+# stops a process, killing it if it ignores the terminate for KILL_GRACE seconds
+
+def stop(proc) -> int:
+    proc.terminate()
+    try:
+        return proc.wait(timeout=KILL_GRACE)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        return proc.wait()
+
+def log_attempt(stats) -> None:
+    os.makedirs(render_dir, exist_ok=True)
+    with open(os.path.join(render_dir, STATS_NAME), "a") as f:
+        f.write(json.dumps(stats) + "\n")
 
-        if rc == 0:
-            sys.exit(0)
+# runs num_workers blender processes side by side
+# each worker has its own retry budget and is restarted without touching the others
 
-        if attempt < max_retries:
-            time.sleep(2)
-            continue
+# max_retries: consecutive failed attempts of a worker without progress before it is given up
+# hang_timeout: seconds without progress after which a worker is killed, 0 never kills
+# backoff: delay before the first restart, doubled for every further failure in a row
 
-        sys.exit(rc)
+def run_workers(num_workers, max_retries, threads=None, hang_timeout=1800, backoff=2) -> int:
+    # worker 0 recreates the marker once the sensors are set up
+    ready_path = os.path.join(render_dir, ".ready")
+    if os.path.exists(ready_path): os.remove(ready_path)
 
+    procs = {}
+    attempts = {}
+    failures = {}
+    start_times = {}
+    start_offsets = {}
+    heartbeats = {}
+    last_progress = {}
+    hung = set()
+    # worker -> time it was abandoned
+    abandoned = {}
+    restart_at = {}
+    totals = {}
+    failed_rc = 0
+
+    def start(worker):
+        attempts[worker] += 1
+        print(f"starting worker {worker} attempt {attempts[worker]} ({failures[worker]}/{max_retries} failures without progress)")
+        start_times[worker] = last_progress[worker] = time.time()
+        start_offsets[worker] = file_size(journal_path(worker))
+        heartbeats[worker] = progress(worker)
+        procs[worker] = start_worker(worker, num_workers, attempts[worker], threads)
+
+    for worker in range(num_workers):
+        attempts[worker] = 0
+        failures[worker] = 0
+        totals[worker] = {"attempts": 0, "crashes": 0, "hangs": 0, "samples": 0, "elapsed": 0.0}
+        start(worker)
+
+    while procs or restart_at:
+        time.sleep(1)
+        now = time.time()
+
+        for worker, proc in list(procs.items()):
+            heartbeat = progress(worker)
+            # shards wait for worker 0's setup without journaling anything, as long as it may still come
+            setting_up = worker != 0 and (0 in procs or 0 in restart_at) and not os.path.exists(ready_path)
+            if heartbeat != heartbeats[worker] or setting_up:
+                heartbeats[worker] = heartbeat
+                last_progress[worker] = now
+                failures[worker] = 0
+
+            rc = proc.poll()
+            if rc is None and worker in abandoned:
+                if now - abandoned[worker] <= KILL_GRACE: continue
+                proc.kill()
+                rc = proc.wait()
+            if rc is None and hang_timeout > 0 and now - last_progress[worker] > hang_timeout:
+                print(f"worker {worker} made no progress for {now - last_progress[worker]:.0f}s, killing it")
+                hung.add(worker)
+                rc = stop(proc)
+            if rc is None: continue
+            del procs[worker]
+
+            elapsed_time = time.time() - start_times[worker]
+            samples = count_samples(worker, start_offsets[worker])
+            if worker in abandoned: outcome = "abandoned"
+            else: outcome = "ok" if rc == 0 else ("hang" if worker in hung else "crash")
+            hung.discard(worker)
+            print(f"ending worker {worker} attempt {attempts[worker]} with rc={rc} ({outcome}, {samples} samples, elapsed {elapsed_time:.1f}s)")
+            log_attempt({"time": now, "worker": worker, "attempt": attempts[worker], "rc": rc, "outcome": outcome,
+                         "elapsed": round(elapsed_time, 1), "samples": samples,
+                         "samples_per_hour": round(samples * 3600 / max(elapsed_time, 1e-9), 1)})
+            total = totals[worker]
+            total["attempts"] += 1
+            total["samples"] += samples
+            total["elapsed"] += elapsed_time
+            if outcome == "crash": total["crashes"] += 1
+            if outcome == "hang": total["hangs"] += 1
+
+            if rc == 0 or worker in abandoned: continue
+            failures[worker] += 1
+            if failures[worker] < max_retries:
+                delay = min(BACKOFF_MAX, backoff * 2 ** (failures[worker] - 1))
+                print(f"restarting worker {worker} in {delay:.0f}s")
+                restart_at[worker] = now + delay
+            else:
+                failed_rc = rc
+                print(f"giving up on worker {worker} after {failures[worker]} failures without progress")
+                # the other shards would wait forever for a setup that never happened
+                if worker == 0 and not os.path.exists(ready_path):
+                    for other, other_proc in procs.items():
+                        abandoned[other] = now
+                        other_proc.terminate()
+                    for other in restart_at: print(f"abandoning worker {other}")
+                    restart_at.clear()
+
+        for worker, when in list(restart_at.items()):
+            if when > now: continue
+            del restart_at[worker]
+            start(worker)
+
+    for worker, total in totals.items():
+        rate = total["samples"] * 3600 / max(total["elapsed"], 1e-9)
+        print(f"worker {worker}: {total['attempts']} attempts, {total['crashes']} crashes, {total['hangs']} hangs, "
+              f"{total['samples']} samples, {rate:.1f} samples/h")
+    return failed_rc
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run scripting.py in Blender, restarting it after crashes and hangs.")
+    parser.add_argument("-w", "--workers", type=int, default=int(os.environ.get("BLENDER_WORKERS", "1")),
+                        help="number of Blender processes, each rendering a disjoint shard of samples")
+    parser.add_argument("-t", "--threads", type=int, default=None,
+                        help="render threads per Blender process (default: cores / workers when sharded)")
+    parser.add_argument("--max-retries", type=int, default=int(os.environ.get("BLENDER_MAX_RETRIES", "3")),
+                        help="restarts of a worker in a row without progress before giving up")
+    parser.add_argument("--hang-timeout", type=float, default=float(os.environ.get("BLENDER_HANG_TIMEOUT", "1800")),
+                        help="seconds without journal or trace progress before a worker is killed, 0 disables")
+    parser.add_argument("--backoff", type=float, default=float(os.environ.get("BLENDER_BACKOFF", "2")),
+                        help="seconds before the first restart, doubled per failure in a row")
+    args = parser.parse_args()
 
+    threads = args.threads
+    if threads is None and args.workers > 1: threads = max(1, (os.cpu_count() or 1) // args.workers)
+    sys.exit(run_workers(args.workers, args.max_retries, threads, args.hang_timeout, args.backoff))
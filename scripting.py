@@ -21,6 +21,64 @@ CALIB_DEPTH_MAX = 0.0018
 OBJ_DEPTH_MIN = 0.0006
 OBJ_DEPTH_MAX = 0.0018
 
+# poses rendered by one sensor before switching to the next
+BLOCK_SIZE = 16
+
+# seconds a shard waits for worker 0 to set up the sensors before it fails
+READY_TIMEOUT = 3600
+
+# seed of the precomputed pose plan, None draws a random one
+PLAN_SEED = None
+
+# log per-stage timings to renders/trace/, summarize with python tracing.py
+TRACE = False
+
+# write depth maps into one chunked store per sensor instead of raw_data/*.npy
+DEPTH_STORE = False
+DEPTH_STORE_DTYPE = 'float32'
+
+# background threads writing depth maps and parameters, fsyncs are batched
+# over OUTPUT_SYNC_EVERY finished samples before they are journaled
+OUTPUT_THREADS = 2
+OUTPUT_QUEUE = 8
+OUTPUT_SYNC_EVERY = 16
+
+# reuse renders with identical inputs from earlier runs, see render_cache.py
+# the cache lives in <repo>/render_cache unless GELSIGHT_RENDER_CACHE points
+# elsewhere, the least recently used entries are evicted past RENDER_CACHE_MAX_GB
+RENDER_CACHE = False
+RENDER_CACHE_MAX_GB = 20
+
+# check planned poses in numpy and redraw those whose contact patch inside the
+# smallest sensor window is below MIN_CONTACT_AREA (m^2), poses still rejected
+# after MAX_POSE_TRIES draws are kept and flagged invalid in the plan
+VALIDATE_POSES = True
+MIN_CONTACT_AREA = 1e-6
+MAX_POSE_TRIES = 20
+
+# render samples as one unit strength pass per emittor, kept in passes/XXXX.npy
+# as LIGHT_PASS_DTYPE, and compose their png in numpy, other lightings of the
+# same geometry are then composed by python light_passes.py variants. the view transform is set to Standard and
+# the first LIGHT_PASS_CHECK samples of every sensor are also rendered directly
+# into passes/check/ for python light_passes.py validate
+LIGHT_PASSES = False
+LIGHT_PASS_CHECK = 2
+LIGHT_PASS_DTYPE = 'float16'
+
+# render meshes through the lods written by python mesh_lod.py, picking the coarsest
+# whose max surface error is below LOD_TOLERANCE pixels at the sampled object size
+MESH_LOD = True
+LOD_TOLERANCE = 1.0
+
+# seed of the sensor bank, None draws a random one
+SENSOR_SEED = None
+
+# also write the legacy sensor_XXXX/parameters.txt next to renders/sensors.npy
+SENSOR_PARAMETERS_TXT = True
+
+# restrict the lowest point search to convex hull vertices (needs scipy)
+LOWEST_USE_HULL = False
+
 # sensor parameters config
 
 FOV_MIN = 20
@@ -60,10 +118,13 @@ import bpy
 from random import uniform as ru
 from math import pi, tan
 import os
+import json
 import shutil
 import sys
+import time
 import numpy as np
 import random
+from functools import partial
 from mathutils import Euler
 
 # moves object to specified location and depth
@@ -73,13 +134,14 @@ from mathutils import Euler
 # object: string object file name
 # location: tuple (x,y,z), resonable x,y from -0.008 to 0.008, z upto 0.003
 # rotation: (x, y, x) in radians
+# rng: random source breaking ties between equally low vertices
 
-def move_object(object, location, rotation) -> None:
+def move_object(object, location, rotation, rng=random) -> None:
     bpy.data.objects[object].rotation_euler = rotation
     bpy.context.scene.frame_set(0)
     
     glbl_co = bpy.data.objects[object].location
-    low_co = find_lowest(object)
+    low_co = find_lowest(object, rng)
     
     x = glbl_co[0] - low_co[0] + location[0]
     y = glbl_co[1] - low_co[1] + location[1]
@@ -94,16 +156,12 @@ def move_object(object, location, rotation) -> None:
 
 # object: string object file name
 
-def find_lowest(object) -> float:
+def find_lowest(object, rng=random) -> float:
     obj = bpy.data.objects[object]
-    mw = obj.matrix_world
-    glbl_co = [ mw @ v.co for v in obj.data.vertices ]
-    minZ = min( [ co.z for co in glbl_co ] )
-    
-    lowest = []
-    for v in obj.data.vertices:
-        if (mw @ v.co).z == minZ: lowest.append(mw @ v.co)
-    return random.choice(lowest)
+    co = mesh_utils.get_vertices(obj)
+    hull = mesh_utils.get_hull(obj) if LOWEST_USE_HULL else None
+    lowest = mesh_utils.lowest_points(co, obj.matrix_world, hull)
+    return rng.choice(lowest)
 
 # changes color & strength of emittor surface
 
@@ -117,6 +175,18 @@ def set_emittor(emittor, strength, color) -> None:
     emission_node.inputs['Color'].default_value = color
     emission_node.inputs['Strength'].default_value =  strength
 
+# sets all four emittors, point lights are 5 times as strong
+
+# emittors: list of [strength, color] for top, bottom, left, right
+# light_type: 'long' or 'point'
+
+def set_emittors(emittors, light_type) -> None:
+    gain = 1 if light_type == 'long' else 5
+    set_emittor('TopEmittor', emittors[0][0]*gain, emittors[0][1])
+    set_emittor('BottomEmittor', emittors[1][0]*gain, emittors[1][1])
+    set_emittor('LeftEmittor', emittors[2][0]*gain, emittors[2][1])
+    set_emittor('RightEmittor', emittors[3][0]*gain, emittors[3][1])
+
 # sets smootheness of gel (emulating thickness/softness)
 
 # val: int, 1-120 for resonable results
@@ -168,9 +238,9 @@ def set_cam(fov, length) -> None:
 
     
 # class to store sensor variables and apply settings
+# sensors are drawn by sensor_params.sample_bank and passed in as params
 class create_sensor():
     def __init__(self, 
-                 randomize = True,
                  smoothness = None,
                  top_str = None,
                  top_col = (None, None, None, 1),
@@ -186,8 +256,7 @@ class create_sensor():
                  fov = None,
                  roughness = None,
                  length = None,
-                 write_dir = None,
-                 read_dir = None):
+                 params = None):
         
         self.smoothness = smoothness
         self.scale = scale
@@ -198,91 +267,30 @@ class create_sensor():
         self.roughness = roughness
         self.length = length
 
-        if read_dir != None:
-            f = open(read_dir, 'r')
-            content = f.readlines()
-
-            self.smoothness = int(content[0])
-            self.scale = float(content[1])
-            self.light_type = content[2].strip('\n')
-            self.angle = content[3].strip('\n')
-            self.emittors[0][0] = float(content[4])
-            self.emittors[0][1] = (float(content[5]), float(content[6]), float(content[7]), 1)
-            self.emittors[1][0] = float(content[8])
-            self.emittors[1][1] = (float(content[9]), float(content[10]), float(content[11]), 1)
-            self.emittors[2][0] = float(content[12])
-            self.emittors[2][1] = (float(content[13]), float(content[14]), float(content[15]), 1)
-            self.emittors[3][0] = float(content[16])
-            self.emittors[3][1] = (float(content[17]), float(content[18]), float(content[19]), 1)
-            self.fov = float(content[20])
-            self.roughness = float(content[21])
-            self.length = float(content[22])
-            
-        else:        
-            if randomize == True: self.randomize()
-
-            if write_dir != None:
-                f = open(write_dir,"w+")
-                f.write(f'{self.smoothness}\n')
-                f.write(f'{self.scale}\n')
-                f.write(f'{self.light_type}\n')
-                f.write(f'{self.angle}\n')
-                f.write(f'{self.emittors[0][0]}\n')
-                f.write(f'{self.emittors[0][1][0]}\n')
-                f.write(f'{self.emittors[0][1][1]}\n')
-                f.write(f'{self.emittors[0][1][2]}\n')
-                f.write(f'{self.emittors[1][0]}\n')
-                f.write(f'{self.emittors[1][1][0]}\n')
-                f.write(f'{self.emittors[1][1][1]}\n')
-                f.write(f'{self.emittors[1][1][2]}\n')
-                f.write(f'{self.emittors[2][0]}\n')
-                f.write(f'{self.emittors[2][1][0]}\n')
-                f.write(f'{self.emittors[2][1][1]}\n')
-                f.write(f'{self.emittors[2][1][2]}\n')
-                f.write(f'{self.emittors[3][0]}\n')
-                f.write(f'{self.emittors[3][1][0]}\n')
-                f.write(f'{self.emittors[3][1][1]}\n')
-                f.write(f'{self.emittors[3][1][2]}\n')
-                f.write(f'{self.fov}\n')
-                f.write(f'{self.roughness}\n')
-                f.write(f'{self.length}\n')
-                f.close()
-
-    def randomize(self):
-        self.smoothness = random.randrange(SMOOTHNESS_MIN, SMOOTHNESS_MAX)
-        self.scale = ru(SCALE_MIN, SCALE_MAX)
-        self.fov = ru(FOV_MIN, FOV_MAX)
-        self.roughness = ru(ROUGH_MIN, ROUGH_MAX)
-        self.length = ru(LENGTH_MIN, LENGTH_MAX)
-        
-        if random.random() < 0.35: self.angle = 'diag'
-        else: self.angle = 'str'
-        
-        if random.random() < 0.35: self.light_type = 'point'
-        else: self.light_type = 'long'
-
-        emittors = ['RED','GREEN','BLUE','BLOCK']
-        emittors = random.sample(emittors, 4)
-
-        for idx, emittor in enumerate(emittors):
-            if emittor == 'RED':
-                self.emittors[idx][0] =  ru(RED_STR_MIN, RED_STR_MAX)
-                self.emittors[idx][1] =  (ru(RED_COL_MIN[0], RED_COL_MAX[0]), 
-                                          ru(RED_COL_MIN[1], RED_COL_MAX[1]), 
-                                          ru(RED_COL_MIN[2], RED_COL_MAX[2]), 1)
-            if emittor == 'GREEN':
-                self.emittors[idx][0] =  ru(GREEN_STR_MIN, GREEN_STR_MAX)
-                self.emittors[idx][1] =  (ru(GREEN_COL_MIN[0], GREEN_COL_MAX[0]), 
-                                          ru(GREEN_COL_MIN[1], GREEN_COL_MAX[1]), 
-                                          ru(GREEN_COL_MIN[2], GREEN_COL_MAX[2]), 1)
-            if emittor == 'BLUE':
-                self.emittors[idx][0] =  ru(BLUE_STR_MIN, BLUE_STR_MAX)
-                self.emittors[idx][1] =  (ru(BLUE_COL_MIN[0], BLUE_COL_MAX[0]), 
-                                          ru(BLUE_COL_MIN[1], BLUE_COL_MAX[1]), 
-                                          ru(BLUE_COL_MIN[2], BLUE_COL_MAX[2]), 1)
-            if emittor == 'BLOCK':
-                self.emittors[idx][0] =  0
-                self.emittors[idx][1] =  (0, 0, 0, 1)
+        if params != None:
+            self.set_parameters(params)
+
+    def set_parameters(self, params):
+        self.smoothness = params['smoothness']
+        self.scale = params['scale']
+        self.light_type = params['light_type']
+        self.angle = params['angle']
+        self.emittors = [[strength, tuple(color)] for strength, color in params['emittors']]
+        self.fov = params['fov']
+        self.roughness = params['roughness']
+        self.length = params['length']
+
+    # parameters in the format of sensor_params.py, copied so later changes don't leak into queued writes
+
+    def get_parameters(self) -> dict:
+        return {'smoothness': self.smoothness,
+                'scale': self.scale,
+                'light_type': self.light_type,
+                'angle': self.angle,
+                'emittors': [[strength, tuple(color)] for strength, color in self.emittors],
+                'fov': self.fov,
+                'roughness': self.roughness,
+                'length': self.length}
 
     def apply(self):
         set_smoothness(self.smoothness)
@@ -304,53 +312,199 @@ class create_sensor():
         bpy.data.objects['LightSurfaceLeft'].matrix_world = rot_mat @ bpy.data.objects['LightSurfaceLeft'].matrix_world
         bpy.data.objects['LightSurfaceRight'].matrix_world = rot_mat @ bpy.data.objects['LightSurfaceRight'].matrix_world
         
-        if self.light_type == 'long': 
-            set_emittor('TopEmittor', self.emittors[0][0], self.emittors[0][1])
-            set_emittor('BottomEmittor', self.emittors[1][0], self.emittors[1][1])
-            set_emittor('LeftEmittor', self.emittors[2][0], self.emittors[2][1])
-            set_emittor('RightEmittor', self.emittors[3][0], self.emittors[3][1])
-        else:
-            set_emittor('TopEmittor', self.emittors[0][0]*5, self.emittors[0][1])
-            set_emittor('BottomEmittor', self.emittors[1][0]*5, self.emittors[1][1])
-            set_emittor('LeftEmittor', self.emittors[2][0]*5, self.emittors[2][1])
-            set_emittor('RightEmittor', self.emittors[3][0]*5, self.emittors[3][1])
+        set_emittors(self.emittors, self.light_type)
 
 # get depth map from range 0 - 3 mm
 # messes up current sensor values
 
-def get_depth(dir) -> None:
-    # apply orthogonal camera standardizations and remove obstructions
-    # bpy.data.objects["InterfaceSurface"].hide_render = True
-    # bpy.data.objects["EpoxySurface"].hide_render = True
-    
-    z = bpy.data.images['Viewer Node']
-    w, h = z.size
-    dmap = np.array(z.pixels[:], dtype=np.float32) # convert to numpy array
-    dmap = np.reshape(dmap, (h, w, 4))[:,:,0]
-    dmap = np.rot90(dmap, k=2)
-    dmap = np.fliplr(dmap)
-    dmap = 1 - dmap
-    np.save(dir, dmap)
-    
-    # undo changes
-    # bpy.data.objects["InterfaceSurface"].hide_render = False
-    # bpy.data.objects["EpoxySurface"].hide_render = False
+# copy: return a new array instead of the reused readout buffer
+
+def read_depth(copy=False) -> np.ndarray:
+    # without copy the buffer is overwritten by the next readout
+    return depth_readout.read(bpy.data.images['Viewer Node'], copy)
+
+# saves the depth map as raw_data/XXXX.npy, or appends it to the sensor's depth store
+
+# dir: path of the .npy file
+# store: optional depth_store.DepthStoreWriter of the sensor
+# sample_idx: int sample index, needed with a store
+
+def get_depth(dir, store=None, sample_idx=None) -> None:
+    save_depth(dir, read_depth(), store, sample_idx)
+
+def save_depth(dir, dmap, store=None, sample_idx=None) -> None:
+    if store is not None:
+        store.append(sample_idx, dmap)
+        return
+    # written under a temporary name so post_process.py --follow never reads a partial file
+    tmp = dir + '.tmp'
+    with open(tmp, 'wb') as f:
+        np.save(f, dmap)
+    os.replace(tmp, dir)
+
+# renders the scene to filepath.png
+# an existing file is removed first since it may be hard linked into the render cache
+
+# extension: extension blender adds for the scene's output format
+
+def render_still(filepath, extension='.png') -> None:
+    if os.path.exists(filepath + extension): os.remove(filepath + extension)
+    bpy.context.scene.render.filepath = filepath
+    bpy.context.scene.frame_set(0)
+    bpy.ops.render.render(write_still=True)
+
+# renders one linear pass per emittor with only that emittor on, at unit
+# strength and white, then restores the sensor's emittors
+
+# prefix: path of the temporary .exr renders without side and extension
+# sensor: the applied create_sensor
+# returns: (4, h, w, 3) float32 passes, top row first
+
+def render_passes(prefix, sensor) -> np.ndarray:
+    settings = bpy.context.scene.render.image_settings
+    previous = (settings.file_format, settings.color_mode, settings.color_depth)
+    settings.file_format = 'OPEN_EXR'
+    settings.color_mode = 'RGB'
+    settings.color_depth = '32'
+    passes = []
+    try:
+        for side_idx, side in enumerate(light_passes.SIDES):
+            set_emittors([[1 if idx == side_idx else 0, (1, 1, 1, 1)] for idx in range(4)], 'long')
+            render_still(f'{prefix}_{side}', '.exr')
+            passes.append(read_pass(f'{prefix}_{side}.exr'))
+            os.remove(f'{prefix}_{side}.exr')
+    finally:
+        settings.file_format, settings.color_mode, settings.color_depth = previous
+        set_emittors(sensor.emittors, sensor.light_type)
+    return np.stack(passes)
+
+# linear (h, w, 3) pixels of an .exr render, top row first
+
+def read_pass(path) -> np.ndarray:
+    image = bpy.data.images.load(path, check_existing=False)
+    try:
+        w, h = image.size
+        rgba = np.empty((h, w, 4), dtype=np.float32)
+        image.pixels.foreach_get(rgba.ravel())
+    finally:
+        bpy.data.images.remove(image)
+    return np.ascontiguousarray(rgba[::-1, :, :3])
+
+# png of a sample composed from its passes with the sensor's emittor weights
+
+def save_composite(png_path, passes, weights) -> None:
+    light_passes.write_png(png_path, light_passes.encode(light_passes.composite(passes, weights)))
+
+# saves a rendered sample's depth map, then adds the sample to the render cache
+
+# cache: optional render_cache.RenderCache
+# cache_key: render cache key of the sample
+
+# passes: optional (4, h, w, 3) light passes the png is composed from, cached instead of the png
+# weights: (4, 3) emittor weights of the composition
+# pass_path: where new passes are saved, None when they are already in place
+# dmap: None when the depth map is already in place
+
+def save_sample(depth_path, dmap, store, sample_idx, png_path, cache=None, cache_key=None, passes=None, weights=None, pass_path=None) -> None:
+    if passes is not None: save_composite(png_path, passes, weights)
+    if pass_path is not None: light_passes.save_passes(pass_path, passes, LIGHT_PASS_DTYPE)
+    if dmap is not None: save_depth(depth_path, dmap, store, sample_idx)
+    if cache is None: return
+    files = {'image.png': png_path} if passes is None else {'passes.npy': pass_path}
+    files['depth.npy'] = depth_path if store is None else dmap
+    cache.put(cache_key, files)
+
+# places an object with an exact scale, rotation and location, e.g. from the journal
+
+def place_object(object, scale, rotation, location) -> None:
+    bpy.data.objects[object].scale = scale
+    bpy.data.objects[object].rotation_euler = rotation
+    bpy.data.objects[object].location = location
+    bpy.context.scene.frame_set(0)
+
+    bpy.data.objects[object].hide_render = True
+    bpy.data.objects['GelSurface'].modifiers["Shrinkwrap"].target = bpy.data.objects[object]
+
+# imports a mesh from mesh_dir unless it is already in the scene
+# only the meshes a run actually samples are parsed by blender
+
+# name: string mesh file name without .obj, or the name of one of its lods
+
+def load_mesh(name) -> None:
+    if name in bpy.data.objects: return
+    path = mesh_lod.mesh_path(name, mesh_dir)
+    bpy.ops.wm.obj_import(filepath=path, directory=os.path.dirname(path), files=[{"name":name + '.obj'}])
+    bpy.data.objects[name].hide_render = True
+    # a new object may reuse the name of a removed one
+    mesh_utils.invalidate(name)
+    loaded_meshes.append(name)
 
 dir = os.path.dirname(bpy.data.filepath)
 sys.path.append(dir)
+import mesh_utils
+import mesh_cache
+import journal
+import depth_store
+import tracing
+import depth_readout
+import output_writer
+import render_cache
+import mesh_lod
+import pose_validator
+import light_passes
+import sensor_params
+import plan as sample_plan
 render_dir = os.environ.get('GELSIGHT_RENDER_DIR', os.path.join(dir, 'renders'))
 mesh_dir = os.path.join(dir, 'meshes')
 
+# sharding set by run_blender.py --workers, each worker renders sample indices
+# WORKER_ID, WORKER_ID + NUM_WORKERS, ... and calibrates the matching sensors
+WORKER_ID = int(os.environ.get('GELSIGHT_WORKER', '0'))
+NUM_WORKERS = int(os.environ.get('GELSIGHT_NUM_WORKERS', '1'))
+ATTEMPT = int(os.environ.get('GELSIGHT_ATTEMPT', '1'))
+
+# written by worker 0 once the sensor directories exist
+ready_dir = os.path.join(render_dir, '.ready')
+
+# OutputWriter of the main loop, None writes synchronously
+output = None
+
+# meshes imported by load_mesh, removed at the end of a run
+loaded_meshes = []
+
 if __name__ == '__main__':
 
-    sensors = []
-    if not CONTINUE:
+    # other shards wait for worker 0 to set up the sensors, then resume from them
+    if NUM_WORKERS > 1 and WORKER_ID != 0:
+        ready_wait = time.time()
+        while not os.path.exists(ready_dir):
+            if time.time() - ready_wait > READY_TIMEOUT:
+                print(f'worker {WORKER_ID}: worker 0 did not set up the sensors within {READY_TIMEOUT}s')
+                sys.exit(1)
+            time.sleep(1)
+        CONTINUE = True
+    # restarted workers resume, a wipe would lose the progress of every attempt and shard
+    if ATTEMPT > 1:
+        CONTINUE = True
+
+    output = output_writer.OutputWriter(OUTPUT_THREADS, OUTPUT_QUEUE, OUTPUT_SYNC_EVERY)
+
+    # composed passes are encoded like the Standard view transform without dithering
+    if LIGHT_PASSES:
+        bpy.context.scene.view_settings.view_transform = 'Standard'
+        bpy.context.scene.view_settings.look = 'None'
+        bpy.context.scene.render.dither_intensity = 0
+    view = bpy.context.scene.view_settings.view_transform
+
+    if not CONTINUE or not os.path.exists(render_dir):
         # create file directory to store renders
         if os.path.exists(render_dir): shutil.rmtree(render_dir)
         os.mkdir(render_dir)
-    
-        # generate different sensors and paths
-        
+
+        # draw all sensors at once into the sensor bank, then create their paths
+        bank = sensor_params.sample_bank(NUM_SENSORS, globals(), np.random.default_rng(SENSOR_SEED))
+        sensor_params.write_bank(render_dir, bank)
+
         for idx in range(NUM_SENSORS):
             idx_formatted = '{0:04}'.format(idx)
             sensor_dir = os.path.join(render_dir, f'sensor_{idx_formatted}')
@@ -359,146 +513,272 @@ if __name__ == '__main__':
             os.mkdir(os.path.join(sensor_dir, 'samples'))
             os.mkdir(os.path.join(sensor_dir, 'raw_data'))
 
-            sensor_txt_dir = os.path.join(sensor_dir, 'parameters.txt')
-            sensors.append(create_sensor(write_dir=sensor_txt_dir))
-    
-    else: 
-        # if it does exist
-        if os.path.exists(render_dir):
-            sensor_dirs = [sensor_dir for sensor_dir in os.listdir(render_dir) if 'sensor' in sensor_dir]
-            sensor_dirs.sort()
-            for sensor_dir in sensor_dirs:
-                sensor_txt_dir = os.path.join(render_dir, sensor_dir, 'parameters.txt')
-                sensors.append(create_sensor(read_dir=sensor_txt_dir))
-        else: 
-            os.mkdir(render_dir)
-            # generate different sensors and paths
-            
-            for idx in range(NUM_SENSORS):
-                idx_formatted = '{0:04}'.format(idx)
-                sensor_dir = os.path.join(render_dir, f'sensor_{idx_formatted}')
-                os.mkdir(os.path.join(sensor_dir))
-                os.mkdir(os.path.join(sensor_dir, 'calibration'))
-                os.mkdir(os.path.join(sensor_dir, 'samples'))
-                os.mkdir(os.path.join(sensor_dir, 'raw_data'))
-
+            if SENSOR_PARAMETERS_TXT:
                 sensor_txt_dir = os.path.join(sensor_dir, 'parameters.txt')
-                sensors.append(create_sensor(write_dir=sensor_txt_dir))
-
-    # generate calibration for all sensors
+                output.submit(sensor_params.write_parameters, sensor_txt_dir, sensor_params.to_params(bank[idx]), paths=[sensor_txt_dir])
+
+    # runs from before the sensor bank keep their sensors, imported once by worker 0
+    # before it writes .ready, the other shards only start once the bank exists
+    elif WORKER_ID == 0 and not sensor_params.bank_exists(render_dir):
+        sensor_params.write_bank(render_dir, sensor_params.import_legacy(render_dir))
+
+    bank = sensor_params.load_bank(render_dir)
+    sensors = [create_sensor(params=sensor_params.to_params(row)) for row in bank]
+
+    # runs that predate the journal are resumed from their files once
+    if WORKER_ID == 0:
+        if CONTINUE and not journal.exists(render_dir):
+            journal.import_legacy(render_dir, len(sensors), NUM_OBJ_SAMPLES)
+        # poses without a visible contact patch are redrawn before anything is rendered
+        validator = None
+        if VALIDATE_POSES:
+            scene_render = bpy.context.scene.render
+            window = pose_validator.sensor_window(min(sensor.length for sensor in sensors), (scene_render.resolution_x, scene_render.resolution_y))
+            validator = pose_validator.PoseValidator(mesh_dir, window, MIN_CONTACT_AREA)
+        samples = sample_plan.extend_plan(render_dir, NUM_OBJ_SAMPLES, mesh_cache.list_meshes(mesh_dir), globals(), PLAN_SEED, validator, MAX_POSE_TRIES)
+        if validator is not None and validator.summary()['drawn'] > 0:
+            total = pose_validator.save_summary(render_dir, validator.summary(), len(sample_plan.invalid_samples(samples)))
+            print(f"pose validator: accepted {validator.accepted} of {validator.summary()['drawn']} poses, {total['acceptance_rate']:.1%} over the run, {total['invalid']} samples without a valid pose")
+        # legacy parameters.txt files are complete once .ready exists
+        output.flush()
+        open(ready_dir, 'w').close()
+
+    state = journal.load_state(render_dir)
+    log = journal.Journal(render_dir, 'worker_{0:04}'.format(WORKER_ID))
+    output.commit = log.sync
+    tracer = tracing.Tracer(render_dir, WORKER_ID, ATTEMPT, enabled=TRACE)
+
+    cache = None
+    if RENDER_CACHE:
+        cache = render_cache.RenderCache(max_bytes=int(RENDER_CACHE_MAX_GB * 2**30))
+        blend_hash = render_cache.file_hash(bpy.data.filepath)
+    mesh_hashes = {}
+
+    # generate calibration for all sensors of this shard
     calibration_objects = ['IndenterSurface', 'Cube']
     for sensor_idx, sensor in enumerate(sensors):
+        if sensor_idx % NUM_WORKERS != WORKER_ID: continue
         sensor_idx_formatted = '{0:04}'.format(sensor_idx)
         sensor_dir = os.path.join(render_dir, f'sensor_{sensor_idx_formatted}')
 
-        if CONTINUE:
-            if len(os.listdir(os.path.join(sensor_dir, 'calibration'))) < (NUM_CALIBRATION * len(calibration_objects) + 1):
-                shutil.rmtree(os.path.join(sensor_dir, 'calibration'))
-                os.mkdir(os.path.join(sensor_dir, 'calibration'))
-            else: continue
+        pending = [idx for idx in range(NUM_CALIBRATION * len(calibration_objects) + 1) if not state.is_done('calib', sensor_idx, idx)]
+        if len(pending) == 0: continue
 
-        sensor.apply()
-        
-        overall_calib_idx = 0
-        calib_idx_formatted = '{0:04}'.format(overall_calib_idx)
-        bpy.context.scene.render.filepath = os.path.join(sensor_dir, 'calibration', calib_idx_formatted)
-        move_object('IndenterSurface', (0,0,-1), (0,0,0))
-        bpy.context.scene.frame_set(0)
-        bpy.ops.render.render(write_still=True)
-        overall_calib_idx += 1
-        
         qt = (sensor.length*2)/3
         
         CALIB_X = [qt, 0, -qt, qt, 0, -qt, qt, 0, -qt]
         CALIB_Y = [qt, qt, qt, 0, 0, 0, -qt, -qt, -qt]
+
+        # the sensor is only applied once a calibration misses the render cache
+        params = sensor.get_parameters()
+        applied = False
         
-        for obj_idx, calib_obj in enumerate(calibration_objects):
-            for calib_idx in range(NUM_CALIBRATION):
+        for overall_calib_idx in pending:
+            with tracer.stage('calibration', sensor_idx, overall_calib_idx):
                 calib_idx_formatted = '{0:04}'.format(overall_calib_idx)
-                bpy.context.scene.render.filepath = os.path.join(sensor_dir, 'calibration', calib_idx_formatted)
-                
-                x = ru(-0.001, 0.001) + CALIB_X[calib_idx]
-                y = ru(-0.001, 0.001) + CALIB_Y[calib_idx]
+                calib_path = os.path.join(sensor_dir, 'calibration', calib_idx_formatted)
 
-                z = ru(CALIB_DEPTH_MIN, CALIB_DEPTH_MAX)
-                
-                a_x = pi/4
-                a_y = pi/4
-                a_z = ru(0, 2*pi)
-                
-                move_object(calib_obj, (x,y,z), (a_x,a_y,a_z))
-                
-                bpy.context.scene.frame_set(0)
-                bpy.ops.render.render(write_still=True)
+                # poses derive from the sensor, so identical sensors calibrate identically
+                rng = random.Random(json.dumps([params, overall_calib_idx]))
+                if overall_calib_idx == 0:
+                    calib_obj, location, rotation = 'IndenterSurface', (0,0,-1), (0,0,0)
+                else:
+                    calib_obj = calibration_objects[(overall_calib_idx - 1) // NUM_CALIBRATION]
+                    calib_idx = (overall_calib_idx - 1) % NUM_CALIBRATION
+
+                    x = rng.uniform(-0.001, 0.001) + CALIB_X[calib_idx]
+                    y = rng.uniform(-0.001, 0.001) + CALIB_Y[calib_idx]
+
+                    z = rng.uniform(CALIB_DEPTH_MIN, CALIB_DEPTH_MAX)
                 
-                overall_calib_idx += 1
-
-    # import all meshes into blender
-    obj_dir = os.listdir(mesh_dir)
-    obj_dir.sort()
-    for obj_idx, obj in enumerate(obj_dir):
-        bpy.ops.wm.obj_import(filepath=os.path.join(mesh_dir, obj), directory=mesh_dir, files=[{"name":object, "name":obj}])
-        obj_dir[obj_idx] = obj.replace('.obj','')
-        bpy.data.objects[obj_dir[obj_idx]].hide_render = True
-
-    # remove incomplete render batch
-    if CONTINUE:
-        sensor_idx_formatted = '{0:04}'.format(0)
-        first_sensor_samples = os.listdir(os.path.join(render_dir, f'sensor_{sensor_idx_formatted}', 'samples'))
-        sensor_idx_formatted = '{0:04}'.format(NUM_SENSORS-1)
-        last_sensor_samples = os.listdir(os.path.join(render_dir, f'sensor_{sensor_idx_formatted}', 'samples'))
-
-        overall_idx = min(len(first_sensor_samples), len(last_sensor_samples))
-        sample_idx_formatted = '{0:04}'.format(overall_idx)
-
-        if len(first_sensor_samples) != len(last_sensor_samples):
-            for sensor_idx, sensor in enumerate(sensors):
-                sensor_idx_formatted = '{0:04}'.format(sensor_idx)
-                sample_dir = os.path.join(render_dir, f'sensor_{sensor_idx_formatted}', 'samples', f'{sample_idx_formatted}.png')
-                dmap_dir = os.path.join(render_dir, f'sensor_{sensor_idx_formatted}', 'raw_data', f'{sample_idx_formatted}.npy')
-                if os.path.exists(sample_dir): os.remove(sample_dir)
-                if os.path.exists(dmap_dir): os.remove(dmap_dir)
-
-    else: overall_idx = 0
-
-    # generate samples for all sensors
-    for sample_idx in range(overall_idx, NUM_OBJ_SAMPLES):
-        # select and scale random object
-        obj = random.choice(obj_dir)
-        scale = max(bpy.data.objects[obj].dimensions) / ru(OBJ_SIZE_MIN, OBJ_SIZE_MAX)
-        cur_scale = bpy.data.objects[obj].scale
-        bpy.data.objects[obj].scale = (cur_scale[0] / scale, cur_scale[1] / scale, cur_scale[2] / scale)
-
-        x = ru(X_MIN, X_MAX)
-        y = ru(Y_MIN, Y_MAX)
-        z = ru(OBJ_DEPTH_MIN, OBJ_DEPTH_MAX)
-
-        a_x = ru(0, 2*pi)
-        a_y = ru(0, 2*pi)
-        a_z = ru(0, 2*pi)
-        
-        move_object(obj, (x,y,z), (a_x,a_y,a_z))
-        
-        overall_idx_formatted = '{0:04}'.format(overall_idx)
-    
+                    a_x = pi/4
+                    a_y = pi/4
+                    a_z = rng.uniform(0, 2*pi)
+                    location, rotation = (x,y,z), (a_x,a_y,a_z)
+
+                hit = False
+                if cache is not None:
+                    cache_key = render_cache.make_key(kind='calib', sensor=params, blend=blend_hash, view=view, obj=calib_obj, location=location, rotation=rotation)
+                    with tracer.stage('cache', sensor_idx, overall_calib_idx):
+                        hit = cache.get(cache_key, {'image.png': calib_path + '.png'})
+
+                if not hit:
+                    if not applied:
+                        with tracer.stage('apply', sensor_idx):
+                            sensor.apply()
+                        applied = True
+
+                    with tracer.stage('move', sensor_idx, overall_calib_idx):
+                        move_object(calib_obj, location, rotation, rng)
+                    with tracer.stage('render', sensor_idx, overall_calib_idx):
+                        render_still(calib_path)
+                    if cache is not None: cache.put(cache_key, {'image.png': calib_path + '.png'})
+
+                with tracer.stage('journal', sensor_idx, overall_calib_idx):
+                    log.append('calib', overall_calib_idx, sensor_idx)
+
+    # object choices and poses drawn by worker 0, meshes are imported into blender on first use
+    plan = sample_plan.load_plan(render_dir)
+
+    # coarsest lod whose surface error stays below a pixel of the finest sensor, every
+    # sensor sees the full 2 * length of the gel across the larger image side
+    lod_index = mesh_lod.load_index(mesh_dir) if MESH_LOD else {}
+    scene_render = bpy.context.scene.render
+    resolution = max(scene_render.resolution_x, scene_render.resolution_y) * scene_render.resolution_percentage / 100
+    footprint = 2 * min(sensor.length for sensor in sensors) / resolution
+
+    stores = [None] * len(sensors)
+    if DEPTH_STORE:
+        for sensor_idx in range(len(sensors)):
+            sensor_dir = os.path.join(render_dir, 'sensor_{0:04}'.format(sensor_idx))
+            stores[sensor_idx] = depth_store.DepthStoreWriter(sensor_dir, 'worker_{0:04}'.format(WORKER_ID), dtype=DEPTH_STORE_DTYPE)
+            output.syncs.append(stores[sensor_idx].flush)
+
+    # samples of this shard with the sensors still missing them in the journal
+    todo = []
+    for overall_idx in range(WORKER_ID, NUM_OBJ_SAMPLES, NUM_WORKERS):
+        missing = state.missing_sensors(overall_idx, len(sensors))
+        if len(missing) > 0: todo.append((overall_idx, missing))
+
+    # poses this worker placed, replayed exactly when other sensors render them
+    placements = {}
+
+    # places the object of a sample, from the journal if it was partially
+    # rendered before, otherwise from the plan with the sample's own seed
+
+    def pose_sample(overall_idx, resumed):
+        if overall_idx in placements:
+            place_object(*placements[overall_idx])
+            return
+
+        pose = state.poses.get(overall_idx)
+        if pose is not None and resumed:
+            # finish a partially rendered sample with its recorded pose
+            obj = pose['obj']
+            with tracer.stage('load_mesh', sample=overall_idx):
+                load_mesh(obj)
+            place_object(obj, pose['scale'], pose['rotation'], pose['location'])
+        else:
+            entry = plan[overall_idx]
+            obj = mesh_lod.select_lod(lod_index, entry['obj'], entry['size'], LOD_TOLERANCE * footprint)
+            with tracer.stage('load_mesh', sample=overall_idx):
+                load_mesh(obj)
+
+            # scale object to its planned size
+            scale = max(bpy.data.objects[obj].dimensions) / entry['size']
+            cur_scale = bpy.data.objects[obj].scale
+            bpy.data.objects[obj].scale = (cur_scale[0] / scale, cur_scale[1] / scale, cur_scale[2] / scale)
+
+            move_object(obj, entry['location'], entry['rotation'], random.Random(entry['seed']))
+
+            # write ahead so a crash mid-sample can be finished with the same pose
+            placed = bpy.data.objects[obj]
+            log.append('pose', overall_idx, obj=obj,
+                       scale=list(placed.scale), rotation=list(placed.rotation_euler), location=list(placed.location))
+
+        placed = bpy.data.objects[obj]
+        placements[overall_idx] = (obj, tuple(placed.scale), tuple(placed.rotation_euler), tuple(placed.location))
+
+    # generate samples sensor-major: every sensor renders a block of poses
+    # before the next one is applied, so the scene is reconfigured once per block
+    for block_start in range(0, len(todo), BLOCK_SIZE):
+        block = todo[block_start:block_start + BLOCK_SIZE]
+
         for sensor_idx, sensor in enumerate(sensors):
+            units = [(overall_idx, len(missing) < len(sensors)) for overall_idx, missing in block if sensor_idx in missing]
+            if len(units) == 0: continue
+
             sensor_idx_formatted = '{0:04}'.format(sensor_idx)
             sensor_dir = os.path.join(render_dir, f'sensor_{sensor_idx_formatted}')
-            sensor.apply()
-            
-            bpy.context.scene.render.filepath = os.path.join(sensor_dir, 'samples', overall_idx_formatted)
-
-            bpy.context.scene.frame_set(0)
-            bpy.ops.render.render(write_still=True)
-            get_depth(os.path.join(sensor_dir, 'raw_data', f'{overall_idx_formatted}.npy'))
-
-        overall_idx += 1
+            params = sensor.get_parameters()
+            applied = False
+            if LIGHT_PASSES:
+                weights = sensor_params.emitter_weights(params)
+                os.makedirs(os.path.join(sensor_dir, light_passes.PASS_DIR, light_passes.CHECK_DIR), exist_ok=True)
+
+            for overall_idx, resumed in units:
+                with tracer.stage('sample', sensor_idx, overall_idx):
+                    overall_idx_formatted = '{0:04}'.format(overall_idx)
+                    with tracer.stage('move', sensor_idx, overall_idx):
+                        pose_sample(overall_idx, resumed)
+
+                    sample_path = os.path.join(sensor_dir, 'samples', overall_idx_formatted)
+                    depth_path = os.path.join(sensor_dir, 'raw_data', f'{overall_idx_formatted}.npy')
+                    store = stores[sensor_idx]
+                    paths = [sample_path + '.png']
+                    if store is None: paths.append(depth_path)
+                    journal_sample = partial(log.append, 'sample', overall_idx, sensor_idx, sync=False)
+                    pass_path = light_passes.pass_path(sensor_dir, overall_idx_formatted)
+                    if LIGHT_PASSES: paths.append(pass_path)
+
+                    # reuse an identical render of an earlier run
+                    if cache is not None:
+                        obj, scale, rotation, location = placements[overall_idx]
+                        if obj not in mesh_hashes: mesh_hashes[obj] = render_cache.file_hash(mesh_lod.mesh_path(obj, mesh_dir))
+                        # passes do not depend on the emittors, every lighting of a geometry shares them
+                        if LIGHT_PASSES:
+                            cache_key = render_cache.make_key(kind='passes', sensor=light_passes.geometry_params(params), blend=blend_hash, dtype=LIGHT_PASS_DTYPE, obj=obj, mesh=mesh_hashes[obj],
+                                                        scale=scale, rotation=rotation, location=location)
+                        else:
+                            cache_key = render_cache.make_key(kind='sample', sensor=params, blend=blend_hash, view=view, obj=obj, mesh=mesh_hashes[obj],
+                                                        scale=scale, rotation=rotation, location=location)
+                        with tracer.stage('cache', sensor_idx, overall_idx):
+                            if LIGHT_PASSES: outputs = {'passes.npy': pass_path}
+                            else: outputs = {'image.png': sample_path + '.png'}
+                            if store is None: outputs['depth.npy'] = depth_path
+                            hit = cache.get(cache_key, outputs)
+                        if hit:
+                            dmap = None if store is None else cache.load(cache_key, 'depth.npy')
+                            if LIGHT_PASSES:
+                                passes = light_passes.load_passes(pass_path)
+                                output.submit(save_sample, depth_path, dmap, store, overall_idx, sample_path + '.png', passes=passes, weights=weights,
+                                              key=sensor_idx, paths=paths, on_done=journal_sample)
+                            elif store is None: output.submit(lambda: None, key=sensor_idx, paths=paths, on_done=journal_sample)
+                            else: output.submit(save_depth, depth_path, dmap, store, overall_idx, key=sensor_idx, paths=paths, on_done=journal_sample)
+                            continue
+
+                    if not applied:
+                        with tracer.stage('apply', sensor_idx):
+                            sensor.apply()
+                        applied = True
+
+                    # includes encoding and writing the png, or the four passes
+                    passes = None
+                    with tracer.stage('render', sensor_idx, overall_idx):
+                        if LIGHT_PASSES:
+                            passes = render_passes(pass_path[:-len('.npy')], sensor)
+                            # direct render the composition is validated against
+                            if overall_idx < LIGHT_PASS_CHECK:
+                                render_still(os.path.join(sensor_dir, light_passes.PASS_DIR, light_passes.CHECK_DIR, overall_idx_formatted))
+                        else:
+                            render_still(sample_path)
+                    with tracer.stage('readout', sensor_idx, overall_idx):
+                        dmap = read_depth(copy=True)
+
+                    # queued, the sample is journaled once its png and depth map are synced
+                    # submit times the wait for queue space, write the save on its writer thread
+                    with tracer.stage('submit', sensor_idx, overall_idx):
+                        output.submit(tracer.call, 'write', sensor_idx, overall_idx, save_sample, depth_path, dmap, store, overall_idx, sample_path + '.png', cache, cache_key if cache is not None else None,
+                                      passes, weights if LIGHT_PASSES else None, pass_path if LIGHT_PASSES else None,
+                                      key=sensor_idx, paths=paths, on_done=journal_sample)
+
+        # placements of finished blocks are not needed again
+        for overall_idx, missing in block: placements.pop(overall_idx, None)
+
+    # raises if a queued write failed, the run is then retried from the journal
+    output.close()
+    for store in stores:
+        if store is not None: store.close()
+    log.close()
+    tracer.close()
 
     # remove meshes from blender
-    for obj in obj_dir:
+    for obj in loaded_meshes:
+        if obj not in bpy.data.objects: continue
         bpy.ops.object.select_all(action='DESELECT')
         bpy.data.objects[obj].select_set(True)
         bpy.ops.object.delete() 
+        mesh_utils.invalidate(obj)
 
     # ensure Blender exits cleanly with code 0 on success
     import bpy.app
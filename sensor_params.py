@@ -0,0 +1,209 @@
+import os
+import sys
+import argparse
+import numpy as np
+
+# reading and writing of sensor parameters outside of blender
+# parameters.txt holds one value per line in this order:
+#   smoothness, scale, light_type, angle,
+#   top/bottom/left/right emittor: strength, r, g, b
+#   fov, roughness, length
+#
+# a run's sensors are kept in one columnar bank, renders/sensors.npy, a
+# structured array with one row per sensor_XXXX that is sampled in one
+# vectorized call and loaded memory mapped. parameters.txt files are the
+# legacy format, imported from and exported to with
+#
+#   python sensor_params.py import      # parameters.txt files -> sensors.npy
+#   python sensor_params.py export      # sensors.npy -> parameters.txt files
+
+EMITTORS = ['top', 'bottom', 'left', 'right']
+
+BANK_NAME = 'sensors.npy'
+
+# float64 columns so values round trip exactly through parameters.txt
+SENSOR_DTYPE = np.dtype([('smoothness', np.int32),
+                         ('scale', np.float64),
+                         ('light_type', 'U5'),
+                         ('angle', 'U4'),
+                         ('strength', np.float64, (4,)),
+                         ('color', np.float64, (4, 3)),
+                         ('fov', np.float64),
+                         ('roughness', np.float64),
+                         ('length', np.float64)])
+
+# emittor kinds drawn per sensor, every kind lights exactly one side
+KINDS = ['RED', 'GREEN', 'BLUE', 'BLOCK']
+
+
+def read_parameters(path) -> dict:
+    with open(path, 'r') as f:
+        content = f.readlines()
+
+    params = {'smoothness': int(content[0]),
+              'scale': float(content[1]),
+              'light_type': content[2].strip('\n'),
+              'angle': content[3].strip('\n'),
+              'emittors': [],
+              'fov': float(content[20]),
+              'roughness': float(content[21]),
+              'length': float(content[22])}
+    for idx in range(4):
+        line = 4 + idx * 4
+        params['emittors'].append([float(content[line]),
+                                   (float(content[line + 1]), float(content[line + 2]), float(content[line + 3]), 1)])
+    return params
+
+def write_parameters(path, params) -> None:
+    f = open(path, 'w+')
+    f.write(f"{params['smoothness']}\n")
+    f.write(f"{params['scale']}\n")
+    f.write(f"{params['light_type']}\n")
+    f.write(f"{params['angle']}\n")
+    for strength, color in params['emittors']:
+        f.write(f'{strength}\n')
+        f.write(f'{color[0]}\n')
+        f.write(f'{color[1]}\n')
+        f.write(f'{color[2]}\n')
+    f.write(f"{params['fov']}\n")
+    f.write(f"{params['roughness']}\n")
+    f.write(f"{params['length']}\n")
+    f.close()
+
+# flattens parameters into a float32 vector for training:
+# smoothness, scale, point light, diag angle, 4 x (strength, r, g, b), fov, roughness, length
+
+def to_vector(params) -> np.ndarray:
+    values = [params['smoothness'],
+              params['scale'],
+              1.0 if params['light_type'] == 'point' else 0.0,
+              1.0 if params['angle'] == 'diag' else 0.0]
+    for strength, color in params['emittors']:
+        values += [strength, color[0], color[1], color[2]]
+    values += [params['fov'], params['roughness'], params['length']]
+    return np.array(values, dtype=np.float32)
+
+# (4, 3) linear emitter weights top, bottom, left, right as create_sensor.apply
+# sets them: strength * color, point lights are 5 times as strong
+
+def emitter_weights(params) -> np.ndarray:
+    gain = 5 if params['light_type'] == 'point' else 1
+    return np.array([[strength * gain * c for c in color[:3]] for strength, color in params['emittors']], dtype=np.float64)
+
+def get_bank_path(render_dir) -> str:
+    return os.path.join(render_dir, BANK_NAME)
+
+def bank_exists(render_dir) -> bool:
+    return os.path.exists(get_bank_path(render_dir))
+
+# draws n sensors at once from the parameter ranges of scripting.py
+
+# config: dict with the sensor parameter constants of scripting.py
+#         (SMOOTHNESS_MIN/MAX, SCALE_MIN/MAX, ..., BLUE_COL_MIN/MAX)
+# rng: numpy Generator
+
+def sample_bank(n, config, rng) -> np.ndarray:
+    bank = np.zeros(n, dtype=SENSOR_DTYPE)
+    bank['smoothness'] = rng.integers(config['SMOOTHNESS_MIN'], config['SMOOTHNESS_MAX'], n)
+    bank['scale'] = rng.uniform(config['SCALE_MIN'], config['SCALE_MAX'], n)
+    bank['fov'] = rng.uniform(config['FOV_MIN'], config['FOV_MAX'], n)
+    bank['roughness'] = rng.uniform(config['ROUGH_MIN'], config['ROUGH_MAX'], n)
+    bank['length'] = rng.uniform(config['LENGTH_MIN'], config['LENGTH_MAX'], n)
+    bank['angle'] = np.where(rng.random(n) < 0.35, 'diag', 'str')
+    bank['light_type'] = np.where(rng.random(n) < 0.35, 'point', 'long')
+
+    # strength and color ranges per kind, BLOCK is always off
+    str_min = np.array([config['RED_STR_MIN'], config['GREEN_STR_MIN'], config['BLUE_STR_MIN'], 0.0])
+    str_max = np.array([config['RED_STR_MAX'], config['GREEN_STR_MAX'], config['BLUE_STR_MAX'], 0.0])
+    col_min = np.array([config['RED_COL_MIN'], config['GREEN_COL_MIN'], config['BLUE_COL_MIN'], [0.0, 0.0, 0.0]])
+    col_max = np.array([config['RED_COL_MAX'], config['GREEN_COL_MAX'], config['BLUE_COL_MAX'], [0.0, 0.0, 0.0]])
+
+    # random assignment of kinds to the four sides
+    kinds = rng.permuted(np.tile(np.arange(len(KINDS)), (n, 1)), axis=1)
+    bank['strength'] = str_min[kinds] + (str_max - str_min)[kinds] * rng.random((n, 4))
+    bank['color'] = col_min[kinds] + (col_max - col_min)[kinds] * rng.random((n, 4, 3))
+    return bank
+
+# row of a bank as a parameter dict like read_parameters
+
+def to_params(row) -> dict:
+    return {'smoothness': int(row['smoothness']),
+            'scale': float(row['scale']),
+            'light_type': str(row['light_type']),
+            'angle': str(row['angle']),
+            'emittors': [[float(row['strength'][idx]), tuple(float(c) for c in row['color'][idx]) + (1,)] for idx in range(4)],
+            'fov': float(row['fov']),
+            'roughness': float(row['roughness']),
+            'length': float(row['length'])}
+
+def from_params(params) -> np.ndarray:
+    row = np.zeros((), dtype=SENSOR_DTYPE)
+    for key in ['smoothness', 'scale', 'light_type', 'angle', 'fov', 'roughness', 'length']:
+        row[key] = params[key]
+    for idx, (strength, color) in enumerate(params['emittors']):
+        row['strength'][idx] = strength
+        row['color'][idx] = color[:3]
+    return row
+
+def write_bank(render_dir, bank) -> None:
+    path = get_bank_path(render_dir)
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        np.save(f, bank)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+# memory mapped bank, rows are only read when accessed
+
+def load_bank(render_dir, mmap=True) -> np.ndarray:
+    return np.load(get_bank_path(render_dir), mmap_mode='r' if mmap else None)
+
+# parameters of one sensor, from the bank or its legacy parameters.txt
+
+# bank: optional bank already loaded by the caller
+
+def load_sensor(render_dir, sensor_idx, bank=None) -> dict:
+    if bank is None and bank_exists(render_dir): bank = load_bank(render_dir)
+    if bank is not None: return to_params(bank[sensor_idx])
+    return read_parameters(os.path.join(render_dir, 'sensor_{0:04}'.format(sensor_idx), 'parameters.txt'))
+
+def list_sensor_dirs(render_dir) -> list:
+    sensor_dirs = [d for d in os.listdir(render_dir) if d.startswith('sensor_') and os.path.isdir(os.path.join(render_dir, d))]
+    sensor_dirs.sort()
+    return sensor_dirs
+
+# builds a bank from the parameters.txt files of sensor_0000, sensor_0001, ...
+
+def import_legacy(render_dir) -> np.ndarray:
+    sensor_dirs = list_sensor_dirs(render_dir)
+    bank = np.zeros(len(sensor_dirs), dtype=SENSOR_DTYPE)
+    for sensor_idx, sensor_dir in enumerate(sensor_dirs):
+        assert sensor_dir == 'sensor_{0:04}'.format(sensor_idx), f"Sensor directories are not contiguous at {sensor_dir}"
+        bank[sensor_idx] = from_params(read_parameters(os.path.join(render_dir, sensor_dir, 'parameters.txt')))
+    return bank
+
+def export_legacy(render_dir, bank) -> None:
+    for sensor_idx in range(len(bank)):
+        sensor_dir = os.path.join(render_dir, 'sensor_{0:04}'.format(sensor_idx))
+        os.makedirs(sensor_dir, exist_ok=True)
+        write_parameters(os.path.join(sensor_dir, 'parameters.txt'), to_params(bank[sensor_idx]))
+
+
+if __name__ == '__main__':
+    root_dir = os.environ.get('GELSIGHT_RENDER_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'renders'))
+
+    parser = argparse.ArgumentParser(description='Convert between the sensor bank (sensors.npy) and legacy parameters.txt files.')
+    parser.add_argument('command', choices=['import', 'export'], help='import parameters.txt files into the bank, or export the bank to them')
+    parser.add_argument('--root', default=root_dir, help='render directory (default: GELSIGHT_RENDER_DIR or <repo>/renders)')
+    args = parser.parse_args()
+
+    if args.command == 'import':
+        bank = import_legacy(args.root)
+        write_bank(args.root, bank)
+        print(f'imported {len(bank)} sensors into {get_bank_path(args.root)}')
+    else:
+        bank = load_bank(args.root)
+        export_legacy(args.root, bank)
+        print(f'exported {len(bank)} sensors from {get_bank_path(args.root)}')
+    sys.exit(0)
@@ -0,0 +1,320 @@
+import io
+import os
+import sys
+import json
+import time
+import random
+import tarfile
+import argparse
+import numpy as np
+import cv2
+from multiprocessing import Pool
+
+import journal
+import normals
+import post_process
+import sensor_params
+
+# sequential tar shards of a render directory for streaming training input
+# every sample becomes one group of consecutive tar members (webdataset layout)
+#   sensor_XXXX/NNNN.rgb.png        samples/NNNN.png as rendered
+#   sensor_XXXX/NNNN.depth.npy      float32 depth map from raw_data/ or the depth store
+#   sensor_XXXX/NNNN.normals.png    norms/NNNN.png, computed like post_process.py if missing or stale
+#   sensor_XXXX/NNNN.params.json    sensor parameters like read_parameters
+# packed into shards of about --shard-mb each, one run of shards per sensor
+#   <out>/sensor_XXXX-NNNNN.tar
+#   <out>/sensor_XXXX.json          shards finished so far, resume state of the sensor
+#   <out>/index.json                all shards with their sample counts
+#
+#   python shards.py export -j 8                # renders/ -> renders/shards/
+#   python shards.py stats                      # reads the shards back sequentially
+#
+# only journaled samples are exported, so a running generator can be exported
+# repeatedly, every export appends new shards for the samples added since
+
+SHARD_DIR = 'shards'
+INDEX_NAME = 'index.json'
+SHARD_MB = 256
+
+COMPONENTS = ('rgb', 'depth', 'normals', 'params')
+SUFFIXES = {'rgb': 'rgb.png', 'depth': 'depth.npy', 'normals': 'normals.png', 'params': 'params.json'}
+
+
+def shard_name(sensor, shard_idx) -> str:
+    return '{0}-{1:05}.tar'.format(sensor, shard_idx)
+
+def load_progress(out_dir, sensor) -> dict:
+    path = os.path.join(out_dir, sensor + '.json')
+    if not os.path.exists(path): return {'shards': []}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def save_json(path, data) -> None:
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f, indent=1)
+    os.replace(tmp, path)
+
+# samples of a sensor with their png and a complete depth map
+
+# done: optional set of journaled sample indices, samples outside it are still being written
+
+def list_exportable(sensor_dir, done=None) -> list:
+    samples = []
+    for sample in post_process.list_samples(sensor_dir):
+        if done is not None and int(sample) not in done: continue
+        if not os.path.exists(os.path.join(sensor_dir, 'samples', sample + '.png')): continue
+        raw_dir = os.path.join(sensor_dir, 'raw_data', sample + '.npy')
+        if os.path.exists(raw_dir) and not post_process.is_complete(raw_dir): continue
+        samples.append(sample)
+    return samples
+
+def read_bytes(path) -> bytes:
+    with open(path, 'rb') as f:
+        return f.read()
+
+# tar members of one sample, in COMPONENTS order
+
+# ksize: sobel kernel size of normals computed here
+
+def encode_sample(sensor_dir, sample, params, ksize=5) -> list:
+    dmap = post_process.load_depth(sensor_dir, sample).astype(np.float32)
+    depth = io.BytesIO()
+    np.save(depth, dmap)
+
+    norm_dir = os.path.join(sensor_dir, 'norms', sample + '.png')
+    if post_process.up_to_date(post_process.source_mtime(sensor_dir, sample), norm_dir):
+        norm = read_bytes(norm_dir)
+    else:
+        norm = cv2.imencode('.png', normals.get_engine(dmap.shape, ksize).compute(dmap, uint8=True))[1].tobytes()
+
+    return [read_bytes(os.path.join(sensor_dir, 'samples', sample + '.png')),
+            depth.getvalue(),
+            norm,
+            json.dumps(params).encode()]
+
+# appends a file member with fixed metadata, so equal renders give equal shards
+
+def add_member(tar, name, data) -> None:
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mode = 0o644
+    tar.addfile(info, io.BytesIO(data))
+
+# exports the samples of one sensor that no finished shard holds yet
+# a shard is written under a temporary name and recorded in the sensor's
+# progress file once complete, an interrupted export loses at most one shard
+
+# job: (root, out_dir, sensor, done, shard_bytes, ksize), done as in list_exportable
+# returns: (sensor, exported samples, new shards)
+
+def export_sensor(job) -> tuple:
+    root, out_dir, sensor, done, shard_bytes, ksize = job
+    sensor_dir = os.path.join(root, sensor)
+    params = sensor_params.load_sensor(root, int(sensor[len('sensor_'):]))
+    progress = load_progress(out_dir, sensor)
+    exported = {sample for shard in progress['shards'] for sample in shard['samples']}
+    samples = [sample for sample in list_exportable(sensor_dir, done) if sample not in exported]
+
+    new_shards = 0
+    position = 0
+    while position < len(samples):
+        name = shard_name(sensor, len(progress['shards']))
+        path = os.path.join(out_dir, name)
+        shard = {'name': name, 'samples': []}
+        with tarfile.open(path + '.tmp', 'w', format=tarfile.PAX_FORMAT) as tar:
+            # every shard holds at least one sample, whatever its size bound
+            while position < len(samples) and (len(shard['samples']) == 0 or tar.offset < shard_bytes):
+                sample = samples[position]
+                for component, data in zip(COMPONENTS, encode_sample(sensor_dir, sample, params, ksize)):
+                    add_member(tar, f'{sensor}/{sample}.{SUFFIXES[component]}', data)
+                shard['samples'].append(sample)
+                position += 1
+        shard['bytes'] = os.path.getsize(path + '.tmp')
+        os.replace(path + '.tmp', path)
+        progress['shards'].append(shard)
+        save_json(os.path.join(out_dir, sensor + '.json'), progress)
+        new_shards += 1
+    return sensor, len(samples), new_shards
+
+# index of every finished shard under out_dir, built from the sensors' progress files
+
+def write_index(out_dir) -> dict:
+    shards = []
+    for name in sorted(os.listdir(out_dir)):
+        if not (name.startswith('sensor_') and name.endswith('.json')): continue
+        sensor = name[:-len('.json')]
+        for shard in load_progress(out_dir, sensor)['shards']:
+            shards.append({'name': shard['name'], 'sensor': sensor, 'count': len(shard['samples']), 'bytes': shard['bytes']})
+    index = {'components': {component: SUFFIXES[component] for component in COMPONENTS},
+             'samples': sum(shard['count'] for shard in shards),
+             'shards': shards}
+    save_json(os.path.join(out_dir, INDEX_NAME), index)
+    return index
+
+# exports every sensor of a render directory on a pool of worker processes
+
+# shard_mb: shards are closed once they exceed this many megabytes
+# workers: number of processes, sensors are the unit of work
+# returns: the written index
+
+def export(root, out_dir=None, sensors=None, shard_mb=SHARD_MB, workers=None, ksize=5) -> dict:
+    if shard_mb <= 0: raise ValueError(f'shard_mb must be positive, got {shard_mb}')
+    if out_dir is None: out_dir = os.path.join(root, SHARD_DIR)
+    if workers is None: workers = os.cpu_count() or 1
+    os.makedirs(out_dir, exist_ok=True)
+    # shards an interrupted export left behind
+    for name in os.listdir(out_dir):
+        if name.endswith('.tar.tmp'): os.remove(os.path.join(out_dir, name))
+
+    done = None
+    if journal.exists(root):
+        done = {}
+        for kind, sensor_idx, index in journal.load_state(root).done:
+            if kind == 'sample': done.setdefault(sensor_idx, set()).add(index)
+    jobs = []
+    for sensor in post_process.list_sensors(root, sensors):
+        sensor_done = None if done is None else done.get(int(sensor[len('sensor_'):]), set())
+        jobs.append((root, out_dir, sensor, sensor_done, shard_mb << 20, ksize))
+
+    def report(result):
+        sensor, count, new_shards = result
+        if count > 0: print(f'{sensor}: {count} samples into {new_shards} shards')
+
+    if workers <= 1 or len(jobs) <= 1:
+        for job in jobs: report(export_sensor(job))
+    else:
+        with Pool(min(workers, len(jobs))) as pool:
+            for result in pool.imap_unordered(export_sensor, jobs):
+                report(result)
+    return write_index(out_dir)
+
+# shard paths of an export, from its index or by listing
+
+def list_shards(shard_dir) -> list:
+    path = os.path.join(shard_dir, INDEX_NAME)
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            return [os.path.join(shard_dir, shard['name']) for shard in json.load(f)['shards']]
+    return sorted(os.path.join(shard_dir, name) for name in os.listdir(shard_dir) if name.endswith('.tar'))
+
+# groups the members of a tar stream into samples, read strictly sequentially
+
+# returns: iterator of (key, {suffix: bytes})
+
+def iter_groups(path):
+    with tarfile.open(path, 'r|') as tar:
+        key, group = None, {}
+        for member in tar:
+            if not member.isfile(): continue
+            base, _, suffix = member.name.partition('.')
+            if base != key and len(group) > 0:
+                yield key, group
+                group = {}
+            key = base
+            group[suffix] = tar.extractfile(member).read()
+        if len(group) > 0: yield key, group
+
+class ShardReader():
+    # shard_dir: directory written by export
+    # components: subset of COMPONENTS to decode per item
+    # shuffle: shuffle the shard order and items through a buffer
+    # buffer: items held for shuffling, bounds memory use
+    # interleave: shards read at the same time, mixes sensors into the buffer
+    # rank, world: this reader only reads every world-th shard, starting at rank
+
+    def __init__(self, shard_dir, components=COMPONENTS, shuffle=True, buffer=1000, interleave=4, seed=None, rank=0, world=1):
+        self.components = tuple(components)
+        self.shuffle = shuffle
+        self.buffer = buffer
+        self.interleave = interleave
+        self.rng = random.Random(seed)
+        self.shards = list_shards(shard_dir)[rank::world]
+
+    def decode(self, key, group) -> dict:
+        sensor, sample = key.split('/')
+        item = {'sensor': int(sensor[len('sensor_'):]), 'sample': int(sample)}
+        if 'rgb' in self.components:
+            item['rgb'] = cv2.cvtColor(cv2.imdecode(np.frombuffer(group[SUFFIXES['rgb']], np.uint8), cv2.IMREAD_COLOR), cv2.COLOR_BGR2RGB)
+        if 'depth' in self.components:
+            item['depth'] = np.load(io.BytesIO(group[SUFFIXES['depth']]))
+        if 'normals' in self.components:
+            item['normals'] = cv2.cvtColor(cv2.imdecode(np.frombuffer(group[SUFFIXES['normals']], np.uint8), cv2.IMREAD_COLOR), cv2.COLOR_BGR2RGB)
+        if 'params' in self.components:
+            item['params'] = sensor_params.to_vector(json.loads(group[SUFFIXES['params']]))
+        return item
+
+    # undecoded samples of the shards, round robin over `interleave` open shards
+
+    def iter_raw(self):
+        order = list(self.shards)
+        if self.shuffle: self.rng.shuffle(order)
+        streams = []
+        while len(order) > 0 or len(streams) > 0:
+            while len(order) > 0 and len(streams) < self.interleave:
+                streams.append(iter_groups(order.pop(0)))
+            for stream in list(streams):
+                group = next(stream, None)
+                if group is None: streams.remove(stream)
+                else: yield group
+
+    # items as dicts like loader.RenderDataset, in a new order every call
+
+    def __iter__(self):
+        if not self.shuffle:
+            for key, group in self.iter_raw(): yield self.decode(key, group)
+            return
+
+        pending = []
+        for group in self.iter_raw():
+            if len(pending) < self.buffer:
+                pending.append(group)
+                continue
+            idx = self.rng.randrange(len(pending))
+            pending[idx], group = group, pending[idx]
+            yield self.decode(*group)
+        self.rng.shuffle(pending)
+        for group in pending: yield self.decode(*group)
+
+    # yields batches of stacked arrays
+
+    def iter_batches(self, batch_size, drop_last=False):
+        items = []
+        for item in self:
+            items.append(item)
+            if len(items) == batch_size:
+                yield {key: np.stack([item[key] for item in items]) for key in items[0]}
+                items = []
+        if len(items) > 0 and not drop_last:
+            yield {key: np.stack([item[key] for item in items]) for key in items[0]}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Pack renders into sequential tar shards, or read them back.')
+    parser.add_argument('command', choices=['export', 'stats'])
+    parser.add_argument('--root', default=post_process.root_dir, help='render directory (default: GELSIGHT_RENDER_DIR or <repo>/renders)')
+    parser.add_argument('--out', default=None, help='shard directory (default: <root>/shards)')
+    parser.add_argument('-s', '--sensors', nargs='+', default=None, help='sensor names or indices to export (default: all)')
+    parser.add_argument('-j', '--workers', type=int, default=os.cpu_count() or 1, help='number of worker processes')
+    parser.add_argument('--shard-mb', type=int, default=SHARD_MB, help='size a shard is closed at, in megabytes')
+    parser.add_argument('--ksize', type=int, default=5, choices=[1, 3, 5, 7], help='sobel kernel size of normals computed during export')
+    parser.add_argument('--buffer', type=int, default=1000, help='shuffle buffer of stats')
+    args = parser.parse_args()
+    if args.shard_mb <= 0: parser.error('--shard-mb must be positive')
+    out_dir = args.out if args.out is not None else os.path.join(args.root, SHARD_DIR)
+
+    if args.command == 'export':
+        index = export(args.root, out_dir, args.sensors, args.shard_mb, args.workers, args.ksize)
+        total = sum(shard['bytes'] for shard in index['shards'])
+        print(f"{index['samples']} samples in {len(index['shards'])} shards, {total / (1 << 20):.1f} MB")
+        sys.exit(0)
+
+    start = time.perf_counter()
+    count = 0
+    read = 0
+    for item in ShardReader(out_dir, buffer=args.buffer):
+        count += 1
+        read += item['rgb'].nbytes + item['depth'].nbytes + item['normals'].nbytes
+    elapsed = time.perf_counter() - start
+    print(f'{count} samples in {elapsed:.2f} s, {count / max(elapsed, 1e-9):.1f} samples/s, {read / (1 << 20) / max(elapsed, 1e-9):.1f} MB/s decoded')
+    sys.exit(0)
@@ -0,0 +1,39 @@
+import numpy as np
+
+import depth_readout
+
+# stand-ins for bpy.types.Image and its pixel collection
+
+class StandInPixels():
+    def __init__(self, values):
+        self.values = values
+
+    def __getitem__(self, idx):
+        return self.values.tolist()[idx]
+
+    def foreach_get(self, buffer) -> None:
+        buffer[:] = self.values
+
+class StandInImage():
+    def __init__(self, w, h, rng):
+        self.size = (w, h)
+        self.pixels = StandInPixels(rng.random(4 * w * h).astype(np.float32))
+
+def test_readout_matches_reference():
+    rng = np.random.default_rng(0)
+    for w, h in [(1, 1), (7, 3), (64, 48)]:
+        image = StandInImage(w, h, rng)
+        expected = depth_readout.read_reference(image)
+        dmap = depth_readout.read(image)
+        assert dmap.shape == (h, w) and dmap.dtype == np.float32
+        assert np.array_equal(dmap, expected)
+
+def test_copy_survives_the_next_readout():
+    rng = np.random.default_rng(1)
+    first = StandInImage(8, 6, rng)
+    second = StandInImage(8, 6, rng)
+    kept = depth_readout.read(first, copy=True)
+    reused = depth_readout.read(first)
+    depth_readout.read(second)
+    assert np.array_equal(kept, depth_readout.read_reference(first))
+    assert np.array_equal(reused, depth_readout.read_reference(second))
@@ -0,0 +1,83 @@
+import os
+import time
+import threading
+import numpy as np
+
+import depth_store
+import post_process
+
+def write_samples(writer, samples, rng):
+    maps = {}
+    for sample in samples:
+        maps[sample] = rng.random((12, 16)).astype(np.float32)
+        writer.append(sample, maps[sample])
+    return maps
+
+def test_store_round_trip(tmp_path):
+    rng = np.random.default_rng(0)
+    sensor_dir = str(tmp_path / 'sensor_0000')
+    writer = depth_store.DepthStoreWriter(sensor_dir, 'worker_0000', chunk=4)
+    maps = write_samples(writer, range(10), rng)
+    writer.close()
+
+    store = depth_store.DepthStore(sensor_dir)
+    assert store.samples() == list(range(10))
+    for sample, dmap in maps.items():
+        assert np.array_equal(store[sample], dmap)
+
+def test_appends_do_not_make_earlier_samples_stale(tmp_path):
+    rng = np.random.default_rng(1)
+    root = str(tmp_path)
+    sensor_dir = os.path.join(root, 'sensor_0000')
+    writer = depth_store.DepthStoreWriter(sensor_dir, 'worker_0000', chunk=16)
+    write_samples(writer, range(4), rng)
+    post_process.run(post_process.collect_units(root), workers=1)
+
+    # later samples land in the same chunk file
+    time.sleep(0.01)
+    write_samples(writer, range(4, 6), rng)
+    writer.close()
+    post_process._stores.clear()
+    assert [unit[1] for unit in post_process.collect_units(root)] == ['0004', '0005']
+
+def test_writers_of_two_shards_create_meta_at_once(tmp_path, monkeypatch):
+    rng = np.random.default_rng(2)
+    sensor_dir = str(tmp_path / 'sensor_0000')
+    writers = [depth_store.DepthStoreWriter(sensor_dir, 'worker_{0:04}'.format(idx), chunk=4) for idx in range(2)]
+
+    # the second writer creates the meta file while the first is about to replace its own
+    replace = os.replace
+    errors = []
+    def racing_replace(src, dst):
+        if len(errors) == 0:
+            errors.append(None)
+            other = threading.Thread(target=lambda: writers[1].append(1, rng.random((12, 16)).astype(np.float32)))
+            other.start()
+            other.join()
+        replace(src, dst)
+    monkeypatch.setattr(depth_store.os, 'replace', racing_replace)
+    writers[0].append(0, rng.random((12, 16)).astype(np.float32))
+    for writer in writers: writer.close()
+
+    store = depth_store.DepthStore(sensor_dir)
+    assert store.samples() == [0, 1]
+    assert not [name for name in os.listdir(depth_store.get_store_dir(sensor_dir)) if name.endswith('.tmp')]
+
+def test_rewritten_sample_is_read_from_its_new_slot(tmp_path):
+    rng = np.random.default_rng(3)
+    sensor_dir = str(tmp_path / 'sensor_0000')
+    writer = depth_store.DepthStoreWriter(sensor_dir, 'worker_0000', chunk=4)
+    write_samples(writer, range(3), rng)
+    post_process._stores.clear()
+    first = post_process.load_depth(sensor_dir, '0001').copy()
+    first_time = post_process.source_mtime(sensor_dir, '0001')
+
+    # a retried sample lands in a later slot of another segment
+    time.sleep(0.01)
+    retry = depth_store.DepthStoreWriter(sensor_dir, 'worker_0001', chunk=4)
+    rewritten = write_samples(retry, [1], rng)[1]
+    assert not np.array_equal(first, rewritten)
+    assert np.array_equal(post_process.load_depth(sensor_dir, '0001'), rewritten)
+    assert post_process.source_mtime(sensor_dir, '0001') > first_time
+    writer.close()
+    retry.close()
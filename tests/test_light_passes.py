@@ -0,0 +1,50 @@
+import numpy as np
+
+import light_passes
+
+def test_composite_is_weighted_sum():
+    rng = np.random.default_rng(0)
+    passes = rng.random((4, 6, 8, 3)).astype(np.float32)
+    weights = rng.random((4, 3)).astype(np.float32)
+    image = light_passes.composite(passes, weights)
+
+    expected = sum(weights[k] * passes[k] for k in range(4))
+    assert image.shape == (6, 8, 3)
+    assert np.allclose(image, expected, atol=1e-6)
+
+def test_composite_is_linear_and_batched():
+    rng = np.random.default_rng(1)
+    passes = rng.random((4, 5, 7, 3)).astype(np.float32)
+    a, b = rng.random((2, 4, 3)).astype(np.float32)
+    both = light_passes.composite(passes, a + 2 * b)
+    assert np.allclose(both, light_passes.composite(passes, a) + 2 * light_passes.composite(passes, b), atol=1e-5)
+
+    batch = light_passes.composite(passes, np.stack((a, b)))
+    assert batch.shape == (2, 5, 7, 3)
+    assert np.allclose(batch[1], light_passes.composite(passes, b))
+
+def test_encode_inverts_to_linear():
+    levels = np.arange(256, dtype=np.uint8)
+    assert np.array_equal(light_passes.encode(light_passes.to_linear(levels / 255)), levels)
+    assert light_passes.encode(np.array([-1.0, 2.0])).tolist() == [0, 255]
+
+def test_png_round_trip(tmp_path):
+    rng = np.random.default_rng(2)
+    image = rng.integers(0, 256, (9, 13, 3), dtype=np.uint8)
+    path = str(tmp_path / 'image.png')
+    light_passes.write_png(path, image)
+    assert np.array_equal(light_passes.read_png(path), image)
+    assert not (tmp_path / 'image.png.tmp').exists()
+
+def test_float16_passes_stay_within_a_level(tmp_path):
+    rng = np.random.default_rng(3)
+    passes = rng.random((4, 16, 16, 3)).astype(np.float32) / 4
+    weights = rng.random((4, 3)).astype(np.float32)
+    path = str(tmp_path / '0000.npy')
+    light_passes.save_passes(path, passes)
+    stored = light_passes.load_passes(path)
+
+    assert stored.dtype == np.float32
+    diff = np.abs(light_passes.encode(light_passes.composite(stored, weights)).astype(np.int16)
+                  - light_passes.encode(light_passes.composite(passes, weights)))
+    assert diff.max() <= 1
@@ -0,0 +1,93 @@
+import os
+import numpy as np
+
+import mesh_lod
+
+# closed uv sphere of radius 1
+def sphere(rings=24, segments=48):
+    theta = np.linspace(0, np.pi, rings + 1)[1:-1]
+    phi = np.linspace(0, 2 * np.pi, segments, endpoint=False)
+    t, p = np.meshgrid(theta, phi, indexing='ij')
+    vertices = np.concatenate(([[0, 0, 1]], np.stack((np.sin(t) * np.cos(p), np.sin(t) * np.sin(p), np.cos(t)), axis=-1).reshape(-1, 3), [[0, 0, -1]]))
+    ring = lambda r, s: 1 + r * segments + s % segments
+    faces = [(0, ring(0, s), ring(0, s + 1)) for s in range(segments)]
+    for r in range(rings - 2):
+        for s in range(segments):
+            faces += [(ring(r, s), ring(r + 1, s), ring(r + 1, s + 1)), (ring(r, s), ring(r + 1, s + 1), ring(r, s + 1))]
+    bottom = len(vertices) - 1
+    faces += [(ring(rings - 2, s), bottom, ring(rings - 2, s + 1)) for s in range(segments)]
+    return vertices.astype(np.float32), np.array(faces, dtype=np.int32)
+
+def errors(cell):
+    vertices, faces = sphere()
+    lod_vertices, lod_faces, cluster = mesh_lod.cluster_mesh(vertices, faces, cell)
+    inward = mesh_lod.lod_errors(vertices, lod_vertices, lod_faces, cluster)
+    outward = mesh_lod.lod_surface_errors(vertices, faces, lod_vertices, lod_faces, cluster)
+    return len(lod_vertices), inward, outward
+
+def test_cluster_mesh_reduces_and_maps_vertices():
+    vertices, faces = sphere()
+    lod_vertices, lod_faces, cluster = mesh_lod.cluster_mesh(vertices, faces, 0.3)
+    assert len(lod_vertices) < len(vertices)
+    assert lod_faces.min() >= 0 and lod_faces.max() < len(lod_vertices)
+    assert cluster.shape == (len(vertices),)
+    assert cluster.max() < len(lod_vertices) and cluster.min() >= -1
+
+def test_fine_cells_keep_the_surface():
+    count, inward, outward = errors(1e-3)
+    assert count == len(sphere()[0])
+    assert inward.max() < 1e-5 and outward.max() < 1e-5
+
+def test_errors_are_non_negative_and_grow_with_the_cell():
+    maxima = []
+    for cell in [0.1, 0.2, 0.4, 0.8]:
+        _, inward, outward = errors(cell)
+        assert (inward >= 0).all() and (outward >= 0).all()
+        maxima.append(max(inward.max(), outward.max()))
+    assert maxima == sorted(maxima)
+    assert maxima[-1] > 2 * maxima[0]
+
+def test_surface_error_bounds_the_lod_surface():
+    # the candidate faces are a subset, so the errors bound the distance to the whole original
+    vertices, faces = sphere(12, 24)
+    lod_vertices, lod_faces, cluster = mesh_lod.cluster_mesh(vertices, faces, 0.4)
+    outward = mesh_lod.lod_surface_errors(vertices, faces, lod_vertices, lod_faces, cluster).reshape(-1, 7)
+    centroids = lod_vertices.astype(np.float64)[lod_faces].mean(axis=1)
+    v = vertices.astype(np.float64)
+    for centroid, error in zip(centroids, outward[:, 6]):
+        points = np.repeat(centroid[None], len(faces), axis=0)
+        exact = mesh_lod.point_triangle_distance(points, v[faces[:, 0]], v[faces[:, 1]], v[faces[:, 2]]).min()
+        assert exact <= error + 1e-9
+
+def test_select_lod_respects_the_tolerance():
+    index = {'mesh': {'levels': [{'name': 'mesh_lod1', 'max_error': 0.001},
+                                 {'name': 'mesh_lod2', 'max_error': 0.004},
+                                 {'name': 'mesh_lod3', 'max_error': 0.02}]}}
+    assert mesh_lod.select_lod(index, 'mesh', 0.05, 0.00001) == 'mesh'
+    assert mesh_lod.select_lod(index, 'mesh', 0.05, 0.0001) == 'mesh_lod1'
+    assert mesh_lod.select_lod(index, 'mesh', 0.05, 0.0002) == 'mesh_lod2'
+    assert mesh_lod.select_lod(index, 'mesh', 0.05, 1) == 'mesh_lod3'
+    assert mesh_lod.select_lod(index, 'other', 0.05, 1) == 'other'
+
+def test_update_lods_rebuilds_older_versions(tmp_path):
+    mesh_dir = str(tmp_path)
+    vertices, faces = sphere()
+    mesh_lod.write_obj(os.path.join(mesh_dir, 'ball.obj'), vertices, faces)
+    index = mesh_lod.update_lods(mesh_dir)
+    assert index['ball']['version'] == mesh_lod.LOD_VERSION
+
+    index['ball']['version'] = mesh_lod.LOD_VERSION - 1
+    mesh_lod.save_index(mesh_dir, index)
+    assert mesh_lod.update_lods(mesh_dir)['ball']['version'] == mesh_lod.LOD_VERSION
+
+def test_build_lods_reports_every_level(tmp_path):
+    mesh_dir = str(tmp_path)
+    vertices, faces = sphere()
+    mesh_lod.write_obj(os.path.join(mesh_dir, 'ball.obj'), vertices, faces)
+    os.makedirs(mesh_lod.get_lod_dir(mesh_dir))
+    entry = mesh_lod.build_lods('ball', mesh_dir, cells=[0.05, 0.1, 0.2])
+    assert entry['num_vertices'] == len(vertices)
+    assert len(entry['levels']) > 0
+    for level in entry['levels']:
+        assert os.path.exists(mesh_lod.mesh_path(level['name'], mesh_dir))
+        assert level['max_error'] >= level['lod_error'] >= 0
@@ -0,0 +1,106 @@
+import numpy as np
+import pytest
+
+import mesh_utils
+
+# stand-ins for a blender object, its mesh and the mesh's vertex collection
+
+class StandInVertices():
+    def __init__(self, co):
+        self.co = np.asarray(co, dtype=np.float32)
+        self.reads = 0
+
+    def __len__(self):
+        return len(self.co)
+
+    def foreach_get(self, attr, buffer) -> None:
+        assert attr == 'co'
+        self.reads += 1
+        buffer[:] = self.co.ravel()
+
+class StandInMesh():
+    def __init__(self, name, co):
+        self.name = name
+        self.vertices = StandInVertices(co)
+
+class StandInObject():
+    def __init__(self, name, co, matrix_world=None):
+        self.name = name
+        self.data = StandInMesh(name, co)
+        self.matrix_world = np.eye(4) if matrix_world is None else matrix_world
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    mesh_utils.invalidate()
+    yield
+    mesh_utils.invalidate()
+
+# world coordinates of every vertex the old find_lowest would have collected
+
+def reference_lowest(co, mw):
+    world = [mw[:3, :3] @ v + mw[:3, 3] for v in co.astype(np.float64)]
+    z = min(p[2] for p in world)
+    return np.array([p for p in world if p[2] == z])
+
+def test_lowest_points_matches_reference():
+    rng = np.random.default_rng(0)
+    co = rng.normal(size=(500, 3)).astype(np.float32)
+    for _ in range(10):
+        mw = mesh_utils.euler_matrix(rng.uniform(0, 2 * np.pi, 3), rng.uniform(0.5, 2), rng.normal(size=3))
+        assert np.allclose(mesh_utils.lowest_points(co, mw), reference_lowest(co, mw))
+
+def test_lowest_points_keeps_ties():
+    co = np.array([[0, 0, 0], [1, 0, 0], [0, 1, 0], [0, 0, 1]], dtype=np.float32)
+    lowest = mesh_utils.lowest_points(co, np.eye(4))
+    assert len(lowest) == 3
+    assert np.all(lowest[:, 2] == 0)
+
+def test_hull_subset_finds_the_same_lowest_point():
+    if mesh_utils.ConvexHull is None: pytest.skip('scipy is not installed')
+    rng = np.random.default_rng(1)
+    co = rng.normal(size=(2000, 3)).astype(np.float32)
+    hull = mesh_utils.hull_indices(co)
+    for _ in range(10):
+        mw = mesh_utils.euler_matrix(rng.uniform(0, 2 * np.pi, 3))
+        assert np.allclose(mesh_utils.lowest_points(co, mw, hull), mesh_utils.lowest_points(co, mw))
+
+def test_cached_vertices_are_reused():
+    obj = StandInObject('cube', np.eye(3))
+    first = mesh_utils.get_vertices(obj)
+    assert mesh_utils.get_vertices(obj) is first
+    assert first.dtype == np.float32 and first.flags['C_CONTIGUOUS']
+    # hits and the hull read the mesh only once
+    mesh_utils.get_hull(obj)
+    mesh_utils.get_hull(obj)
+    assert obj.data.vertices.reads == 1
+
+def test_invalidate_after_coordinate_edit():
+    obj = StandInObject('cube', np.eye(3))
+    first = mesh_utils.get_vertices(obj)
+    obj.data.vertices.co[1, 2] = -5
+    assert mesh_utils.get_vertices(obj) is first
+    mesh_utils.invalidate('cube')
+    second = mesh_utils.get_vertices(obj)
+    assert second is not first
+    assert second[1, 2] == -5
+    assert first[1, 2] == 0
+
+def test_replaced_mesh_invalidates_vertices():
+    obj = StandInObject('cube', np.eye(3))
+    mesh_utils.get_vertices(obj)
+    obj.data = StandInMesh('cube.001', np.ones((5, 3)))
+    assert mesh_utils.get_vertices(obj).shape == (5, 3)
+
+def test_invalidate_drops_the_hull():
+    if mesh_utils.ConvexHull is None: pytest.skip('scipy is not installed')
+    rng = np.random.default_rng(2)
+    obj = StandInObject('blob', rng.normal(size=(200, 3)))
+    hull = mesh_utils.get_hull(obj)
+    assert mesh_utils.get_hull(obj) is hull
+
+    # a vertex pushed far outside joins the hull
+    inner = np.setdiff1d(np.arange(200), hull)[0]
+    obj.data.vertices.co[inner] = (0, 0, -100)
+    mesh_utils.invalidate('blob')
+    assert inner in mesh_utils.get_hull(obj)
@@ -0,0 +1,51 @@
+import threading
+import numpy as np
+
+import normals
+import post_process
+
+def synthetic_depth(shape, rng):
+    h, w = shape
+    y, x = np.mgrid[0:h, 0:w]
+    dmap = np.exp(-((x - w / 2) ** 2 + (y - h / 2) ** 2) / (2 * (min(h, w) / 5) ** 2))
+    return (dmap + 0.01 * rng.random(shape)).astype(np.float32)
+
+def test_float_output_matches_dmap2norm():
+    rng = np.random.default_rng(0)
+    dmap = synthetic_depth((60, 80), rng)
+    expected = post_process.dmap2norm(dmap)
+    actual = normals.NormalEngine(dmap.shape).compute(dmap)
+    assert actual.dtype == np.float32
+    assert np.abs(actual - expected).max() < 1e-5
+
+def test_uint8_output_within_one_level():
+    rng = np.random.default_rng(1)
+    dmap = synthetic_depth((48, 64), rng)
+    expected = (np.clip(post_process.dmap2norm(dmap), 0, 1) * 255).astype(np.uint8)
+    actual = normals.NormalEngine(dmap.shape).compute(dmap, uint8=True)
+    assert np.abs(actual.astype(int) - expected).max() <= 1
+
+def test_reused_buffers_do_not_leak_between_maps():
+    rng = np.random.default_rng(2)
+    engine = normals.NormalEngine((32, 32))
+    first, second = synthetic_depth((32, 32), rng), rng.random((32, 32))
+    expected = engine.compute(first)
+    engine.compute(second)
+    assert np.array_equal(engine.compute(first), expected)
+
+def test_batch_matches_single_maps():
+    rng = np.random.default_rng(3)
+    dmaps = np.stack([synthetic_depth((24, 40), rng) for _ in range(3)])
+    engine = normals.get_engine(dmaps.shape[1:])
+    batch = engine.compute_batch(dmaps, uint8=True)
+    for dmap, norm in zip(dmaps, batch):
+        assert np.array_equal(norm, engine.compute(dmap, uint8=True))
+
+def test_get_engine_is_per_thread():
+    engine = normals.get_engine((8, 8))
+    assert normals.get_engine((8, 8)) is engine
+    other = []
+    thread = threading.Thread(target=lambda: other.append(normals.get_engine((8, 8))))
+    thread.start()
+    thread.join()
+    assert other[0] is not engine
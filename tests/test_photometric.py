@@ -0,0 +1,70 @@
+import os
+import numpy as np
+
+import plan
+import light_passes
+import photometric
+import sensor_params
+
+# smooth bumps in the 0-1 range of the depth maps
+def bumps(shape, rng, count=3):
+    h, w = shape
+    y, x = np.mgrid[0:h, 0:w]
+    dmap = np.zeros(shape, dtype=np.float32)
+    for _ in range(count):
+        cx, cy, r = rng.uniform(0.2 * w, 0.8 * w), rng.uniform(0.2 * h, 0.8 * h), rng.uniform(4, 10)
+        dmap += np.exp(-((x - cx) ** 2 + (y - cy) ** 2) / (2 * r ** 2))
+    return np.clip(dmap / count, 0, 1)
+
+def test_fit_sensor_recovers_response(tmp_path):
+    rng = np.random.default_rng(0)
+    shape = (48, 64)
+    sensor_dir = str(tmp_path / 'sensor_0000')
+    for sub in ['calibration', 'samples', 'raw_data']: os.makedirs(os.path.join(sensor_dir, sub))
+
+    # a flat image that survives the 8 bit round trip and a response that stays unclipped
+    base = light_passes.to_linear(rng.integers(90, 140, shape + (3,)) / 255)
+    response = rng.normal(0, 0.05, (len(photometric.FEATURES), 3)).astype(np.float32)
+    photometric.write_image(os.path.join(sensor_dir, 'calibration', '0000.png'), base)
+    names = ['{0:04}'.format(idx) for idx in range(6)]
+    for name in names:
+        dmap = bumps(shape, rng)
+        np.save(os.path.join(sensor_dir, 'raw_data', name + '.npy'), dmap)
+        photometric.write_image(os.path.join(sensor_dir, 'samples', name + '.png'),
+                                photometric.render(dmap[None], base[None], response[None])[0, 0])
+
+    model = photometric.fit_sensor(sensor_dir, names, stride=1)
+    assert np.allclose(model['base'], base, atol=1e-6)
+    assert np.abs(model['response'] - response).max() < 0.01
+    assert model['rmse'] < 2 / 255
+    assert photometric.evaluate(sensor_dir, model, names) < 1.0
+
+def test_fit_emitters_reproduces_group_models():
+    rng = np.random.default_rng(1)
+    h, w, f = 6, 8, len(photometric.FEATURES)
+    truth = {'ambient': rng.random((h, w, 3)).astype(np.float32),
+             'fields': rng.random((4, h, w)).astype(np.float32),
+             'kappa': rng.normal(0, 0.1, (f, 3)).astype(np.float32),
+             'theta': rng.normal(0, 0.1, (4, f)).astype(np.float32)}
+
+    bank = sensor_params.sample_bank(7, plan.load_config(), rng)
+    bank['light_type'] = 'long'
+    bank['angle'] = 'str'
+    params = [sensor_params.to_params(row) for row in bank]
+    emitters = {photometric.group_key(params[0]): truth}
+    models = [photometric.predict(p, emitters) for p in params[:6]]
+
+    fitted = photometric.fit_emitters(models, params[:6])
+    assert list(fitted) == [photometric.group_key(params[0])]
+    assert fitted[photometric.group_key(params[0])]['sensors'] == 6
+    for p in params:
+        expected, predicted = photometric.predict(p, emitters), photometric.predict(p, fitted)
+        assert np.allclose(predicted['base'], expected['base'], atol=1e-4)
+        assert np.allclose(predicted['response'], expected['response'], atol=1e-4)
+
+def test_fit_emitters_skips_small_groups():
+    rng = np.random.default_rng(2)
+    bank = sensor_params.sample_bank(2, plan.load_config(), rng)
+    params = [sensor_params.to_params(row) for row in bank]
+    models = [{'base': rng.random((4, 4, 3)), 'response': rng.random((len(photometric.FEATURES), 3))} for _ in params]
+    assert photometric.fit_emitters(models, params) == {}
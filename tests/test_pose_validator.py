@@ -0,0 +1,49 @@
+import numpy as np
+
+import plan
+import mesh_utils
+import pose_validator
+
+def test_place_entry_puts_lowest_vertex_at_location():
+    rng = np.random.default_rng(0)
+    vertices = rng.normal(size=(200, 3))
+    max_dim = float((vertices.max(axis=0) - vertices.min(axis=0)).max())
+    entry = {'seed': 3, 'obj': 'blob', 'size': 0.02, 'location': [0.001, -0.002, 0.0008], 'rotation': [0.3, 1.2, 2.5]}
+    world = pose_validator.place_entry(vertices, max_dim, entry)
+
+    assert np.isclose(world[:, 2].min(), -0.0008)
+    low = world[world[:, 2].argmin()]
+    assert np.allclose(low, [0.001, -0.002, -0.0008])
+    extent = (world.max(axis=0) - world.min(axis=0)).max()
+    assert extent <= 0.02 * np.sqrt(3) + 1e-9
+
+def test_place_entry_matches_euler_matrix():
+    vertices = np.array([[0, 0, 0], [1, 0, 0], [0, 1, 0], [0, 0, 1]], dtype=np.float64)
+    entry = {'seed': 0, 'obj': 'tet', 'size': 1.0, 'location': [0, 0, 0], 'rotation': [0.4, 0.1, 0.9]}
+    world = pose_validator.place_entry(vertices, 1.0, entry)
+    rotated = vertices @ mesh_utils.euler_matrix(entry['rotation'])[:3, :3].T
+    assert np.allclose(world - world[0], rotated - rotated[0])
+
+CONFIG = {'OBJ_SIZE_MIN': 0.01, 'OBJ_SIZE_MAX': 0.05, 'X_MIN': -0.005, 'X_MAX': 0.005,
+          'Y_MIN': -0.005, 'Y_MAX': 0.005, 'OBJ_DEPTH_MIN': 0.0006, 'OBJ_DEPTH_MAX': 0.0018}
+
+def test_extend_plan_validates_every_draw(tmp_path):
+    draws = []
+    def reject(entry):
+        draws.append(entry)
+        return False
+
+    samples = plan.extend_plan(str(tmp_path), 3, ['a', 'b'], CONFIG, seed=0, validate=reject, max_tries=4)
+    assert len(draws) == 12
+    assert plan.invalid_samples(samples) == [0, 1, 2]
+    assert plan.invalid_samples(plan.load_plan(str(tmp_path))) == [0, 1, 2]
+
+def test_extend_plan_keeps_accepted_draw(tmp_path):
+    calls = []
+    def accept_second(entry):
+        calls.append(entry['index'])
+        return calls.count(entry['index']) == 2
+
+    samples = plan.extend_plan(str(tmp_path), 2, ['a'], CONFIG, seed=0, validate=accept_second, max_tries=4)
+    assert calls == [0, 0, 1, 1]
+    assert plan.invalid_samples(samples) == []
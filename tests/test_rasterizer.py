@@ -0,0 +1,55 @@
+import numpy as np
+
+import rasterizer
+
+FOV = 40
+LENGTH = 0.0075
+RESOLUTION = (64, 48)
+
+# quad over the whole view, z = z0 + slope * x
+def plane(z0, slope=0.0, extent=4 * LENGTH):
+    xy = np.array([[-extent, -extent], [extent, -extent], [extent, extent], [-extent, extent]])
+    world = np.column_stack((xy, z0 + slope * xy[:, 0]))
+    faces = np.array([[0, 1, 2], [0, 2, 3]])
+    return world, faces
+
+# depth map of a plane z = z0 + slope * x by intersecting every pixel ray
+def plane_depth(z0, slope):
+    w, h = RESOLUTION
+    height = rasterizer.camera_height(FOV, LENGTH)
+    focal = (max(w, h) / 2) / np.tan(np.radians(FOV / 2))
+    s = (np.arange(w) + 0.5 - w / 2) / focal
+    dist = (height + z0) / (1 - slope * s)
+    return np.broadcast_to(np.clip((height - dist) / rasterizer.DEPTH_RANGE, 0, 1), (h, w))
+
+def test_flat_plane():
+    world, faces = plane(-0.001)
+    dmap = rasterizer.rasterize(world, faces, FOV, LENGTH, RESOLUTION)
+    assert dmap.shape == (48, 64)
+    assert np.allclose(dmap, 0.5, atol=1e-5)
+
+def test_tilted_plane_matches_ray_cast():
+    world, faces = plane(-0.001, 0.05)
+    dmap = rasterizer.rasterize(world, faces, FOV, LENGTH, RESOLUTION)
+    assert np.allclose(dmap, plane_depth(-0.001, 0.05), atol=1e-4)
+    assert dmap[:, -1].mean() < dmap[:, 0].mean()
+
+def test_surface_above_gel_leaves_zero():
+    world, faces = plane(0.0005)
+    dmap = rasterizer.rasterize(world, faces, FOV, LENGTH, RESOLUTION)
+    assert not dmap.any()
+
+def test_nearest_surface_wins():
+    shallow, faces = plane(-0.0005)
+    deep, _ = plane(-0.0015, extent=LENGTH / 4)
+    world = np.concatenate((shallow, deep))
+    faces = np.concatenate((faces, faces + 4))
+    dmap = rasterizer.rasterize(world, faces, FOV, LENGTH, RESOLUTION)
+    assert np.isclose(dmap[24, 32], 0.75, atol=1e-5)
+    assert np.isclose(dmap[0, 0], 0.25, atol=1e-5)
+
+def test_small_budget_matches(monkeypatch):
+    world, faces = plane(-0.001, 0.05)
+    full = rasterizer.rasterize(world, faces, FOV, LENGTH, RESOLUTION)
+    monkeypatch.setattr(rasterizer, 'PIXEL_BUDGET', 100)
+    assert np.array_equal(rasterizer.rasterize(world, faces, FOV, LENGTH, RESOLUTION), full)
@@ -0,0 +1,67 @@
+import os
+import numpy as np
+
+import render_cache
+
+def entry_bytes(cache, key):
+    entry = cache.entry_dir(key)
+    return sum(os.path.getsize(os.path.join(entry, name)) for name in os.listdir(entry))
+
+def test_put_then_get(tmp_path):
+    cache = render_cache.RenderCache(str(tmp_path / 'cache'))
+    src = tmp_path / 'image.png'
+    src.write_bytes(b'png bytes')
+    key = render_cache.make_key(obj='teapot', pose=[0.1, 0.2, 0.3])
+
+    out = tmp_path / 'out'
+    out.mkdir()
+    assert not cache.get(key, {'image.png': str(out / 'image.png')})
+    cache.put(key, {'image.png': str(src), 'depth.npy': np.arange(6, dtype=np.float32)})
+    assert cache.get(key, {'image.png': str(out / 'image.png')})
+    assert (out / 'image.png').read_bytes() == b'png bytes'
+    assert np.array_equal(cache.load(key, 'depth.npy'), np.arange(6, dtype=np.float32))
+
+    # a missing file is a miss, as is any other key
+    assert not cache.get(key, {'image.png': str(out / 'a.png'), 'passes.npy': str(out / 'b.npy')})
+    assert not cache.get(render_cache.make_key(obj='teapot', pose=[0.1, 0.2, 0.4]), {'image.png': str(out / 'c.png')})
+    assert cache.size() == entry_bytes(cache, key)
+
+def test_concurrent_put_keeps_the_first_entry(tmp_path, monkeypatch):
+    cache = render_cache.RenderCache(str(tmp_path / 'cache'))
+    other = render_cache.RenderCache(str(tmp_path / 'cache'))
+    key = render_cache.make_key(obj='bowl')
+
+    # another worker renames its entry into place while this one is writing
+    rename = os.rename
+    def racing_rename(src, dst):
+        monkeypatch.setattr(render_cache.os, 'rename', rename)
+        other.put(key, {'depth.npy': np.zeros(4)})
+        rename(src, dst)
+    monkeypatch.setattr(render_cache.os, 'rename', racing_rename)
+    cache.put(key, {'depth.npy': np.ones(4)})
+
+    assert np.array_equal(cache.load(key, 'depth.npy'), np.zeros(4))
+    prefix_dir = os.path.dirname(cache.entry_dir(key))
+    assert os.listdir(prefix_dir) == [key]
+    assert cache.size() == entry_bytes(cache, key)
+
+def test_eviction_removes_least_recently_used_down_to_low_water(tmp_path):
+    data = np.zeros(1000, dtype=np.uint8)
+    cache = render_cache.RenderCache(str(tmp_path / 'cache'))
+    keys = [render_cache.make_key(sample=idx) for idx in range(10)]
+    for idx, key in enumerate(keys):
+        cache.put(key, {'depth.npy': data})
+        os.utime(cache.entry_dir(key), (1000 + idx, 1000 + idx))
+    entry = entry_bytes(cache, keys[0])
+
+    # the oldest entry was just used
+    assert cache.get(keys[0], {'depth.npy': str(tmp_path / 'hit.npy')})
+
+    bounded = render_cache.RenderCache(str(tmp_path / 'cache'), max_bytes=10 * entry)
+    bounded.put(render_cache.make_key(sample=10), {'depth.npy': data})
+    remaining = [key for key in keys if os.path.exists(cache.entry_dir(key))]
+    kept = int(10 * entry * render_cache.LOW_WATER) // entry
+    assert len(remaining) + 1 == kept
+    assert keys[0] in remaining and keys[1] not in remaining
+    assert remaining[1:] == keys[-len(remaining) + 1:]
+    assert bounded.size() == sum(size for _, size, _ in bounded.entries())
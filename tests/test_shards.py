@@ -0,0 +1,62 @@
+import os
+import numpy as np
+import cv2
+import pytest
+
+import plan
+import loader
+import shards
+import sensor_params
+
+def make_renders(root, sensors, samples, rng, start=0):
+    os.makedirs(root, exist_ok=True)
+    if not sensor_params.bank_exists(root):
+        sensor_params.write_bank(root, sensor_params.sample_bank(sensors, plan.load_config(), rng))
+    for sensor_idx in range(sensors):
+        sensor_dir = os.path.join(root, 'sensor_{0:04}'.format(sensor_idx))
+        for sub in ['samples', 'raw_data']: os.makedirs(os.path.join(sensor_dir, sub), exist_ok=True)
+        for sample in range(start, start + samples):
+            name = '{0:04}'.format(sample)
+            cv2.imwrite(os.path.join(sensor_dir, 'samples', name + '.png'), rng.integers(0, 256, (12, 16, 3), dtype=np.uint8))
+            np.save(os.path.join(sensor_dir, 'raw_data', name + '.npy'), rng.random((12, 16)).astype(np.float32))
+
+def by_key(items):
+    return {(item['sensor'], item['sample']): item for item in items}
+
+def test_round_trip_matches_dataset(tmp_path):
+    root = str(tmp_path / 'renders')
+    make_renders(root, 2, 5, np.random.default_rng(0))
+    index = shards.export(root, shard_mb=1, workers=1)
+    assert index['samples'] == 10
+
+    expected = by_key(loader.RenderDataset(root)[idx] for idx in range(10))
+    read = by_key(shards.ShardReader(os.path.join(root, shards.SHARD_DIR), seed=0))
+    assert read.keys() == expected.keys()
+    for key, item in read.items():
+        for component in shards.COMPONENTS:
+            assert np.allclose(item[component], expected[key][component], atol=1), component
+        assert np.array_equal(item['depth'], expected[key]['depth'])
+
+def test_export_appends_new_samples(tmp_path):
+    root = str(tmp_path / 'renders')
+    rng = np.random.default_rng(1)
+    make_renders(root, 1, 3, rng)
+    shards.export(root, shard_mb=1, workers=1)
+    make_renders(root, 1, 2, rng, start=3)
+    index = shards.export(root, shard_mb=1, workers=1)
+
+    assert index['samples'] == 5
+    assert len(index['shards']) == 2
+    samples = sorted(item['sample'] for item in shards.ShardReader(os.path.join(root, shards.SHARD_DIR), components=['depth'], shuffle=False))
+    assert samples == list(range(5))
+
+def test_small_bound_puts_one_sample_per_shard(tmp_path):
+    root = str(tmp_path / 'renders')
+    make_renders(root, 1, 3, np.random.default_rng(2))
+    shards.export_sensor((root, str(tmp_path), 'sensor_0000', None, 0, 5))
+    progress = shards.load_progress(str(tmp_path), 'sensor_0000')
+    assert [len(shard['samples']) for shard in progress['shards']] == [1, 1, 1]
+
+def test_rejects_non_positive_shard_size(tmp_path):
+    with pytest.raises(ValueError):
+        shards.export(str(tmp_path), shard_mb=0)
@@ -0,0 +1,31 @@
+import os
+import threading
+
+import tracing
+import output_writer
+
+def test_write_stage_is_timed_on_the_writer_thread(tmp_path):
+    root = str(tmp_path)
+    tracer = tracing.Tracer(root, worker=0)
+    output = output_writer.OutputWriter(threads=2, sync_every=1)
+    written = []
+    for sample in range(6):
+        with tracer.stage('submit', 0, sample):
+            output.submit(tracer.call, 'write', 0, sample, lambda sample: written.append((sample, threading.get_ident())), sample, key=sample)
+    output.close()
+    tracer.close()
+
+    assert sorted(sample for sample, _ in written) == list(range(6))
+    assert threading.get_ident() not in {ident for _, ident in written}
+    records = tracing.read_records(root)
+    assert sorted(r['sample'] for r in records if r['stage'] == 'write') == list(range(6))
+    assert tracing.summarize(records)['stages']['submit']['count'] == 6
+
+def test_read_records_skips_corrupt_lines(tmp_path):
+    root = str(tmp_path)
+    tracer = tracing.Tracer(root, worker=1)
+    with tracer.stage('render', 0, 0): pass
+    tracer.close()
+    with open(os.path.join(tracing.get_trace_dir(root), 'worker_0001.jsonl'), 'a') as f:
+        f.write('{"stage": \n{"torn": 1')
+    assert [r['stage'] for r in tracing.read_records(root)] == ['render']
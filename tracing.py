@@ -0,0 +1,171 @@
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from contextlib import contextmanager
+import numpy as np
+
+# per-stage timing trace of the generation loop
+# scripting.py wraps every stage in Tracer.stage(), each call appends one record
+#   {"time": ..., "worker": 0, "attempt": 2, "stage": "render", "sensor": 1, "sample": 12, "wall": 3.2, "rss_mb": 812.4, "peak_rss_mb": 830.1}
+# to <render_dir>/trace/worker_XXXX.jsonl, attempts of a run share the file
+#
+#   python tracing.py              # per-stage percentiles and throughput of a run
+
+TRACE_DIR = 'trace'
+
+
+def get_trace_dir(render_dir) -> str:
+    return os.path.join(render_dir, TRACE_DIR)
+
+# current resident set size of this process in mb, None where /proc is missing
+
+def rss_mb():
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            pages = int(f.read().split()[1])
+        return round(pages * os.sysconf('SC_PAGE_SIZE') / 2**20, 1)
+    except (OSError, ValueError, IndexError):
+        return None
+
+# peak resident set size of this process in mb, ru_maxrss is in bytes on macos
+
+def peak_rss_mb() -> float:
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (2**20 if sys.platform == 'darwin' else 2**10), 1)
+
+class Tracer():
+    def __init__(self, render_dir, worker=0, attempt=1, enabled=True):
+        self.worker = worker
+        self.attempt = attempt
+        self.enabled = enabled
+        self.file = None
+        # stages of background writes are recorded from the writer threads
+        self.lock = threading.Lock()
+        if not enabled: return
+
+        trace_dir = get_trace_dir(render_dir)
+        os.makedirs(trace_dir, exist_ok=True)
+        self.file = open(os.path.join(trace_dir, 'worker_{0:04}.jsonl'.format(worker)), 'a')
+
+    # times the enclosed block and appends its record
+
+    @contextmanager
+    def stage(self, stage, sensor=None, sample=None):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.write(stage, time.perf_counter() - start, sensor, sample)
+
+    # runs fn(*args, **kwargs) as a timed stage, for work handed to other threads
+
+    def call(self, stage, sensor, sample, fn, *args, **kwargs):
+        with self.stage(stage, sensor, sample):
+            return fn(*args, **kwargs)
+
+    def write(self, stage, wall, sensor=None, sample=None) -> None:
+        record = {'time': time.time(),
+                  'worker': self.worker,
+                  'attempt': self.attempt,
+                  'stage': stage,
+                  'sensor': sensor,
+                  'sample': sample,
+                  'wall': wall,
+                  'rss_mb': rss_mb(),
+                  'peak_rss_mb': peak_rss_mb()}
+        with self.lock:
+            self.file.write(json.dumps(record) + '\n')
+            self.file.flush()
+
+    def close(self) -> None:
+        if self.file is not None: self.file.close()
+
+# records of all trace files, a torn or corrupt line is skipped
+
+def read_records(render_dir) -> list:
+    records = []
+    trace_dir = get_trace_dir(render_dir)
+    if not os.path.isdir(trace_dir): return records
+    for name in sorted(os.listdir(trace_dir)):
+        if not name.endswith('.jsonl'): continue
+        with open(os.path.join(trace_dir, name), 'r') as f:
+            for line in f:
+                if not line.endswith('\n'): break
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+    return records
+
+# per-stage wall time statistics and per-attempt throughput
+
+# returns: {'stages': {stage: stats}, 'attempts': {worker/attempt: stats}}
+
+def summarize(records) -> dict:
+    stages = {}
+    for record in records:
+        stages.setdefault(record['stage'], []).append(record['wall'])
+
+    stage_stats = {}
+    for stage, walls in stages.items():
+        walls = np.array(walls)
+        stage_stats[stage] = {'count': int(len(walls)),
+                              'total': float(walls.sum()),
+                              'mean': float(walls.mean()),
+                              'p50': float(np.percentile(walls, 50)),
+                              'p90': float(np.percentile(walls, 90)),
+                              'p99': float(np.percentile(walls, 99)),
+                              'max': float(walls.max())}
+
+    attempts = {}
+    for record in records:
+        key = f"{record['worker']}/{record['attempt']}"
+        entry = attempts.setdefault(key, {'start': record['time'] - record['wall'], 'end': record['time'], 'samples': 0, 'calibrations': 0, 'max_rss_mb': None, 'peak_rss_mb': None})
+        entry['start'] = min(entry['start'], record['time'] - record['wall'])
+        entry['end'] = max(entry['end'], record['time'])
+        for field in ('max_rss_mb', 'peak_rss_mb'):
+            value = record.get('rss_mb' if field == 'max_rss_mb' else field)
+            if value is not None: entry[field] = value if entry[field] is None else max(entry[field], value)
+        if record['stage'] == 'sample': entry['samples'] += 1
+        if record['stage'] == 'calibration': entry['calibrations'] += 1
+    for entry in attempts.values():
+        elapsed = entry['end'] - entry['start']
+        entry['elapsed'] = elapsed
+        entry['samples_per_hour'] = entry['samples'] / elapsed * 3600 if elapsed > 0 else 0.0
+
+    return {'stages': stage_stats, 'attempts': attempts}
+
+def print_summary(summary) -> None:
+    print(f"{'stage':<14} {'count':>8} {'total s':>10} {'mean s':>9} {'p50 s':>9} {'p90 s':>9} {'p99 s':>9} {'max s':>9}")
+    stages = sorted(summary['stages'].items(), key=lambda item: -item[1]['total'])
+    for stage, s in stages:
+        print(f"{stage:<14} {s['count']:>8} {s['total']:>10.1f} {s['mean']:>9.3f} {s['p50']:>9.3f} {s['p90']:>9.3f} {s['p99']:>9.3f} {s['max']:>9.3f}")
+    print()
+    print(f"{'worker/attempt':<14} {'elapsed s':>10} {'samples':>8} {'calib':>6} {'samples/h':>10} {'max rss mb':>11} {'peak rss mb':>12}")
+    for key, a in sorted(summary['attempts'].items()):
+        rss = '-' if a['max_rss_mb'] is None else f"{a['max_rss_mb']:.1f}"
+        peak = '-' if a['peak_rss_mb'] is None else f"{a['peak_rss_mb']:.1f}"
+        print(f"{key:<14} {a['elapsed']:>10.1f} {a['samples']:>8} {a['calibrations']:>6} {a['samples_per_hour']:>10.1f} {rss:>11} {peak:>12}")
+
+
+if __name__ == '__main__':
+    root_dir = os.environ.get('GELSIGHT_RENDER_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'renders'))
+
+    parser = argparse.ArgumentParser(description='Summarize the per-stage timing trace of a generation run.')
+    parser.add_argument('--root', default=root_dir, help='render directory (default: GELSIGHT_RENDER_DIR or <repo>/renders)')
+    parser.add_argument('--json', action='store_true', help='print the summary as json')
+    args = parser.parse_args()
+
+    records = read_records(args.root)
+    assert len(records) > 0, f"No trace records found in {get_trace_dir(args.root)}"
+    summary = summarize(records)
+    if args.json: print(json.dumps(summary, indent=1))
+    else: print_summary(summary)
+    sys.exit(0)
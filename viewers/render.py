@@ -3,36 +3,99 @@ from dash import Dash, dcc, html, Input, Output
 import numpy as np
 from PIL import Image
 import os
-import base64
+from functools import lru_cache
+
+import thumbnails
 
 app = Dash(__name__)
 
+# default preview downsampling and number of figures kept for paging
+PREVIEW_STEP = int(os.environ.get('GELSIGHT_PREVIEW_STEP', '4'))
+FIGURE_CACHE_SIZE = 32
+THUMB_HEIGHT = 200
+
 def get_renders_dir():
     repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     renders_dir = os.environ.get('GELSIGHT_RENDER_DIR', os.path.join(repo_dir, 'renders'))
     return renders_dir
 
-def list_sensor_dirs(renders_dir):
-    entries = os.listdir(renders_dir)
-    sensor_dirs = [d for d in entries if d.startswith('sensor_') and os.path.isdir(os.path.join(renders_dir, d))]
-    sensor_dirs.sort()
-    return sensor_dirs
+thumbnails.register_route(app, get_renders_dir)
 
 def get_image_components(render_idx):
     renders_dir = get_renders_dir()
-    sensor_dirs = list_sensor_dirs(renders_dir)
+    sensor_dirs = cached_sensor_dirs(renders_dir)
     # Fail fast if no sensors
     assert len(sensor_dirs) > 0, f"No sensors found in {renders_dir}"
-    image_components = []
+    name = '{0:04}'.format(render_idx)
     for sensor in sensor_dirs:
-        img_path = os.path.join(renders_dir, sensor, 'samples', '{0:04}.png'.format(render_idx))
+        img_path = thumbnails.source_path(renders_dir, sensor, name)
         assert os.path.exists(img_path), f"Missing sample image: {img_path}"
-        with open(img_path, 'rb') as f:
-            b64 = base64.b64encode(f.read()).decode('ascii')
-        data_uri = 'data:image/png;base64,' + b64
-        image_components.append(html.Img(src=data_uri, style={'height': '200px', 'width': 'auto', 'margin': '3px'}, title=sensor))
+    thumbnails.ensure_thumbnails(renders_dir, [(sensor, name) for sensor in sensor_dirs], THUMB_HEIGHT)
+
+    image_components = []
+    for sensor in sensor_dirs:
+        src = thumbnails.thumbnail_url(renders_dir, sensor, name, THUMB_HEIGHT)
+        image_components.append(html.Img(src=src, style={'height': '200px', 'width': 'auto', 'margin': '3px'}, title=sensor))
     return image_components
 
+# directory listings, re-read only when the directory's mtime changes
+
+@lru_cache(maxsize=64)
+def _listdir(path, mtime):
+    return sorted(os.listdir(path))
+
+def cached_sensor_dirs(renders_dir):
+    entries = _listdir(renders_dir, os.path.getmtime(renders_dir))
+    return [d for d in entries if d.startswith('sensor_') and os.path.isdir(os.path.join(renders_dir, d))]
+
+def list_samples(samples_dir):
+    return [f for f in _listdir(samples_dir, os.path.getmtime(samples_dir)) if f.endswith('.png')]
+
+# builds the 3D preview of a depth map without per-pixel python loops
+
+# dmap: (h, w) depth map, negative values are clamped to 0
+# step: keep every step-th pixel along both axes
+# trace: 'scatter' for a point cloud, 'surface' for a heightmap
+
+def build_figure(dmap, step=PREVIEW_STEP, trace='scatter'):
+    height, width = dmap.shape
+    zs = np.maximum(dmap[::step, ::step], 0) * 5
+    xs = width - np.arange(0, width, step)
+    ys = np.arange(0, height, step)
+
+    if trace == 'surface':
+        data = go.Surface(x=xs, y=ys, z=zs, cmin=0, cmax=3, colorscale='Viridis', showscale=False)
+    else:
+        grid_x, grid_y = np.meshgrid(xs, ys)
+        data = go.Scatter3d(x=grid_x.ravel(), 
+                            y=grid_y.ravel(), 
+                            z=zs.ravel(), 
+                            mode='markers', 
+                            marker=dict(size=1.5 * step,
+                                        cmax=3,
+                                        cmin=0, 
+                                        color=zs.ravel(), 
+                                        colorscale='Viridis', 
+                                        opacity=1.0))
+    fig = go.Figure(data=[data])
+    
+    fig.update_layout(scene = dict(xaxis = dict(tickmode="array", tickvals=[], range=[0,width], backgroundcolor="rgba(0, 0, 0, 0)", title=dict(text="")),
+                                   yaxis = dict(tickmode="array", tickvals=[], range=[0,height], backgroundcolor="rgba(0, 0, 0, 0)", title=dict(text="")),
+                                   zaxis = dict(tickmode="array", tickvals=[], range=[0,5], backgroundcolor="rgba(0, 0, 0, 0)", title=dict(text="")),
+                                   
+                                   aspectmode='manual', 
+                                   aspectratio=dict(x=1, y=1, z=0.25),
+                                   camera = dict(eye=dict(x=0, y=0, z=1.2), 
+                                                 up=dict(x=0, y=0, z=0))),
+                      margin=dict(l=0, r=0, b=0, t=0),)
+    return fig
+
+# built figures, keyed by depth map path and mtime so re-renders are picked up
+
+@lru_cache(maxsize=FIGURE_CACHE_SIZE)
+def load_figure(dmap_path, mtime, step, trace):
+    return build_figure(np.load(dmap_path), step, trace)
+
 app.layout = html.Div([
     html.H2("Render Preview",  style={'textAlign': 'center', "font-family": "Arial"}),
     
@@ -41,6 +104,12 @@ app.layout = html.Div([
     html.Div([html.Button('Back', id='prev', n_clicks=0,),
               html.Button('Next', id='next', n_clicks=0),], 
              style={'textAlign': 'center'}),
+
+    html.Div([dcc.RadioItems(id='trace', options=[{'label': 'points', 'value': 'scatter'}, {'label': 'surface', 'value': 'surface'}],
+                             value='scatter', inline=True),
+              dcc.Dropdown(id='step', options=[{'label': f'1/{step}', 'value': step} for step in [1, 2, 4, 8, 16]],
+                           value=PREVIEW_STEP, clearable=False, style={'width': '100px', 'margin': 'auto'})],
+             style={'textAlign': 'center', "font-family": "Arial"}),
     
     html.Br(),
     
@@ -52,52 +121,22 @@ app.layout = html.Div([
     Output('image-container', 'children'),
     Input('next', 'n_clicks'), 
     Input('prev', 'n_clicks'),
+    Input('step', 'value'),
+    Input('trace', 'value'),
 )
 
-def update_graph(next_clicks, back_click):
+def update_graph(next_clicks, back_click, step, trace):
     renders_dir = get_renders_dir()
-    sensor_dirs = list_sensor_dirs(renders_dir)
+    sensor_dirs = cached_sensor_dirs(renders_dir)
     assert len(sensor_dirs) > 0, f"No sensors found in {renders_dir}"
     first_sensor = sensor_dirs[0]
     samples_dir = os.path.join(renders_dir, first_sensor, 'samples')
-    sample_files = [f for f in os.listdir(samples_dir) if f.endswith('.png')]
-    sample_files.sort()
+    sample_files = list_samples(samples_dir)
     assert len(sample_files) > 0, f"No samples found in {samples_dir}"
     render_idx = (next_clicks - back_click) % len(sample_files)
 
     dmap_path = os.path.join(renders_dir, first_sensor, 'raw_data', '{0:04}.npy'.format(render_idx))
-    dmap = np.load(dmap_path)
-    xs = []
-    ys = []
-    zs = []
-    height, width = dmap.shape
-    for y in range(height):
-        for x in range(width):
-            xs.append(width - x)
-            ys.append(y)
-            if dmap[y][x] < 0: dmap[y][x] = 0
-            zs.append(dmap[y][x] * 5)
-
-    fig = go.Figure(data=[go.Scatter3d(x=xs, 
-                                       y=ys, 
-                                       z=zs, 
-                                       mode='markers', 
-                                       marker=dict(size=1.5,
-                                                   cmax=3,
-                                                   cmin=0, 
-                                                   color=zs, 
-                                                   colorscale='Viridis', 
-                                                   opacity=1.0))])
-    
-    fig.update_layout(scene = dict(xaxis = dict(tickmode="array", tickvals=[], range=[0,width], backgroundcolor="rgba(0, 0, 0, 0)", title=dict(text="")),
-                                   yaxis = dict(tickmode="array", tickvals=[], range=[0,height], backgroundcolor="rgba(0, 0, 0, 0)", title=dict(text="")),
-                                   zaxis = dict(tickmode="array", tickvals=[], range=[0,5], backgroundcolor="rgba(0, 0, 0, 0)", title=dict(text="")),
-                                   
-                                   aspectmode='manual', 
-                                   aspectratio=dict(x=1, y=1, z=0.25),
-                                   camera = dict(eye=dict(x=0, y=0, z=1.2), 
-                                                 up=dict(x=0, y=0, z=0))),
-                      margin=dict(l=0, r=0, b=0, t=0),)
+    fig = load_figure(dmap_path, os.path.getmtime(dmap_path), step, trace)
 
     image_components = get_image_components(render_idx)
     return fig, image_components
@@ -3,7 +3,12 @@ from dash import Dash, dcc, html, Input, Output
 import numpy as np
 from PIL import Image
 import os
-import base64
+
+import thumbnails
+
+# samples per gallery page and stored thumbnail height in pixels
+PAGE_SIZE = 60
+THUMB_HEIGHT = 100
 
 def get_renders_dir():
     repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -16,22 +21,27 @@ def list_sensor_dirs(renders_dir):
     sensor_dirs.sort()
     return sensor_dirs
 
-def get_image_components(sensor_id):
+def get_image_components(sensor_id, page=0):
     renders_dir = get_renders_dir()
-    sensor_dir = os.path.join(renders_dir, 'sensor_{0:04}'.format(sensor_id), 'samples')
+    sensor = 'sensor_{0:04}'.format(sensor_id)
+    sensor_dir = os.path.join(renders_dir, sensor, 'samples')
     assert os.path.isdir(sensor_dir), f"Missing sensor samples directory: {sensor_dir}"
     sample_files = [f for f in os.listdir(sensor_dir) if f.endswith('.png')]
     sample_files.sort()
+
+    num_pages = max(1, -(-len(sample_files) // PAGE_SIZE))
+    page = page % num_pages
+    names = [f[:-4] for f in sample_files[page * PAGE_SIZE:(page + 1) * PAGE_SIZE]]
+    thumbnails.ensure_thumbnails(renders_dir, [(sensor, name) for name in names], THUMB_HEIGHT)
+
     image_components = []
-    for name in sample_files:
-        img_path = os.path.join(sensor_dir, name)
-        with open(img_path, 'rb') as f:
-            b64 = base64.b64encode(f.read()).decode('ascii')
-        data_uri = 'data:image/png;base64,' + b64
-        image_components.append(html.Img(src=data_uri, style={'height': '100px', 'width': 'auto', 'margin': '2px'}, title=name))
-    return image_components
+    for name in names:
+        src = thumbnails.thumbnail_url(renders_dir, sensor, name, THUMB_HEIGHT)
+        image_components.append(html.Img(src=src, style={'height': '100px', 'width': 'auto', 'margin': '2px'}, title=name + '.png'))
+    return image_components, f'{sensor} page {page + 1}/{num_pages} ({len(sample_files)} samples)'
 
 app = Dash(__name__)
+thumbnails.register_route(app, get_renders_dir)
 
 app.layout = html.Div([
     html.H2("Sensor Preview",  style={'textAlign': 'center', "font-family": "Arial"}),
@@ -39,6 +49,11 @@ app.layout = html.Div([
     html.Div([html.Button('Back', id='back-button', n_clicks=0),
               html.Button('Next', id='next-button', n_clicks=0)],
              style={'textAlign': 'center'}),
+
+    html.Div([html.Button('Previous page', id='prev-page', n_clicks=0),
+              html.Span(id='page-label', style={'margin': '0 10px', "font-family": "Arial"}),
+              html.Button('Next page', id='next-page', n_clicks=0)],
+             style={'textAlign': 'center', 'margin-top': '5px'}),
     
     html.Br(),
     
@@ -47,17 +62,20 @@ app.layout = html.Div([
 
 @app.callback(
     Output('image-container', 'children'),
+    Output('page-label', 'children'),
     Input('next-button', 'n_clicks'),
     Input('back-button', 'n_clicks'),
+    Input('next-page', 'n_clicks'),
+    Input('prev-page', 'n_clicks'),
 )
 
-def update_graph(next_clicks, back_click):
+def update_graph(next_clicks, back_click, next_page, prev_page):
     renders_dir = get_renders_dir()
     sensors = list_sensor_dirs(renders_dir)
     assert len(sensors) > 0, f"No sensors found in {renders_dir}"
     sensor_id = (next_clicks - back_click) % len(sensors)
-    image_components = get_image_components(sensor_id)
-    return image_components
+    image_components, label = get_image_components(sensor_id, next_page - prev_page)
+    return image_components, label
 
 if __name__ == '__main__':
     app.run(port=8060, debug=True)
\ No newline at end of file
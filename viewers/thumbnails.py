@@ -0,0 +1,60 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from flask import send_file, abort
+
+# downscaled copies of sensor renders, generated once and served as static urls
+# thumbnails live in <renders>/.thumbs/<height>/<sensor>/<name>.jpg and are
+# regenerated whenever the source png is newer
+
+THUMBS_NAME = '.thumbs'
+ROUTE = '/thumbs'
+THREADS = os.cpu_count() or 4
+
+
+def thumbnail_path(renders_dir, sensor, name, height) -> str:
+    return os.path.join(renders_dir, THUMBS_NAME, str(height), sensor, name + '.jpg')
+
+def source_path(renders_dir, sensor, name) -> str:
+    return os.path.join(renders_dir, sensor, 'samples', name + '.png')
+
+# writes the thumbnail of src unless an up to date one exists
+
+def ensure_thumbnail(src, dst, height) -> str:
+    if os.path.exists(dst) and os.path.getmtime(dst) >= os.path.getmtime(src): return dst
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    with Image.open(src) as img:
+        img = img.convert('RGB')
+        if img.height > height:
+            width = max(1, round(img.width * height / img.height))
+            img = img.resize((width, height), Image.BILINEAR)
+        tmp = f'{dst}.{os.getpid()}.{threading.get_ident()}.tmp'
+        img.save(tmp, 'JPEG', quality=85)
+    os.replace(tmp, dst)
+    return dst
+
+# generates thumbnails of (sensor, name) pairs in parallel
+
+def ensure_thumbnails(renders_dir, items, height) -> None:
+    jobs = [(source_path(renders_dir, sensor, name), thumbnail_path(renders_dir, sensor, name, height)) for sensor, name in items]
+    with ThreadPoolExecutor(max_workers=THREADS) as pool:
+        list(pool.map(lambda job: ensure_thumbnail(job[0], job[1], height), jobs))
+
+# url of a thumbnail, the source mtime busts browser caches after a re-render
+
+def thumbnail_url(renders_dir, sensor, name, height) -> str:
+    mtime = int(os.path.getmtime(source_path(renders_dir, sensor, name)))
+    return f'{ROUTE}/{height}/{sensor}/{name}.jpg?v={mtime}'
+
+# serves thumbnails from the dash app's flask server, generating missing ones
+
+def register_route(app, get_renders_dir) -> None:
+    @app.server.route(ROUTE + '/<int:height>/<sensor>/<name>.jpg')
+    def serve_thumbnail(height, sensor, name):
+        if not sensor.startswith('sensor_') or not name.isdigit() or height > 1024: abort(404)
+        renders_dir = get_renders_dir()
+        src = source_path(renders_dir, sensor, name)
+        if not os.path.exists(src): abort(404)
+        dst = ensure_thumbnail(src, thumbnail_path(renders_dir, sensor, name, height), height)
+        return send_file(dst, mimetype='image/jpeg', max_age=86400)